@@ -0,0 +1,45 @@
+-- Secondary indexes, on top of the primary keys in TableCreation.sql.
+--
+-- Scripts/Index_Management.py reads this file: it creates missing indexes
+-- CONCURRENTLY and, during a full rebuild, drops the ones under
+-- "Deferred during full rebuilds" and recreates them once the load is done.
+-- Keep one CREATE INDEX IF NOT EXISTS statement per index, ending with a
+-- semicolon. Run it directly (psql -f) on a fresh database.
+--
+-- Primary keys cannot be deferred: the loader's ON CONFLICT upserts and
+-- the price history diff depend on them.
+
+BEGIN;
+
+-- Kept during bulk loads
+
+-- Per-reload DELETE FROM standard_charges / payer_charges WHERE hospital_name = ...
+-- and the price history and summary refreshes for one hospital
+CREATE INDEX IF NOT EXISTS standard_charges_hospital
+  ON standard_charges (hospital_name);
+
+CREATE INDEX IF NOT EXISTS payer_charges_hospital
+  ON payer_charges (hospital_name, service_id);
+
+CREATE INDEX IF NOT EXISTS service_description_aliases_hospital
+  ON service_description_aliases (hospital_name);
+
+-- Deferred during full rebuilds
+
+-- Lookups by code (comparison queries and price summaries)
+CREATE INDEX IF NOT EXISTS services_code_type
+  ON services (code, type, setting);
+
+-- Comparisons by payer across hospitals
+CREATE INDEX IF NOT EXISTS payer_charges_payer
+  ON payer_charges (payer_name, service_id)
+  INCLUDE (standard_charge_negotiated_dollar);
+
+-- Description search: fuzzy (word_similarity, <%) and full text (@@)
+CREATE INDEX IF NOT EXISTS service_description_aliases_trigram
+  ON service_description_aliases USING gin (description gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS service_description_aliases_search
+  ON service_description_aliases USING gin (search);
+
+COMMIT;
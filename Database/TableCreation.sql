@@ -1,3 +1,4 @@
+-- Secondary indexes are in Indexes.sql; run it after this file.
 BEGIN;
 
 CREATE TYPE setting_enum AS ENUM ('Inpatient', 'Outpatient');
@@ -54,10 +55,135 @@ CREATE TABLE "payer_charges" (
   PRIMARY KEY ("service_id", "hospital_name", "payer_name", "plan_name")
 );
 
+-- Price history: one row per distinct price per validity range. A row is only
+-- written when a reload changes a price, so storage grows with churn rather
+-- than with the number of snapshots. valid_to = 'infinity' marks the current
+-- version.
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE TABLE "standard_charges_history" (
+  "service_id" varchar(64) REFERENCES services(service_id),
+  "hospital_name" text REFERENCES hospitals(hospital_name),
+  "valid_from" date NOT NULL,
+  "valid_to" date NOT NULL DEFAULT 'infinity',
+  "standard_charge_gross" numeric(12, 2),
+  "standard_charge_discounted_cash" numeric(12, 2),
+  "standard_charge_min" numeric(12, 2),
+  "standard_charge_max" numeric(12, 2),
+  PRIMARY KEY ("service_id", "hospital_name", "valid_from")
+);
+
+CREATE TABLE "payer_charges_history" (
+  "service_id" varchar(64) REFERENCES services(service_id),
+  "hospital_name" text REFERENCES hospitals(hospital_name),
+  "payer_name" text,
+  "plan_name" text,
+  "valid_from" date NOT NULL,
+  "valid_to" date NOT NULL DEFAULT 'infinity',
+  "standard_charge_negotiated_dollar" numeric(12, 2),
+  "standard_charge_negotiated_algorithm" text,
+  "standard_charge_negotiated_percent" float,
+  "estimated_amount" numeric(12, 2),
+  "median_amount" numeric(12,2),
+  "tenth_percentile_amount" numeric(12,2),
+  "ninetieth_percentile_amount" numeric(12,2),
+  "count_amounts" text,
+  "standard_charge_methodology" text,
+  "additional_generic_notes" text,
+  PRIMARY KEY ("service_id", "hospital_name", "payer_name", "plan_name", "valid_from")
+);
+
+-- Current versions, used when diffing a reload against history
+CREATE UNIQUE INDEX standard_charges_history_current
+  ON standard_charges_history (service_id, hospital_name)
+  WHERE valid_to = 'infinity';
+
+CREATE UNIQUE INDEX payer_charges_history_current
+  ON payer_charges_history (service_id, hospital_name, payer_name, plan_name)
+  WHERE valid_to = 'infinity';
+
+-- Point-in-time lookups: daterange(valid_from, valid_to) @> date
+CREATE INDEX standard_charges_history_as_of
+  ON standard_charges_history USING gist (hospital_name, daterange(valid_from, valid_to));
+
+CREATE INDEX payer_charges_history_as_of
+  ON payer_charges_history USING gist (hospital_name, daterange(valid_from, valid_to));
+
+-- Price summaries: the distribution of negotiated dollar amounts across
+-- hospitals, per service and per service and payer. Refreshed by the ETL
+-- for the keys the reloaded hospital touches (see Price_Summaries.py).
+CREATE TABLE "service_price_summary" (
+  "code" text,
+  "type" service_type_enum,
+  "setting" setting_enum,
+  "min_price" numeric(12, 2),
+  "p10_price" numeric(12, 2),
+  "median_price" numeric(12, 2),
+  "p90_price" numeric(12, 2),
+  "max_price" numeric(12, 2),
+  "hospital_count" integer,
+  "rate_count" integer,
+  "refreshed_at" timestamptz,
+  PRIMARY KEY ("code", "type", "setting")
+);
+
+CREATE TABLE "payer_price_summary" (
+  "code" text,
+  "type" service_type_enum,
+  "setting" setting_enum,
+  "payer_name" text,
+  "min_price" numeric(12, 2),
+  "p10_price" numeric(12, 2),
+  "median_price" numeric(12, 2),
+  "p90_price" numeric(12, 2),
+  "max_price" numeric(12, 2),
+  "hospital_count" integer,
+  "rate_count" integer,
+  "refreshed_at" timestamptz,
+  PRIMARY KEY ("code", "type", "setting", "payer_name")
+);
+
+-- Which summary keys each hospital contributes to, so a reload can
+-- recompute the ones it no longer prices too
+CREATE TABLE "price_summary_members" (
+  "hospital_name" text REFERENCES hospitals(hospital_name),
+  "code" text,
+  "type" service_type_enum,
+  "setting" setting_enum,
+  "payer_name" text,
+  PRIMARY KEY ("hospital_name", "code", "type", "setting", "payer_name")
+);
+
+CREATE INDEX payer_price_summary_payer
+  ON payer_price_summary (payer_name, code, type, setting);
+
+-- Every description each hospital publishes for a service. services keeps
+-- only the first one seen; searches run over all of them (see the trigram
+-- and full-text indexes in Indexes.sql). The primary key holds an md5 of
+-- the description, not the text: a long multi-byte description can exceed
+-- the btree row size limit. Descriptions are cut to 1000 characters on load
+-- to bound the search indexes.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE "service_description_aliases" (
+  "service_id" varchar(64) REFERENCES services(service_id),
+  "hospital_name" text REFERENCES hospitals(hospital_name),
+  "description" text NOT NULL,
+  "description_md5" uuid GENERATED ALWAYS AS (md5(description)::uuid) STORED,
+  "search" tsvector GENERATED ALWAYS AS (to_tsvector('english'::regconfig, description)) STORED,
+  PRIMARY KEY ("service_id", "hospital_name", "description_md5")
+);
+
 
 GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE services TO appuser;
 GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE standard_charges TO appuser;
 GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE payer_charges TO appuser;
 GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE hospitals TO appuser;
+GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE standard_charges_history TO appuser;
+GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE payer_charges_history TO appuser;
+GRANT SELECT, INSERT, UPDATE, DELETE, TRUNCATE ON TABLE service_price_summary TO appuser;
+GRANT SELECT, INSERT, UPDATE, DELETE, TRUNCATE ON TABLE payer_price_summary TO appuser;
+GRANT SELECT, INSERT, UPDATE, DELETE, TRUNCATE ON TABLE price_summary_members TO appuser;
+GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE service_description_aliases TO appuser;
 
 COMMIT;
\ No newline at end of file
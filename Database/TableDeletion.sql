@@ -1,5 +1,11 @@
 BEGIN;
 
+DROP TABLE service_description_aliases;
+DROP TABLE price_summary_members;
+DROP TABLE payer_price_summary;
+DROP TABLE service_price_summary;
+DROP TABLE payer_charges_history;
+DROP TABLE standard_charges_history;
 DROP TABLE payer_charges;
 DROP TABLE standard_charges;
 DROP TABLE hospitals;
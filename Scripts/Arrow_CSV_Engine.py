@@ -0,0 +1,212 @@
+import sys
+import time
+from typing import Iterator, Tuple
+
+import numpy
+import pandas
+import pyarrow
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+from Code_Filter import CODE_FILTER, CodeFilter
+from CSV_Reader import DECODE_ERRORS
+
+
+_STRING = pyarrow.string()
+_DICTIONARY = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+
+
+def _per_row(array: pyarrow.Array, kernel) -> pyarrow.Array:
+    """
+    Apply a compute kernel to a column. For dictionary columns the kernel
+    only runs over the distinct values and the result is gathered per row.
+    """
+    if pyarrow.types.is_dictionary(array.type):
+        return kernel(array.dictionary).take(array.indices)
+    return kernel(array)
+
+
+def _normalize_codes(values: pyarrow.Array) -> pyarrow.Array:
+    return pc.utf8_upper(pc.utf8_trim_whitespace(values))
+
+
+def _normalize_settings(values: pyarrow.Array) -> pyarrow.Array:
+    """Arrow counterpart of HospitalChargeETLCSV._normalize_setting"""
+    lowered = pc.utf8_lower(pc.utf8_trim_whitespace(values))
+    normalized = pc.if_else(
+        pc.match_substring(lowered, 'inpatient'), 'Inpatient', pc.if_else(
+            pc.match_substring(lowered, 'outpatient'), 'Outpatient', pc.if_else(
+                pc.match_substring(lowered, 'both'), 'Both', pc.utf8_capitalize(values))))
+    return pc.if_else(pc.equal(values, ''), pyarrow.scalar(None, _STRING), normalized)
+
+
+class ArrowChargeFilter:
+    """
+    Filters the charge rows of a hospital CSV with Arrow compute kernels.
+
+    Rows are parsed by the multithreaded Arrow CSV reader into string and
+    dictionary arrays, and code matching, setting normalization and the
+    Both-row expansion all run on those arrays. Only the kept rows are
+    converted to a pandas frame (and so to Python objects) for loading.
+    """
+
+    # Low-cardinality columns read as dictionary arrays
+    DICTIONARY_KEYS = ['setting', 'payer_name', 'plan_name', 'modifiers', 'methodology', 'negotiated_algorithm']
+
+    def __init__(self, column_mapping: dict, code_filter: CodeFilter = CODE_FILTER):
+        self.column_mapping = column_mapping
+        self.code_filter = code_filter
+
+        self._whitelisted_types = pyarrow.array(sorted({t for t, _ in code_filter.allowed_pairs}))
+        self._allowed_codes = pyarrow.array(sorted({c for _, c in code_filter.allowed_pairs}))
+        self._any_code_types = pyarrow.array(sorted(code_filter.any_code_types))
+
+    def column_types(self, columns: list[str]) -> dict:
+        dictionary_columns = set(self.column_mapping['type_columns'])
+        dictionary_columns.update(self.column_mapping[key] for key in self.DICTIONARY_KEYS if self.column_mapping.get(key))
+        return {col: _DICTIONARY if col in dictionary_columns else _STRING for col in columns}
+
+    def filter_batches(self, batches: Iterator[pyarrow.RecordBatch]) -> Iterator[Tuple[int, int, pandas.DataFrame]]:
+        """
+        :return: (rows read, rows kept before Both expansion, kept rows as a DataFrame) per batch
+        """
+        for batch in batches:
+            matched, codes, types = self._first_match(batch)
+            kept = batch.filter(matched)
+            kept_rows = kept.num_rows
+
+            table = pyarrow.Table.from_batches([kept])
+            table = table.append_column('_matched_code', codes.filter(matched))
+            table = table.append_column('_matched_type', types.filter(matched))
+
+            setting_col = self.column_mapping['setting']
+            if kept_rows and setting_col in table.column_names:
+                index = table.column_names.index(setting_col)
+                settings = _per_row(table.column(index).combine_chunks(), _normalize_settings)
+                table = table.set_column(index, setting_col, settings)
+                table = self._expand_both_settings(table, index)
+
+            yield batch.num_rows, kept_rows, self._to_pandas(table)
+
+    def _first_match(self, batch: pyarrow.RecordBatch) -> Tuple[pyarrow.Array, pyarrow.Array, pyarrow.Array]:
+        names = batch.schema.names
+        matched = pyarrow.array(numpy.zeros(batch.num_rows, dtype=bool))
+        codes = pyarrow.nulls(batch.num_rows, _STRING)
+        types = pyarrow.nulls(batch.num_rows, _STRING)
+
+        pairs = [(c, t) for c, t in zip(self.column_mapping['code_columns'], self.column_mapping['type_columns'])
+                 if c in names and t in names]
+
+        # Walk the columns backwards so the first matching column wins
+        for code_col, type_col in reversed(pairs):
+            code = _per_row(batch.column(code_col), _normalize_codes)
+            code_type = _per_row(batch.column(type_col), _normalize_codes)
+
+            hit = pc.or_(
+                pc.is_in(code_type, value_set=self._any_code_types),
+                pc.and_(pc.is_in(code_type, value_set=self._whitelisted_types),
+                        pc.is_in(code, value_set=self._allowed_codes)))
+
+            codes = pc.if_else(hit, code, codes)
+            types = pc.if_else(hit, code_type, types)
+            matched = pc.or_(matched, hit)
+
+        return matched, codes, types
+
+    def _expand_both_settings(self, table: pyarrow.Table, index: int) -> pyarrow.Table:
+        settings = table.column(index)
+        both = pc.fill_null(pc.equal(settings, 'Both'), False).to_numpy(zero_copy_only=False)
+        if not both.any():
+            return table
+
+        positions = numpy.repeat(numpy.arange(table.num_rows), numpy.where(both, 2, 1))
+        first_copy = numpy.ones(len(positions), dtype=bool)
+        first_copy[1:] = positions[1:] != positions[:-1]
+
+        expanded = table.take(positions)
+        expanded_settings = pc.if_else(
+            pyarrow.array(both[positions]),
+            pc.if_else(pyarrow.array(first_copy), 'Inpatient', 'Outpatient'),
+            expanded.column(index))
+        return expanded.set_column(index, table.column_names[index], expanded_settings)
+
+    def _to_pandas(self, table: pyarrow.Table) -> pandas.DataFrame:
+        # Decode dictionaries so pandas gets plain object columns, not Categoricals
+        columns = [pc.cast(col, _STRING) if pyarrow.types.is_dictionary(col.type) else col for col in table.columns]
+        frame = pyarrow.Table.from_arrays(columns, names=table.column_names).to_pandas()
+        return frame.astype(object)
+
+
+def _repair_strings(array: pyarrow.Array) -> pyarrow.Array:
+    """Re-decode a string (or dictionary of strings) array holding invalid UTF-8, as CSV_Reader does"""
+    if pyarrow.types.is_dictionary(array.type):
+        return pyarrow.DictionaryArray.from_arrays(array.indices, _repair_strings(array.dictionary))
+    try:
+        array.validate(full=True)
+        return array
+    except pyarrow.ArrowInvalid:
+        values = array.cast(pyarrow.binary()).to_pylist()
+        return pyarrow.array([None if value is None else value.decode('utf-8', DECODE_ERRORS) for value in values],
+                             type=_STRING)
+
+
+def _valid_utf8(batches: pacsv.CSVStreamingReader) -> Iterator[pyarrow.RecordBatch]:
+    """
+    Strings are read without UTF-8 validation, so a stray cp1252 byte past
+    the encoding sample does not abort the file; a batch that fails full
+    validation has its columns re-decoded.
+    """
+    for batch in batches:
+        try:
+            batch.validate(full=True)
+        except pyarrow.ArrowInvalid:
+            batch = pyarrow.RecordBatch.from_arrays([_repair_strings(column) for column in batch.columns],
+                                                    schema=batch.schema)
+        yield batch
+
+
+def read_batches(csv_file, column_types: dict, prefilter: bool = False,
+                 block_size: int = 16 << 20) -> Iterator[pyarrow.RecordBatch]:
+    """Open the charge section of a HospitalCSVFile with the Arrow CSV reader"""
+    source = csv_file.charge_stream(prefilter)
+    return _valid_utf8(pacsv.open_csv(
+        source,
+        read_options=pacsv.ReadOptions(column_names=csv_file.charge_header, block_size=block_size,
+                                       use_threads=True, encoding=csv_file.stream_encoding),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=True, check_utf8=False),
+    ))
+
+
+def compare_engines(file_path: str, prefilter: bool = False) -> dict:
+    """
+    Parse and filter a hospital CSV with both engines, without touching the
+    database, and report rows/s for each.
+    """
+    from Read_Hospital_CSV import HospitalChargeETLCSV
+
+    results = {}
+    for engine in ('pandas', 'arrow'):
+        etl = HospitalChargeETLCSV("", file_path, prefilter=prefilter, engine=engine)
+        start = time.time()
+        etl._read_hospital_data()
+        filtered = etl._filter_services()
+        elapsed = time.time() - start
+        results[engine] = {
+            'seconds': elapsed,
+            'rows': etl.total_rows_processed,
+            'rows_kept': len(filtered),
+            'rows_per_second': etl.total_rows_processed / elapsed if elapsed else 0.0,
+        }
+
+    results['speedup'] = results['pandas']['seconds'] / results['arrow']['seconds'] if results['arrow']['seconds'] else 0.0
+    return results
+
+
+if __name__ == "__main__":
+    comparison = compare_engines(sys.argv[1], prefilter="--prefilter" in sys.argv)
+    for engine in ('pandas', 'arrow'):
+        stats = comparison[engine]
+        print(f"{engine:>6}: {stats['rows']:,} rows in {stats['seconds']:.2f}s "
+              f"({stats['rows_per_second']:,.0f} rows/s), {stats['rows_kept']:,} kept")
+    print(f"Arrow speedup: {comparison['speedup']:.2f}x")
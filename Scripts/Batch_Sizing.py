@@ -0,0 +1,71 @@
+class AdaptiveBatchSizer:
+    """
+    Decides when buffered charge batches are flushed to the database.
+
+    The row limit starts at initial_rows and is retuned after every flush
+    from the observed write speed (an exponentially weighted rows/s), so a
+    flush takes about target_seconds whatever the database can sustain.
+    Independently of the row limit, batches are flushed once their buffers
+    reach max_bytes, which bounds the memory held between flushes.
+
+    Usage:
+        sizer = AdaptiveBatchSizer()
+        ...append rows...
+        if sizer.should_flush(batches):
+            start = time.time()
+            load_charge_batches(cur, batches)
+            sizer.record(batches.row_count, batches.nbytes, time.time() - start)
+    """
+
+    # Measuring buffer size walks every column, so it is only checked every this many rows
+    BYTE_CHECK_ROWS = 1024
+
+    def __init__(self, target_seconds: float = 1.0, max_bytes: int = 64 << 20, initial_rows: int = 5000,
+                 min_rows: int = 500, max_rows: int = 500_000, smoothing: float = 0.5):
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.smoothing = smoothing
+
+        self.batch_rows = initial_rows
+        self.rows_per_second = None
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self._next_byte_check = self.BYTE_CHECK_ROWS
+
+    def should_flush(self, batches) -> bool:
+        rows = batches.row_count
+        if rows >= self.batch_rows:
+            return True
+        if rows >= self._next_byte_check:
+            self._next_byte_check = rows + self.BYTE_CHECK_ROWS
+            return batches.nbytes >= self.max_bytes
+        return False
+
+    def record(self, rows: int, nbytes: int, seconds: float):
+        """Feed back how long a flush of rows (taking nbytes of buffer) took"""
+        self.flushes += 1
+        self.flush_seconds += seconds
+        self._next_byte_check = self.BYTE_CHECK_ROWS
+        if rows <= 0 or seconds <= 0:
+            return
+
+        rate = rows / seconds
+        if self.rows_per_second is None:
+            self.rows_per_second = rate
+        else:
+            self.rows_per_second = self.smoothing * rate + (1 - self.smoothing) * self.rows_per_second
+
+        target = self.rows_per_second * self.target_seconds
+        if nbytes:
+            target = min(target, self.max_bytes / (nbytes / rows))
+        self.batch_rows = int(min(max(target, self.min_rows), self.max_rows))
+
+    def stats(self) -> dict:
+        return {
+            'flushes': self.flushes,
+            'flush_seconds': self.flush_seconds,
+            'batch_rows': self.batch_rows,
+            'rows_per_second': self.rows_per_second or 0.0,
+        }
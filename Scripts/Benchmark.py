@@ -0,0 +1,399 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from Connection_Pool import read_connection_str
+from Synthetic_MRF import FORMATS, generate_mrf
+
+
+RESULTS_FILE = "../Benchmarks/results.jsonl"
+DATA_DIR = "../Benchmarks/data"
+
+# How the pipeline benchmark serves the suite, cycling through the files
+PIPELINE_MODES = ('plain', 'zip', 'gzip', 'redirect', 'attachment')
+
+# The standard suite; scale multiplies the item counts
+SUITE = {
+    'tall': {'file_format': 'tall', 'items': 20_000, 'payers': 5, 'plans': 2},
+    'wide': {'file_format': 'wide', 'items': 20_000, 'payers': 5, 'plans': 2},
+    'json': {'file_format': 'json', 'items': 20_000, 'payers': 5, 'plans': 2},
+    'tall-many-payers': {'file_format': 'tall', 'items': 2_000, 'payers': 40, 'plans': 3},
+    'json-high-match': {'file_format': 'json', 'items': 20_000, 'payers': 5, 'plans': 2, 'match_rate': 0.8},
+}
+
+
+def git_commit() -> str:
+    """Short hash of HEAD, with -dirty if the tree has uncommitted changes"""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo, capture_output=True,
+                               text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+
+def _peak_rss_bytes(who) -> int | None:
+    if resource is None:
+        return None
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return resource.getrusage(who).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _run_etl(file_path: str, sink_name: str, db_connection_str: str | None, options: dict) -> dict:
+    """Runs in a fresh process, so the peak RSS belongs to this file alone"""
+    from Output_Sinks import create_sink
+
+    sink = create_sink(sink_name, db_connection_str)
+    if file_path.lower().endswith('.json'):
+        from Read_Hospital_JSON import HospitalChargeETLJSON
+        etl = HospitalChargeETLJSON(db_connection_str, file_path, sink=sink, **options.get('json', {}))
+    else:
+        from Read_Hospital_CSV import HospitalChargeETLCSV
+        etl = HospitalChargeETLCSV(db_connection_str, file_path, sink=sink, **options.get('csv', {}))
+
+    try:
+        result = etl.execute()
+    except Exception as e:
+        result = {'status': 'failed', 'error': str(e)}
+    finally:
+        sink.close()
+
+    result['peak_rss_bytes'] = _peak_rss_bytes(resource.RUSAGE_SELF) if resource else None
+    result['peak_worker_rss_bytes'] = _peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource else None
+    return result
+
+
+def run_benchmark(file_path: str, sink: str = 'null', db_connection_str: str = None, options: dict = None,
+                  label: str = None) -> dict:
+    """
+    Run one ETL over file_path in a child process.
+
+    :param sink: 'null' to time parsing and normalization alone, 'postgres' for a full load
+    :param options: {'csv': {...}, 'json': {...}} keyword arguments for the ETL class
+    :param label: name of the case in the results, default the file name
+    :return: the benchmark record (see record_result)
+    """
+    options = options or {}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(1, mp_context=context) as pool:
+        result = pool.submit(_run_etl, os.path.abspath(file_path), sink, db_connection_str, options).result()
+
+    seconds = result.get('execution_time') or 0.0
+    file_bytes = os.path.getsize(file_path)
+    rows = result.get('records_processed', 0)
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'label': label or os.path.basename(file_path),
+        'file': file_path,
+        'file_bytes': file_bytes,
+        'sink': sink,
+        'options': options,
+        'status': result['status'],
+        'error': result.get('error'),
+        'seconds': seconds,
+        'rows': rows,
+        'rows_per_second': rows / seconds if seconds else 0.0,
+        'megabytes_per_second': file_bytes / 1e6 / seconds if seconds else 0.0,
+        'peak_rss_bytes': result.get('peak_rss_bytes'),
+        'peak_worker_rss_bytes': result.get('peak_worker_rss_bytes'),
+        'stage_times': result.get('stage_times', {}),
+        'batching': result.get('batching', {}),
+    }
+
+
+def _directory_bytes(directory: str) -> int:
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:  # cleaned up while walking
+                pass
+    return total
+
+
+class _DiskHighWater:
+    """Samples the size of a directory tree from a background thread and keeps the largest"""
+
+    def __init__(self, directory: str, interval: float = 0.02):
+        self.directory = directory
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="disk-high-water", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, _directory_bytes(self.directory))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, _directory_bytes(self.directory))
+
+
+def run_pipeline_benchmark(files: list[str], download_workers: int = 1, max_buffered: int = 1,
+                           bandwidth: float | None = None, latency: float = 0.0, faults: bool = False,
+                           label: str = None) -> dict:
+    """
+    Serve files from a LocalMRFServer and run pipeline_process over them
+    into a NullSink, timing the whole download, unzip and ETL pipeline and
+    sampling how much of the disk its download directory takes.
+
+    :param bandwidth: bytes per second per download, None for unlimited
+    :param latency: seconds before each response
+    :param faults: also serve a 403 and a truncated download, which must be skipped and cleaned up
+    :return: the benchmark record (see record_result)
+    """
+    from Download_and_Process import pipeline_process
+    from Local_MRF_Server import LocalMRFServer
+    from Output_Sinks import NullSink
+    from Run_Metrics import RunMetrics
+
+    download_dir = tempfile.mkdtemp(prefix="mrf-pipeline-")
+    metrics = RunMetrics()
+    with LocalMRFServer(bandwidth, latency) as server:
+        urls = [server.add_file(path, PIPELINE_MODES[i % len(PIPELINE_MODES)]) for i, path in enumerate(files)]
+        if faults:
+            urls += [server.add_file(files[0], 'forbidden'), server.add_file(files[0], 'truncated')]
+        start = time.perf_counter()
+        try:
+            with _DiskHighWater(download_dir) as disk, contextlib.redirect_stdout(io.StringIO()):
+                pipeline_process(urls, download_dir, max_buffered=max_buffered, target_extensions=['.csv', '.json'],
+                                 sink=NullSink(), metrics=metrics, download_workers=download_workers)
+            status, error = 'success', None
+        except Exception as e:
+            status, error = 'failed', str(e)
+        seconds = time.perf_counter() - start
+        leftover_bytes = _directory_bytes(download_dir)
+    shutil.rmtree(download_dir, ignore_errors=True)
+
+    file_bytes = sum(os.path.getsize(path) for path in files)
+    processed = sum(1 for report in metrics.files if report['status'] == 'success')
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'label': label or f"pipeline-w{download_workers}-b{max_buffered}",
+        'kind': 'pipeline',
+        'sink': NullSink.name,
+        'options': {'download_workers': download_workers, 'max_buffered': max_buffered, 'bandwidth': bandwidth,
+                    'latency': latency, 'faults': faults},
+        'status': status,
+        'error': error,
+        'seconds': seconds,
+        'files': len(files),
+        'files_processed': processed,
+        'file_bytes': file_bytes,
+        'megabytes_per_second': file_bytes / 1e6 / seconds if seconds else 0.0,
+        'files_per_second': processed / seconds if seconds else 0.0,
+        'disk_high_water_bytes': disk.peak_bytes,
+        'leftover_bytes': leftover_bytes,
+    }
+
+
+def record_result(record: dict, results_file: str = RESULTS_FILE):
+    """Append a benchmark record to the results file, one JSON object per line"""
+    directory = os.path.dirname(results_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(results_file, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def load_results(results_file: str = RESULTS_FILE) -> list[dict]:
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(results_file: str = RESULTS_FILE, metric: str = 'rows_per_second') -> list[dict]:
+    """
+    Best value of metric per case (label and sink) and commit, in the order
+    the commits were first benchmarked, with the change from the previous commit.
+    Lower is better for seconds and the byte peaks, higher for the rates.
+    """
+    lower_is_better = metric in ('seconds', 'peak_rss_bytes', 'disk_high_water_bytes')
+    best = {}
+    for record in load_results(results_file):
+        value = record.get(metric)
+        if record.get('status') != 'success' or value is None:
+            continue
+        key = (record['label'], record['sink'], record['commit'])
+        if key not in best or (value < best[key] if lower_is_better else value > best[key]):
+            best[key] = value
+
+    rows = []
+    previous = {}
+    for (label, sink, commit), value in best.items():
+        before = previous.get((label, sink))
+        rows.append({
+            'label': label, 'sink': sink, 'commit': commit, metric: value,
+            'change': (value - before) / before if before else None,
+        })
+        previous[(label, sink)] = value
+    return rows
+
+
+def generate_suite(data_dir: str = DATA_DIR, scale: float = 1.0, seed: int = 0) -> dict[str, str]:
+    """Generate the SUITE files, reusing ones already generated with the same parameters"""
+    paths = {}
+    for name, params in SUITE.items():
+        params = dict(params, items=max(1, int(params['items'] * scale)), seed=seed)
+        extension = 'json' if params['file_format'] == 'json' else 'csv'
+        file_path = os.path.join(data_dir, f"{name}-{params['items']}-{seed}.{extension}")
+        if not os.path.exists(file_path):
+            generate_mrf(file_path, **params)
+        paths[name] = file_path
+    return paths
+
+
+def _etl_options(args) -> dict:
+    memory_limit = args.memory_limit << 20 if args.memory_limit else None
+    return {
+        'csv': {'engine': args.engine, 'prefilter': args.prefilter, 'memory_limit': memory_limit},
+        'json': {'decoder': args.decoder, 'workers': args.workers, 'memory_limit': memory_limit},
+    }
+
+
+def _db_connection_str(args) -> str | None:
+    if args.sink != 'postgres':
+        return None
+    if args.db:
+        return args.db
+    return read_connection_str()
+
+
+def _report(record: dict):
+    peak = record['peak_rss_bytes']
+    stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in record['stage_times'].items())
+    if record['status'] != 'success':
+        print(f"{record['label']:<28} {record['sink']:<9} FAILED: {record['error']}")
+        return
+    print(f"{record['label']:<28} {record['sink']:<9} {record['seconds']:8.2f}s {record['rows_per_second']:12,.0f} rows/s "
+          f"{record['megabytes_per_second']:7.1f} MB/s  peak RSS {peak / 2**20 if peak else 0:7.1f} MiB  ({stages})")
+
+
+def _report_pipeline(record: dict):
+    if record['status'] != 'success':
+        print(f"{record['label']:<28} FAILED: {record['error']}")
+        return
+    print(f"{record['label']:<28} {record['seconds']:8.2f}s {record['files_processed']}/{record['files']} files "
+          f"{record['megabytes_per_second']:7.1f} MB/s  disk high water {record['disk_high_water_bytes'] / 2**20:7.1f} MiB"
+          + (f"  LEFT {record['leftover_bytes']:,} bytes behind" if record['leftover_bytes'] else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic MRF generation and ETL benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="write one synthetic MRF")
+    generate.add_argument('file_path')
+    generate.add_argument('--format', dest='file_format', choices=FORMATS, default='tall')
+    generate.add_argument('--items', type=int, default=10_000)
+    generate.add_argument('--payers', type=int, default=5)
+    generate.add_argument('--plans', type=int, default=2)
+    generate.add_argument('--match-rate', type=float, default=0.2)
+    generate.add_argument('--both-rate', type=float, default=0.1)
+    generate.add_argument('--target-bytes', type=int, default=None)
+    generate.add_argument('--seed', type=int, default=0)
+
+    for name, help_text in (('run', "benchmark the ETL on existing files"), ('suite', "generate and benchmark the standard suite")):
+        command = commands.add_parser(name, help=help_text)
+        if name == 'run':
+            command.add_argument('files', nargs='+')
+        else:
+            command.add_argument('--scale', type=float, default=1.0)
+            command.add_argument('--data-dir', default=DATA_DIR)
+        command.add_argument('--sink', choices=('null', 'postgres'), default='null')
+        command.add_argument('--db', help="connection string, default ../Credentials/cred.txt")
+        command.add_argument('--repeat', type=int, default=1)
+        command.add_argument('--engine', choices=('pandas', 'arrow'), default='pandas')
+        command.add_argument('--prefilter', action='store_true')
+        command.add_argument('--decoder', default='auto')
+        command.add_argument('--workers', type=int, default=1)
+        command.add_argument('--memory-limit', type=int, default=None, help="RSS ceiling in MiB (memory-bounded mode)")
+        command.add_argument('--results', default=RESULTS_FILE)
+        command.add_argument('--no-record', action='store_true', help="print only, do not store the results")
+
+    pipeline = commands.add_parser('pipeline', help="benchmark download and processing against a local server")
+    pipeline.add_argument('--scale', type=float, default=0.1)
+    pipeline.add_argument('--data-dir', default=DATA_DIR)
+    pipeline.add_argument('--download-workers', type=int, nargs='+', default=[1, 2])
+    pipeline.add_argument('--max-buffered', type=int, nargs='+', default=[1, 3])
+    pipeline.add_argument('--bandwidth', type=float, default=None, help="MB/s per download")
+    pipeline.add_argument('--latency', type=float, default=0.0, help="seconds per response")
+    pipeline.add_argument('--faults', action='store_true', help="add a 403 and a truncated download")
+    pipeline.add_argument('--repeat', type=int, default=1)
+    pipeline.add_argument('--results', default=RESULTS_FILE)
+    pipeline.add_argument('--no-record', action='store_true', help="print only, do not store the results")
+
+    comparison = commands.add_parser('compare', help="compare stored results across commits")
+    comparison.add_argument('--metric', default='rows_per_second')
+    comparison.add_argument('--results', default=RESULTS_FILE)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        stats = generate_mrf(args.file_path, file_format=args.file_format, items=args.items, payers=args.payers,
+                             plans=args.plans, match_rate=args.match_rate, both_rate=args.both_rate,
+                             target_bytes=args.target_bytes, seed=args.seed)
+        print(stats)
+
+    elif args.command in ('run', 'suite'):
+        if args.command == 'suite':
+            cases = list(generate_suite(args.data_dir, args.scale).items())
+        else:
+            cases = [(None, path) for path in args.files]
+        db_connection_str = _db_connection_str(args)
+        for label, file_path in cases:
+            for _ in range(args.repeat):
+                record = run_benchmark(file_path, args.sink, db_connection_str, _etl_options(args), label)
+                _report(record)
+                if not args.no_record:
+                    record_result(record, args.results)
+
+    elif args.command == 'pipeline':
+        files = list(generate_suite(args.data_dir, args.scale).values())
+        bandwidth = args.bandwidth * 1e6 if args.bandwidth else None
+        for download_workers in args.download_workers:
+            for max_buffered in args.max_buffered:
+                for _ in range(args.repeat):
+                    record = run_pipeline_benchmark(files, download_workers, max_buffered, bandwidth, args.latency,
+                                                    args.faults)
+                    _report_pipeline(record)
+                    if not args.no_record:
+                        record_result(record, args.results)
+
+    else:
+        for row in compare(args.results, args.metric):
+            change = f"{row['change']:+.1%}" if row['change'] is not None else ''
+            print(f"{row['label']:<28} {row['sink']:<9} {row['commit']:<16} {row[args.metric]:14,.2f} {change}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import io
+from typing import BinaryIO, Iterable, Iterator
+
+import numpy
+
+from Code_Filter import ALLOWED_CPT_HCPCS_CODES, DRG_TYPES
+
+
+# bytes.translate table mapping token characters to 1 and everything else to 0
+_TOKEN_TABLE = bytes(
+    1 if chr(byte) in "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-" else 0
+    for byte in range(256)
+)
+
+# Clearing bit 5 upper-cases ASCII letters and keeps digits and '-' distinct
+_CASE_MASK = 0xDF
+
+_NEWLINE = ord("\n")
+_QUOTE = ord('"')
+
+
+def _pack(token: bytes) -> int:
+    key = 0
+    for byte in token:
+        key = (key << 8) | (byte & _CASE_MASK)
+    return key
+
+
+class CandidateMatcher:
+    """
+    Multi-pattern matcher for whitelisted codes and DRG type markers over raw
+    CSV bytes.
+
+    Every pattern is at most 8 bytes, so each is packed into a uint64 key.
+    A block is split into tokens ([0-9A-Za-z-] runs) with array operations,
+    tokens of a pattern length are packed the same way, and all patterns are
+    tested at once with one sorted-array membership check per length. No
+    Python code runs per byte or per line.
+    """
+
+    def __init__(self, codes: Iterable[str] = ALLOWED_CPT_HCPCS_CODES,
+                 markers: Iterable[str] = DRG_TYPES):
+        keys: dict[int, list[int]] = {}
+        for pattern in set(codes) | set(markers):
+            encoded = pattern.encode("ascii")
+            if len(encoded) > 8:
+                raise ValueError(f"Pattern longer than 8 bytes: {pattern}")
+            keys.setdefault(len(encoded), []).append(_pack(encoded))
+        self._keys = {length: numpy.array(sorted(k), dtype=numpy.uint64) for length, k in keys.items()}
+
+    def hit_positions(self, block: bytes) -> numpy.ndarray:
+        """Byte offsets of every whole-token pattern match in block"""
+        data = numpy.frombuffer(block, dtype=numpy.uint8)
+        token = numpy.frombuffer(block.translate(_TOKEN_TABLE), dtype=bool)
+
+        edges = numpy.flatnonzero(token[1:] != token[:-1]) + 1
+        if len(token) and token[0]:
+            edges = numpy.concatenate(([0], edges))
+        if len(token) and token[-1]:
+            edges = numpy.concatenate((edges, [len(token)]))
+        starts = edges[0::2]
+        lengths = edges[1::2] - starts
+
+        hits = []
+        for length, keys in self._keys.items():
+            candidates = starts[lengths == length]
+            packed = numpy.zeros(len(candidates), dtype=numpy.uint64)
+            for offset in range(length):
+                packed = (packed << numpy.uint64(8)) | (data[candidates + offset] & _CASE_MASK)
+            hits.append(candidates[numpy.isin(packed, keys)])
+
+        return numpy.concatenate(hits) if hits else numpy.zeros(0, dtype=numpy.int64)
+
+
+CANDIDATE_MATCHER = CandidateMatcher()
+
+
+def iter_records(raw: BinaryIO) -> Iterator[bytes]:
+    """
+    Yield raw CSV records, joining physical lines while a quoted field is
+    still open (an odd number of quote characters so far). Escaped quotes
+    ("") come in pairs, so they never change the parity.
+    """
+    pending = []
+    open_quotes = 0
+    for line in raw:
+        open_quotes += line.count(b'"')
+        if open_quotes & 1:
+            pending.append(line)
+            continue
+        if pending:
+            pending.append(line)
+            line = b"".join(pending)
+            pending = []
+        open_quotes = 0
+        yield line
+    if pending:
+        yield b"".join(pending)
+
+
+def record_ends(block: bytes) -> numpy.ndarray:
+    """
+    Offsets of the newlines in block that end a record, i.e. those preceded
+    by an even number of quote characters. block must start on a record
+    boundary.
+    """
+    data = numpy.frombuffer(block, dtype=numpy.uint8)
+    newlines = numpy.flatnonzero(data == _NEWLINE)
+    quotes = numpy.flatnonzero(data == _QUOTE)
+    return newlines[(numpy.searchsorted(quotes, newlines) & 1) == 0]
+
+
+class PrefilteredCSVStream(io.RawIOBase):
+    """
+    Read-only byte stream over a hospital CSV that only lets through the
+    leading header records and the records that could possibly match the
+    code filter. Everything else is dropped before pandas ever tokenizes it.
+
+    The match is a superset test on raw bytes: the exact (type, code) check
+    still happens after parsing, so false positives are harmless. The file
+    is scanned in large blocks cut on record boundaries, so quoted fields
+    spanning several lines stay in one piece.
+    """
+
+    def __init__(self, raw: BinaryIO, passthrough_records: int = 3,
+                 matcher: CandidateMatcher = CANDIDATE_MATCHER, block_size: int = 8 << 20):
+        super().__init__()
+        self._raw = raw
+        self._matcher = matcher
+        self._passthrough = passthrough_records
+        self._block_size = block_size
+        self._carry = b""
+        self._buffer = bytearray()
+        self._exhausted = False
+
+        self.records_scanned = 0
+        self.records_passed = 0
+
+    @property
+    def records_skipped(self) -> int:
+        return self.records_scanned - self.records_passed
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+    def readinto(self, b) -> int:
+        while len(self._buffer) < len(b) and not self._exhausted:
+            self._fill()
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+    def _fill(self):
+        if self._passthrough > 0:
+            for record in iter_records(self._raw):
+                self._buffer += record
+                self._passthrough -= 1
+                if self._passthrough == 0:
+                    break
+            else:
+                self._passthrough = 0
+            return
+
+        data = self._raw.read(self._block_size)
+        block = self._carry + data
+        if not block:
+            self._exhausted = True
+            return
+
+        ends = record_ends(block)
+        if not data:
+            # Last record may have no trailing newline
+            if not len(ends) or ends[-1] != len(block) - 1:
+                ends = numpy.append(ends, len(block) - 1)
+            self._carry = b""
+        elif not len(ends):
+            self._carry = block
+            return
+        else:
+            self._carry = block[ends[-1] + 1:]
+            block = block[:ends[-1] + 1]
+
+        self.records_scanned += len(ends)
+
+        hits = self._matcher.hit_positions(block)
+        if not len(hits):
+            return
+
+        kept = numpy.unique(numpy.searchsorted(ends, hits))
+        self.records_passed += len(kept)
+
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+        for start, end in zip(starts[kept].tolist(), ends[kept].tolist()):
+            self._buffer += block[start:end + 1]
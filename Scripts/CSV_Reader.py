@@ -0,0 +1,204 @@
+import codecs
+import csv
+import io
+from typing import BinaryIO, Optional
+
+import pandas
+
+from CSV_Prefilter import PrefilteredCSVStream, iter_records
+
+try:
+    from charset_normalizer import from_bytes as _detect_charset
+except ImportError:  # optional dependency
+    _detect_charset = None
+
+
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+def _is_ascii_compatible(encoding: str) -> bool:
+    """
+    True if ASCII characters encode to plain ASCII bytes, so the raw stream
+    can be scanned and split on b'\\n' / b'"' directly
+    """
+    probe = '\n",|-azAZ09'
+    try:
+        return probe.encode(encoding) == probe.encode('ascii')
+    except (LookupError, UnicodeError):
+        return False
+
+
+FALLBACK_ENCODING = 'latin1'  # Decodes any byte sequence
+
+# The encoding is chosen from the first SAMPLE_SIZE bytes, and an all-ASCII
+# sample passes as UTF-8; Windows exports can still have a stray cp1252
+# byte further down. Bytes that do not decode are read as cp1252 (latin1
+# for the five bytes it leaves undefined) instead of failing the file.
+DECODE_ERRORS = 'mrf-cp1252-fallback'
+
+
+def _cp1252_fallback(error: UnicodeDecodeError) -> tuple[str, int]:
+    byte = error.object[error.start:error.start + 1]
+    try:
+        return byte.decode('cp1252'), error.start + 1
+    except UnicodeDecodeError:
+        return byte.decode(FALLBACK_ENCODING), error.start + 1
+
+
+codecs.register_error(DECODE_ERRORS, _cp1252_fallback)
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    Detect the encoding of a CSV from its first bytes: a BOM if present,
+    then strict UTF-8, then charset_normalizer when installed, and finally
+    cp1252 or latin1.
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    # The sample may end partway through a multi-byte character
+    for cut in range(4):
+        try:
+            sample[:len(sample) - cut].decode('utf-8')
+            return 'utf-8'
+        except UnicodeDecodeError as e:
+            if e.start < len(sample) - 4:
+                break
+
+    if _detect_charset is not None:
+        best = _detect_charset(sample).best()
+        if best is not None and _is_ascii_compatible(best.encoding):
+            return best.encoding
+
+    # Windows exports are far more common than true latin1; cp1252 only
+    # differs in 0x80-0x9F, where it leaves five bytes undefined
+    try:
+        sample.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+
+
+class _Utf8Recoder(io.RawIOBase):
+    """Byte stream re-encoding a non ASCII-compatible file (UTF-16/32) as UTF-8"""
+
+    def __init__(self, raw: BinaryIO, encoding: str):
+        super().__init__()
+        self._text = io.TextIOWrapper(raw, encoding=encoding, errors=DECODE_ERRORS, newline='')
+        self._pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self._pending) < len(b):
+            text = self._text.read(1 << 16)
+            if not text:
+                break
+            self._pending += text.encode('utf-8')
+
+        size = min(len(b), len(self._pending))
+        b[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._text.close()
+        super().close()
+
+
+def _dedupe(names: list[str]) -> list[str]:
+    """Make column names unique the way pandas does for a parsed header (x, x.1, x.2)"""
+    seen: dict[str, int] = {}
+    result = []
+    for name in names:
+        candidate = name
+        while candidate in seen:
+            seen[name] += 1
+            candidate = f"{name}.{seen[name]}"
+        seen[candidate] = 0
+        result.append(candidate)
+    return result
+
+
+class HospitalCSVFile:
+    """
+    A hospital charge CSV opened exactly once.
+
+    The file is sampled for its encoding, then the two hospital metadata rows
+    and the charge header are read off the same buffered stream, which is
+    left positioned on the first charge row for the chunked parser.
+
+    Usage:
+        with HospitalCSVFile(file_path) as csv_file:
+            csv_file.metadata, csv_file.charge_header
+            for chunk in csv_file.read_chunks(100000): ...
+    """
+
+    SAMPLE_SIZE = 1 << 16
+
+    def __init__(self, file_path: str, buffer_size: int = 1 << 20):
+        self.file_path = file_path
+        self._raw = open(file_path, 'rb', buffering=max(buffer_size, self.SAMPLE_SIZE))
+
+        self.encoding = detect_encoding(self._raw.peek(self.SAMPLE_SIZE)[:self.SAMPLE_SIZE])
+
+        if self.encoding == 'utf-8-sig':
+            self._raw.read(len(codecs.BOM_UTF8))
+            self.stream_encoding = 'utf-8'
+            self.stream: BinaryIO = self._raw
+        elif _is_ascii_compatible(self.encoding):
+            self.stream_encoding = self.encoding
+            self.stream = self._raw
+        else:
+            self.stream_encoding = 'utf-8'
+            self.stream = io.BufferedReader(_Utf8Recoder(self._raw, self.encoding), buffer_size)
+
+        records = iter_records(self.stream)
+        metadata_header, metadata_row, charge_header = (self._parse_record(next(records, b'')) for _ in range(3))
+
+        self.metadata = dict(zip(metadata_header, metadata_row))
+        self.charge_header = _dedupe(charge_header)
+        self.prefiltered: Optional[PrefilteredCSVStream] = None
+
+    def _parse_record(self, record: bytes) -> list[str]:
+        return next(csv.reader(io.StringIO(record.decode(self.stream_encoding, DECODE_ERRORS), newline='')), [])
+
+    def charge_stream(self, prefilter: bool = False) -> BinaryIO:
+        """
+        Byte stream over the charge rows, in stream_encoding.
+
+        :param prefilter: only pass rows that could hold a relevant code (see CSV_Prefilter)
+        """
+        if not prefilter:
+            return self.stream
+        self.prefiltered = PrefilteredCSVStream(self.stream, passthrough_records=0)
+        return io.BufferedReader(self.prefiltered)
+
+    def read_chunks(self, chunksize: int, prefilter: bool = False) -> pandas.io.parsers.TextFileReader:
+        """
+        Chunked reader over the charge rows.
+
+        :param prefilter: only parse rows that could hold a relevant code (see CSV_Prefilter)
+        """
+        return pandas.read_csv(self.charge_stream(prefilter), header=None, names=self.charge_header, encoding=self.stream_encoding,
+                               encoding_errors=DECODE_ERRORS, chunksize=chunksize, dtype=str, low_memory=False)
+
+    def close(self):
+        self.stream.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
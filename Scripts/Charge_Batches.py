@@ -0,0 +1,390 @@
+import math
+import struct
+from array import array
+from typing import Iterable, Iterator, Sequence
+
+import numpy
+
+from Charge_Values import money_cents, percent
+
+
+# Column encodings
+TEXT = 'text'              # Mostly distinct values, stored back to back
+DICTIONARY = 'dictionary'  # Repeated values, stored once and referenced by code
+MONEY = 'money'            # Dollar amounts, stored as int8 cents
+PERCENT = 'percent'        # Percentages, stored as float8
+
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_COPY_TRAILER = struct.pack('!h', -1)
+_NULL_FIELD = struct.pack('!i', -1)
+
+
+def _is_null(value) -> bool:
+    # pandas hands missing strings over as NaN
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _field(value) -> bytes:
+    """A COPY BINARY text field: int32 length followed by the UTF-8 bytes"""
+    if _is_null(value):
+        return _NULL_FIELD
+    encoded = str(value).encode('utf-8')
+    return struct.pack('!i', len(encoded)) + encoded
+
+
+class _Column:
+    """Null bitmap shared by every column encoding: bit i is set when row i is NULL"""
+
+    def __init__(self):
+        self.nulls = bytearray()
+        self.length = 0
+
+    def _mark(self, is_null: bool):
+        if self.length & 7 == 0:
+            self.nulls.append(0)
+        if is_null:
+            self.nulls[self.length >> 3] |= 1 << (self.length & 7)
+        self.length += 1
+
+    def is_null(self, row: int) -> bool:
+        return bool(self.nulls[row >> 3] >> (row & 7) & 1)
+
+    def null_count(self) -> int:
+        return sum(bin(byte).count('1') for byte in self.nulls)
+
+    def load_arrow(self, values):
+        """Append every value of a pyarrow array (as written by to_arrow)"""
+        for value in values.to_pylist():
+            self.append(value)
+
+    def null_mask(self) -> numpy.ndarray:
+        return numpy.unpackbits(numpy.frombuffer(self.nulls, dtype=numpy.uint8), count=self.length,
+                                bitorder='little').astype(bool)
+
+
+class TextColumn(_Column):
+    """
+    Values kept as one contiguous buffer of ready-to-send COPY fields, with
+    an offset array marking where each row's field starts.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+        self.offsets = array('q', [0])
+
+    def append(self, value):
+        self.data += _field(value)
+        self.offsets.append(len(self.data))
+        self._mark(_is_null(value))
+
+    def extend(self, other: 'TextColumn'):
+        base = len(self.data)
+        self.data += other.data
+        self.offsets.extend(offset + base for offset in other.offsets[1:])
+        for row in range(other.length):
+            self._mark(other.is_null(row))
+
+    def value(self, row: int):
+        if self.is_null(row):
+            return None
+        return bytes(self.data[self.offsets[row] + 4:self.offsets[row + 1]]).decode('utf-8')
+
+    def to_arrow(self):
+        import pyarrow
+        return pyarrow.array([self.value(row) for row in range(self.length)], type=pyarrow.string())
+
+    def fields(self) -> Iterator[memoryview]:
+        data = memoryview(self.data)
+        offsets = self.offsets
+        return (data[offsets[row]:offsets[row + 1]] for row in range(self.length))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + self.offsets.itemsize * len(self.offsets) + len(self.nulls)
+
+
+class DictionaryColumn(_Column):
+    """
+    Each distinct value is encoded once; rows hold an int32 code into the
+    dictionary. NULL is an ordinary dictionary entry, so writing a row never
+    has to branch on it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.values: list = []
+        self.encoded: list[bytes] = []
+        self.codes = array('i')
+        self._index: dict = {}
+        self._encoded_bytes = 0
+
+    def _code(self, value) -> int:
+        code = self._index.get(value)
+        if code is None:
+            code = len(self.values)
+            self._index[value] = code
+            self.values.append(value)
+            self.encoded.append(_field(value))
+            self._encoded_bytes += len(self.encoded[-1])
+        return code
+
+    def append(self, value):
+        if _is_null(value):
+            value = None
+        elif isinstance(value, list):
+            # Values used as dictionary keys must be hashable; lists are stored pipe-separated
+            value = "|".join(str(v) for v in value) or None
+        self.codes.append(self._code(value))
+        self._mark(value is None)
+
+    def extend(self, other: 'DictionaryColumn'):
+        remap = [self._code(value) for value in other.values]
+        self.codes.extend(remap[code] for code in other.codes)
+        for row in range(other.length):
+            self._mark(other.is_null(row))
+
+    def value(self, row: int):
+        return self.values[self.codes[row]]
+
+    def to_arrow(self):
+        import pyarrow
+        indices = pyarrow.array(numpy.frombuffer(self.codes, dtype=numpy.int32), mask=self.null_mask())
+        # NULL rows are masked in the indices; Parquet rejects a NULL dictionary entry
+        dictionary = pyarrow.array(['' if value is None else str(value) for value in self.values], type=pyarrow.string())
+        return pyarrow.DictionaryArray.from_arrays(indices, dictionary)
+
+    def fields(self) -> Iterator[bytes]:
+        return map(self.encoded.__getitem__, self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self._encoded_bytes + self.codes.itemsize * len(self.codes) + len(self.nulls)
+
+
+class _NumericColumn(_Column):
+    """
+    Fixed-width values in a typed array; NULL rows hold 0 and are only
+    known through the bitmap. Appended values go through the shared
+    Charge_Values rules, and values those rules reject are stored as NULL
+    and counted in rejected.
+    """
+
+    typecode = ''
+    field = struct.Struct('')
+
+    def __init__(self):
+        super().__init__()
+        self.data = array(self.typecode)
+        self.rejected = 0
+
+    def _convert(self, value):
+        raise NotImplementedError
+
+    def append(self, value):
+        try:
+            number = self._convert(value)
+        except ValueError:
+            self.rejected += 1
+            number = None
+        self.data.append(0 if number is None else number)
+        self._mark(number is None)
+
+    def extend(self, other: '_NumericColumn'):
+        self.data.extend(other.data)
+        self.rejected += other.rejected
+        for row in range(other.length):
+            self._mark(other.is_null(row))
+
+    def value(self, row: int):
+        return None if self.is_null(row) else self.data[row]
+
+    def to_arrow(self):
+        import pyarrow
+        return pyarrow.array(numpy.frombuffer(self.data, dtype=self.data.typecode), mask=self.null_mask())
+
+    def load_arrow(self, values):
+        """
+        Fill an empty column from a pyarrow array written by to_arrow. The
+        values are already normalized, so they bypass _convert.
+        """
+        import pyarrow.compute as pc
+        if self.length:
+            raise ValueError("load_arrow needs an empty column")
+        mask = values.is_null().to_numpy(zero_copy_only=False)
+        numbers = pc.fill_null(values, 0).to_numpy(zero_copy_only=False)
+        self.data.frombytes(numpy.ascontiguousarray(numbers, dtype=self.data.typecode).tobytes())
+        self.nulls = bytearray(numpy.packbits(mask, bitorder='little').tobytes())
+        self.length = len(mask)
+
+    def fields(self) -> Iterator[bytes]:
+        pack = self.field.pack
+        size = self.field.size - 4
+        return (_NULL_FIELD if self.is_null(row) else pack(size, number) for row, number in enumerate(self.data))
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.itemsize * len(self.data) + len(self.nulls)
+
+
+class MoneyColumn(_NumericColumn):
+    typecode = 'q'
+    field = struct.Struct('!iq')
+    _convert = staticmethod(money_cents)
+
+
+class PercentColumn(_NumericColumn):
+    typecode = 'd'
+    field = struct.Struct('!id')
+    _convert = staticmethod(percent)
+
+
+_COLUMN_TYPES = {TEXT: TextColumn, DICTIONARY: DictionaryColumn, MONEY: MoneyColumn, PERCENT: PercentColumn}
+
+
+class ColumnarBatch:
+    """
+    Append-only batch of rows for one table, stored column by column.
+
+    Rows are appended as sequences in schema order but are not kept as
+    Python tuples: every column either packs its values into one buffer or
+    dictionary-encodes them, and tracks NULLs in a bitmap. The batch
+    serializes straight to PostgreSQL COPY BINARY format.
+
+    Usage:
+        batch = ColumnarBatch(SERVICE_COLUMNS)
+        batch.append((service_id, setting, code, description, code_type, modifiers))
+        cur.copy("COPY ... FROM STDIN (FORMAT BINARY)").write(batch.to_copy_binary())
+    """
+
+    def __init__(self, schema: Sequence[tuple[str, str]]):
+        self.schema = tuple(schema)
+        self.column_names = [name for name, _ in self.schema]
+        self.columns = [_COLUMN_TYPES[encoding]() for _, encoding in self.schema]
+        self._row_header = struct.pack('!h', len(self.columns))
+
+    def __len__(self) -> int:
+        return self.columns[0].length if self.columns else 0
+
+    def append(self, row: Sequence):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+
+    def extend(self, other: 'ColumnarBatch'):
+        if other.schema != self.schema:
+            raise ValueError("Cannot combine batches with different schemas")
+        for column, other_column in zip(self.columns, other.columns):
+            column.extend(other_column)
+
+    def rejects(self) -> dict[str, int]:
+        """{column: values rejected by normalization} for columns with rejects"""
+        return {name: column.rejected for name, column in zip(self.column_names, self.columns)
+                if getattr(column, 'rejected', 0)}
+
+    def rows(self) -> Iterator[tuple]:
+        """Decode the rows back to tuples (for inspection, not the load path)"""
+        for row in range(len(self)):
+            yield tuple(column.value(row) for column in self.columns)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns)
+
+    def to_arrow(self):
+        """
+        The batch as a pyarrow Table (pyarrow is only needed when this is
+        called). Dictionary columns stay dictionary encoded; MONEY columns
+        are int64 cents.
+        """
+        import pyarrow
+        return pyarrow.Table.from_arrays([column.to_arrow() for column in self.columns], names=self.column_names)
+
+    @classmethod
+    def from_arrow(cls, schema: Sequence[tuple[str, str]], table) -> 'ColumnarBatch':
+        """Rebuild a batch from a pyarrow Table produced by to_arrow"""
+        batch = cls(schema)
+        for name, column in zip(batch.column_names, batch.columns):
+            column.load_arrow(table.column(name).combine_chunks())
+        return batch
+
+    def to_copy_binary(self) -> bytes:
+        out = bytearray(_COPY_HEADER)
+        row_header = self._row_header
+        for fields in zip(*(column.fields() for column in self.columns)):
+            out += row_header
+            for field in fields:
+                out += field
+        out += _COPY_TRAILER
+        return bytes(out)
+
+
+SERVICE_COLUMNS = (
+    ('service_id', DICTIONARY),
+    ('setting', DICTIONARY),
+    ('code', DICTIONARY),
+    ('description', TEXT),
+    ('type', DICTIONARY),
+    ('modifiers', DICTIONARY),
+)
+
+STANDARD_CHARGE_COLUMNS = (
+    ('service_id', TEXT),
+    ('hospital_name', DICTIONARY),
+    ('standard_charge_gross', MONEY),
+    ('standard_charge_discounted_cash', MONEY),
+    ('standard_charge_min', MONEY),
+    ('standard_charge_max', MONEY),
+)
+
+PAYER_CHARGE_COLUMNS = (
+    ('service_id', DICTIONARY),
+    ('hospital_name', DICTIONARY),
+    ('payer_name', DICTIONARY),
+    ('plan_name', DICTIONARY),
+    ('standard_charge_negotiated_dollar', MONEY),
+    ('standard_charge_negotiated_algorithm', DICTIONARY),
+    ('standard_charge_negotiated_percent', PERCENT),
+    ('estimated_amount', MONEY),
+    ('standard_charge_methodology', DICTIONARY),
+    ('additional_generic_notes', DICTIONARY),
+    ('median_amount', MONEY),
+    ('tenth_percentile_amount', MONEY),
+    ('ninetieth_percentile_amount', MONEY),
+    ('count_amounts', TEXT),
+)
+
+
+class ChargeBatches:
+    """The services, standard_charges and payer_charges batches filled together by an ETL"""
+
+    def __init__(self):
+        self.services = ColumnarBatch(SERVICE_COLUMNS)
+        self.standard_charges = ColumnarBatch(STANDARD_CHARGE_COLUMNS)
+        self.payer_charges = ColumnarBatch(PAYER_CHARGE_COLUMNS)
+
+    def __len__(self) -> int:
+        return len(self.services)
+
+    @property
+    def row_count(self) -> int:
+        """Rows buffered across all three tables"""
+        return sum(len(batch) for _, batch in self.tables())
+
+    def tables(self) -> Iterable[tuple[str, ColumnarBatch]]:
+        return (('services', self.services), ('standard_charges', self.standard_charges),
+                ('payer_charges', self.payer_charges))
+
+    def extend(self, other: 'ChargeBatches'):
+        for (_, batch), (_, other_batch) in zip(self.tables(), other.tables()):
+            batch.extend(other_batch)
+
+    def rejects(self) -> dict[str, int]:
+        rejects: dict[str, int] = {}
+        for _, batch in self.tables():
+            for name, count in batch.rejects().items():
+                rejects[name] = rejects.get(name, 0) + count
+        return rejects
+
+    @property
+    def nbytes(self) -> int:
+        return sum(batch.nbytes for _, batch in self.tables())
@@ -0,0 +1,118 @@
+import time
+
+from Charge_Batches import MONEY, PERCENT, ChargeBatches, ColumnarBatch
+
+
+# Staging column type per batch encoding; text columns are cast in the merge
+_STAGING_TYPES = {MONEY: 'int8', PERCENT: 'float8'}
+
+_CASTS = {
+    'setting': 'setting_enum',
+    'type': 'service_type_enum',
+}
+
+# Conflict key and the action taken on conflict for each live table
+_CONFLICTS = {
+    'services': (None, "DO NOTHING"),
+    'standard_charges': (['service_id', 'hospital_name'], """
+        DO UPDATE SET
+            standard_charge_gross = COALESCE(EXCLUDED.standard_charge_gross, standard_charges.standard_charge_gross),
+            standard_charge_discounted_cash = COALESCE(EXCLUDED.standard_charge_discounted_cash, standard_charges.standard_charge_discounted_cash),
+            standard_charge_min = COALESCE(EXCLUDED.standard_charge_min, standard_charges.standard_charge_min),
+            standard_charge_max = COALESCE(EXCLUDED.standard_charge_max, standard_charges.standard_charge_max)
+    """),
+    'payer_charges': (['service_id', 'hospital_name', 'payer_name', 'plan_name'], """
+        DO UPDATE SET
+            standard_charge_negotiated_dollar = EXCLUDED.standard_charge_negotiated_dollar,
+            standard_charge_negotiated_algorithm = EXCLUDED.standard_charge_negotiated_algorithm,
+            standard_charge_negotiated_percent = EXCLUDED.standard_charge_negotiated_percent,
+            estimated_amount = EXCLUDED.estimated_amount,
+            standard_charge_methodology = EXCLUDED.standard_charge_methodology,
+            additional_generic_notes = EXCLUDED.additional_generic_notes,
+            median_amount = EXCLUDED.median_amount,
+            tenth_percentile_amount = EXCLUDED.tenth_percentile_amount,
+            ninetieth_percentile_amount = EXCLUDED.ninetieth_percentile_amount,
+            count_amounts = EXCLUDED.count_amounts
+    """),
+}
+
+
+# Every description a hospital gives a service is kept as a search alias;
+# services itself keeps only the first description seen
+_ALIASES = """
+    INSERT INTO service_description_aliases (service_id, hospital_name, description)
+    SELECT DISTINCT service_id, %s, left(description, 1000)
+    FROM services_staging
+    WHERE coalesce(description, '') <> ''
+    ON CONFLICT DO NOTHING
+"""
+
+
+def _select(column: str, encoding: str) -> str:
+    if encoding == MONEY:
+        return f"{column}::numeric / 100"  # Cents back to numeric(12, 2), exactly
+    if column in _CASTS:
+        return f"{column}::{_CASTS[column]}"
+    return column
+
+
+def _staging_statements(table: str, batch: ColumnarBatch) -> tuple[str, str, str]:
+    columns = batch.column_names
+    staging = f"{table}_staging"
+    key, action = _CONFLICTS[table]
+
+    # seq records arrival order, so the last row for a key wins like it did
+    # with row by row upserts
+    create = f"""
+        CREATE TEMP TABLE IF NOT EXISTS {staging} (
+            seq bigint GENERATED ALWAYS AS IDENTITY,
+            {", ".join(f"{c} {_STAGING_TYPES.get(encoding, 'text')}" for c, encoding in batch.schema)}
+        )
+    """
+    copy = f"COPY {staging} ({', '.join(columns)}) FROM STDIN (FORMAT BINARY)"
+
+    select = ", ".join(_select(c, encoding) for c, encoding in batch.schema)
+    if key is None:
+        source = f"SELECT {select} FROM {staging} ORDER BY seq"
+        conflict = f"ON CONFLICT {action}"
+    else:
+        # DO UPDATE cannot touch the same row twice in one statement
+        source = f"SELECT DISTINCT ON ({', '.join(key)}) {select} FROM {staging} ORDER BY {', '.join(key)}, seq DESC"
+        conflict = f"ON CONFLICT ({', '.join(key)}) {action}"
+    merge = f"INSERT INTO {table} ({', '.join(columns)}) {source} {conflict}"
+
+    return create, copy, merge
+
+
+def load_charge_batches(cur, batches: ChargeBatches, timings: dict[str, float] | None = None,
+                        hospital_name: str | None = None) -> tuple[int, int, int]:
+    """
+    Upsert a set of charge batches. Each batch is streamed with COPY BINARY
+    into a temporary staging table and merged into the live table with one
+    INSERT ... SELECT ... ON CONFLICT.
+
+    :param cur: psycopg cursor; the staging tables live for the session
+    :param timings: if given, the seconds spent on each table are added to timings[table]
+    :param hospital_name: if given, the service descriptions are also kept as the hospital's aliases
+    :return: (services inserted, standard charges upserted, payer charges upserted)
+    """
+    counts = []
+    for table, batch in batches.tables():
+        if not len(batch):
+            counts.append(0)
+            continue
+
+        start = time.perf_counter()
+        create, copy, merge = _staging_statements(table, batch)
+        cur.execute(create)
+        with cur.copy(copy) as staged:
+            staged.write(batch.to_copy_binary())
+        cur.execute(merge, prepare=True)
+        counts.append(cur.rowcount)
+        if table == 'services' and hospital_name is not None:
+            cur.execute(_ALIASES, (hospital_name,), prepare=True)
+        cur.execute(f"TRUNCATE {table}_staging")
+        if timings is not None:
+            timings[table] = timings.get(table, 0.0) + time.perf_counter() - start
+
+    return counts[0], counts[1], counts[2]
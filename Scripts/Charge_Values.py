@@ -0,0 +1,110 @@
+import math
+import re
+
+import numpy
+import pandas
+
+
+# Largest value that fits numeric(12, 2)
+MAX_MONEY = 9_999_999_999.99
+
+# Placeholders hospitals publish instead of leaving a price blank
+MISSING_MARKERS = frozenset({'', 'N/A', 'NA', 'NAN', 'NONE', 'NULL', '-', '--'})
+
+# Currency symbol, thousands separators, percent sign and whitespace
+_NOISE = r'[\s$,%]'
+_NOISE_RE = re.compile(_NOISE)
+
+
+def _to_numbers(values: pandas.Series, limit: float) -> tuple[numpy.ndarray, int]:
+    """
+    Parse a column of prices into float64, NaN where missing.
+
+    :return: (numbers, rejected) where rejected counts values that were
+             present but not a number within +/- limit
+    """
+    if pandas.api.types.is_numeric_dtype(values.dtype):
+        numbers = values.to_numpy(dtype=float, na_value=numpy.nan, copy=True)
+        present = ~numpy.isnan(numbers)
+    else:
+        text = values.astype('string').str.replace(_NOISE, '', regex=True)
+        # Accounting style negatives: (12.50)
+        negative = (text.str.startswith('(') & text.str.endswith(')')).to_numpy(dtype=bool, na_value=False)
+        text = text.str.strip('()')
+        missing = text.isna() | text.str.upper().isin(MISSING_MARKERS)
+        numbers = pandas.to_numeric(text.mask(missing), errors='coerce').to_numpy(dtype=float, na_value=numpy.nan)
+        numbers[negative] = -numbers[negative]
+        present = ~missing.to_numpy(dtype=bool)
+
+    with numpy.errstate(invalid='ignore'):
+        numbers[~(numpy.abs(numbers) <= limit)] = numpy.nan
+    rejected = int((present & numpy.isnan(numbers)).sum())
+    return numbers, rejected
+
+
+def normalize_money(values: pandas.Series) -> tuple[pandas.Series, int]:
+    """
+    Vectorized parse of dollar amounts such as "$1,234.50", "(10)" or 99.
+    Missing markers become NaN; anything else that is not a number that
+    fits numeric(12, 2) is rejected (NaN) and counted.
+
+    :return: (float64 dollars rounded to cents, rejected count)
+    """
+    numbers, rejected = _to_numbers(values, MAX_MONEY)
+    return pandas.Series(numpy.round(numbers, 2), index=values.index), rejected
+
+
+def normalize_percent(values: pandas.Series) -> tuple[pandas.Series, int]:
+    """Vectorized parse of percentages such as "45%" or 45.5 into float64"""
+    numbers, rejected = _to_numbers(values, math.inf)
+    return pandas.Series(numbers, index=values.index), rejected
+
+
+def normalize_charge_frame(df: pandas.DataFrame, money_columns: list[str], percent_columns: list[str]) -> dict[str, int]:
+    """
+    Normalize the price columns of a charge frame in place.
+
+    :return: {column: rejected count} for columns with rejects
+    """
+    rejects = {}
+    for columns, normalize in ((money_columns, normalize_money), (percent_columns, normalize_percent)):
+        for col in columns:
+            if col and col in df.columns:
+                df[col], rejected = normalize(df[col])
+                if rejected:
+                    rejects[col] = rejected
+    return rejects
+
+
+def _to_number(value, limit: float) -> float | None:
+    """
+    Scalar counterpart of _to_numbers for values appended one at a time.
+    Raises ValueError for a rejected value.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = float(value)
+        if math.isnan(number):
+            return None
+    else:
+        text = _NOISE_RE.sub('', str(value))
+        negative = text.startswith('(') and text.endswith(')')
+        text = text.strip('()')
+        if text.upper() in MISSING_MARKERS:
+            return None
+        number = -float(text) if negative else float(text)
+    if not abs(number) <= limit:
+        raise ValueError(f"{value!r} is out of range")
+    return number
+
+
+def money_cents(value) -> int | None:
+    """Dollar amount as integer cents (see normalize_money). Raises ValueError if rejected."""
+    number = _to_number(value, MAX_MONEY)
+    return None if number is None else round(number * 100)
+
+
+def percent(value) -> float | None:
+    """Percentage as a float (see normalize_percent). Raises ValueError if rejected."""
+    return _to_number(value, math.inf)
@@ -0,0 +1,145 @@
+import numpy
+import pandas
+from typing import Iterable, List, Optional, Tuple
+
+
+# CPT/HCPCS codes we compare across hospitals. Every DRG is kept.
+ALLOWED_CPT_HCPCS_CODES = frozenset({
+    '19120', '29826', '29881', '33206', '33207', '33208', '33274', '36415', '42820',
+    '43235', '43239', '45378', '45380', '45385', '45391', '47562', '49505', '55700',
+    '55866', '59400', '59510', '59610', '62322', '64483', '66821', '66984', '70450',
+    '70553', '72110', '72148', '72193', '73700', '73702', '73721', '74176', '74177',
+    '74178', '76700', '76805', '76830', '77065', '77066', '77067', '80048', '80053',
+    '80055', '80061', '80069', '80076', '81000', '81001', '81002', '81003', '84153',
+    '84154', '84443', '85025', '85027', '85610', '85730', '90832', '90834', '90837',
+    '90846', '90847', '90853', '92961', '93000', '93306', '93350', '93452', '93650',
+    '93656', '95810', '97110', '97161', '97162', '97163', '99203', '99204', '99205',
+    '99243', '99244', '99385', '99386', '99421', '99422', '99423', '00670', '01214',
+    '01215', '01402', '01961', '01967', '12001', '17134', '20526', '20550', '20552',
+    '20600', '20605', '20606', '20610', '20611', '20612', '20931', '22514', '22551',
+    '22845', '23350', '24220', '25246', '27093', '27096', '27130', '27134', '27369',
+    '27447', '27648', '29826', '29827', '29881', '32555', '36415', '38571', '42820',
+    '45385', '46415', '47000', '47562', '49083', '49505', '50200', '51700', '51701',
+    '51798', '52000', '55700', '55866', '58340', '59400', '59610', '62323', '63047',
+    '63048', '63060', '64447', '64483', '66291', '70110', '70140', '70160', '70200',
+    '70220', '70260', '70330', '70336', '70355', '70450', '70460', '70470', '70480',
+    '70481', '70482', '70486', '70487', '70490', '70491', '70492', '70540', '70543',
+    '70551', '70553', '71045', '71046', '71100', '71101', '71120', '71130', '71250',
+    '71260', '71270', '71550', '71552', '72020', '72040', '72070', '72072', '72082',
+    '72100', '72110', '72125', '72126', '72128', '72129', '72131', '72132', '72141',
+    '72146', '72148', '72156', '72157', '72158', '72170', '72192', '72193', '72194',
+    '72195', '72197', '72202', '72220', '73000', '73010', '73030', '73040', '73050',
+    '73080', '73085', '73090', '73110', '73115', '73130', '73140', '73200', '73201',
+    '73218', '73220', '73221', '73223', '73502', '73525', '73552', '73562', '73564',
+    '73580', '73590', '73610', '73630', '73650', '73660', '73700', '73701', '73718',
+    '73720', '73721', '73723', '73925', '73971', '74018', '74150', '74153', '74160',
+    '74170', '74176', '74177', '74178', '74181', '74183', '74220', '74270', '74280',
+    '74740', '75012', '75557', '75561', '75565', '76000', '76376', '76380', '76506',
+    '76536', '76604', '76641', '76642', '76700', '76705', '76770', '76775', '76776',
+    '76801', '76805', '76811', '76813', '76815', '76816', '76817', '76819', '76830',
+    '76831', '76856', '76857', '76870', '76872', '76882', '76942', '76946', '77002',
+    '77063', '77065', '77066', '77067', '77072', '77073', '77074', '77075', '77077',
+    '78452', '78815', '78816', '80048', '80053', '80055', '80061', '80069', '80076',
+    '81000', '81001', '81002', '81003', '82040', '82043', '82247', '82248', '82306',
+    '82310', '82374', '82435', '82565', '82570', '82607', '82728', '82947', '83036',
+    '83540', '83550', '83735', '83970', '84075', '84100', '84132', '84153', '84154',
+    '84155', '84156', '84439', '84443', '84450', '84460', '85027', '85610', '85652',
+    '85730', '86140', '87086', '88300', '88300', '88307', '88313', '88346', '90832',
+    '90834', '90837', '90846', '90847', '90853', '93000', '93005', '93010', '93016',
+    '93017', '93018', '93225', '93226', '93227', '93308', '93312', '93320', '93325',
+    '93350', '93452', '93880', '93882', '93886', '93888', '93892', '93893', '93923',
+    '93926', '93930', '93931', '93970', '93975', '93976', '93978', '93979', '94070',
+    '94640', '94668', '94760', '94762', '95720', '95810', '96101', '97110', '99152',
+    '99153', '99211', '99243', '99244', '99385', '99386', '99421', '99422', '99423',
+    'C8928'
+})
+
+WHITELISTED_TYPES = frozenset({'CPT', 'HCPCS'})  # Only whitelisted codes allowed
+DRG_TYPES = frozenset({'MS-DRG', 'APR-DRG'})  # All codes allowed
+
+
+class CodeFilter:
+    """
+    Decides which billing codes are relevant, shared by the CSV and JSON ETLs.
+
+    The allowed (type, code) pairs are compiled once into index lookups and a
+    boolean table, so a whole chunk of `code|N` / `code|N|type` columns is
+    matched with a handful of array operations.
+    """
+
+    def __init__(self, allowed_codes: Iterable[str] = ALLOWED_CPT_HCPCS_CODES,
+                 whitelisted_types: Iterable[str] = WHITELISTED_TYPES,
+                 drg_types: Iterable[str] = DRG_TYPES):
+        self.allowed_pairs = frozenset((t, c) for t in whitelisted_types for c in allowed_codes)
+        self.any_code_types = frozenset(drg_types)
+
+        types = sorted(set(whitelisted_types) | self.any_code_types)
+        codes = sorted(set(allowed_codes))
+        self._type_index = pandas.Index(types)
+        self._code_index = pandas.Index(codes)
+
+        # One extra row/column of False so a lookup miss (-1) indexes into it
+        self._pair_table = numpy.zeros((len(types) + 1, len(codes) + 1), dtype=bool)
+        for code_type, code in self.allowed_pairs:
+            self._pair_table[types.index(code_type), codes.index(code)] = True
+        self._any_code = numpy.zeros(len(types) + 1, dtype=bool)
+        for code_type in self.any_code_types:
+            self._any_code[types.index(code_type)] = True
+
+    def is_relevant(self, code_type: str, code: str) -> bool:
+        return code_type in self.any_code_types or (code_type, code) in self.allowed_pairs
+
+    def first_match(self, code_information: Iterable[dict]) -> Optional[Tuple[str, str]]:
+        """Return (type, code) of the first relevant entry of a JSON `code_information` list"""
+        for entry in code_information:
+            code_type = _normalize(entry["type"])
+            code = _normalize(entry["code"])
+            if self.is_relevant(code_type, code):
+                return (code_type, code)
+        return None
+
+    def first_match_frame(self, chunk: pandas.DataFrame, code_columns: List[str],
+                          type_columns: List[str]) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """
+        Find the first relevant code column of every row of a CSV chunk.
+
+        :return: (matched mask, matched codes, matched types); codes and types
+                 are None where the row has no relevant code
+        """
+        pairs = [(c, t) for c, t in zip(code_columns, type_columns)
+                 if c in chunk.columns and t in chunk.columns]
+        rows = len(chunk)
+
+        if not pairs or rows == 0:
+            empty = numpy.full(rows, None, dtype=object)
+            return numpy.zeros(rows, dtype=bool), empty, empty.copy()
+
+        width = len(pairs)
+        codes = _normalize_block(chunk[[c for c, _ in pairs]])
+        types = _normalize_block(chunk[[t for _, t in pairs]])
+
+        type_ids = self._type_index.get_indexer(types)
+        code_ids = self._code_index.get_indexer(codes)
+
+        hits = (self._any_code[type_ids] | self._pair_table[type_ids, code_ids]).reshape(rows, width)
+
+        matched = hits.any(axis=1)
+        first = hits.argmax(axis=1)
+        flat_first = numpy.arange(rows) * width + first
+
+        matched_codes = numpy.where(matched, codes[flat_first], None)
+        matched_types = numpy.where(matched, types[flat_first], None)
+        return matched, matched_codes, matched_types
+
+
+def _normalize(value) -> Optional[str]:
+    return value.strip().upper() if isinstance(value, str) else value
+
+
+def _normalize_block(block: pandas.DataFrame) -> numpy.ndarray:
+    """Flatten a block of columns row-major and upper-case/strip it in one pass"""
+    flat = pandas.Series(block.to_numpy(dtype=object).ravel(), dtype=object)
+    return flat.str.strip().str.upper().to_numpy(dtype=object)
+
+
+CODE_FILTER = CodeFilter()
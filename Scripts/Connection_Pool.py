@@ -0,0 +1,92 @@
+import contextlib
+from functools import lru_cache
+
+import psycopg
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError:  # optional dependency
+    ConnectionPool = None
+
+
+CREDENTIALS_FILE = "../Credentials/cred.txt"
+
+
+@lru_cache(maxsize=None)
+def read_connection_str(path: str = CREDENTIALS_FILE) -> str:
+    """The connection string on the first line of the credentials file, read once per process"""
+    with open(path, "r") as f:
+        return f.readline().strip()
+
+
+class DirectConnections:
+    """
+    Stand-in for a ConnectionPool when psycopg_pool is not installed: the
+    same getconn/putconn/connection() interface, but every checkout opens a
+    new connection and returning it closes it (rolling back anything
+    uncommitted, as the pool does).
+    """
+
+    def __init__(self, conninfo: str, name: str = 'mrf-etl'):
+        self.conninfo = conninfo
+        self.name = name
+
+    def getconn(self) -> psycopg.Connection:
+        return psycopg.connect(self.conninfo)
+
+    def putconn(self, conn: psycopg.Connection):
+        conn.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Commits on success and rolls back on an exception, like ConnectionPool.connection"""
+        with psycopg.connect(self.conninfo) as conn:
+            yield conn
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def create_pool(db_connection_str: str | None = None, min_size: int = 1, max_size: int = 4, timeout: float = 30.0,
+                max_idle: float = 300.0, max_lifetime: float = 3600.0, name: str = 'mrf-etl'):
+    """
+    A psycopg_pool.ConnectionPool for sharing connections across ETL runs,
+    so loading hundreds of files does not open (and TLS handshake) two new
+    connections per file. Connections are checked before they are handed
+    out, so one the server dropped between files is replaced instead of
+    failing the next load, and are recycled after max_lifetime seconds.
+    Statements executed with prepare=True stay prepared on a connection
+    for as long as it lives in the pool.
+
+    Without psycopg_pool installed this returns DirectConnections, which
+    connects per checkout as the scripts did before pooling.
+
+    :param db_connection_str: default read_connection_str()
+    :param max_size: upper bound on connections; getconn waits up to timeout seconds for one
+    :param max_idle: seconds an idle connection above min_size is kept
+
+    Usage:
+        with create_pool() as pool:
+            pipeline_process(urls, pool=pool)
+    """
+    db_connection_str = db_connection_str or read_connection_str()
+    if ConnectionPool is None:
+        return DirectConnections(db_connection_str, name)
+
+    return ConnectionPool(
+        db_connection_str,
+        min_size=min_size,
+        max_size=max_size,
+        timeout=timeout,
+        max_idle=max_idle,
+        max_lifetime=max_lifetime,
+        check=ConnectionPool.check_connection,
+        name=name,
+        open=True,
+    )
@@ -4,11 +4,18 @@ import requests
 import threading
 import re
 import mimetypes
+import tempfile
 import time
 from pathlib import Path
 from queue import Queue
 from Read_Hospital_CSV import HospitalChargeETLCSV
 from Read_Hospital_JSON import HospitalChargeETLJSON
+from Output_Sinks import ChargeSink, PostgresSink
+from Normalized_Cache import CachingSink, NormalizedCache, mrf_digest
+from Run_Metrics import RunMetrics
+from Profiling import FileProfiler, ProfileConfig
+from Index_Management import deferred_indexes
+from Connection_Pool import create_pool, read_connection_str
 from urllib.parse import urlparse, unquote
 
 def get_filename_from_url(response, original_url=None):
@@ -72,6 +79,7 @@ def download_file(url, download_dir):
         "Accept-Language": "en-US,en;q=0.9",
         "Connection": "keep-alive",
     }
+    download_path = None
     try:
         response = requests.get(url, headers=headers, allow_redirects=True, stream=True)
         response.raise_for_status()
@@ -95,6 +103,9 @@ def download_file(url, download_dir):
             raise
     except Exception as e:
         print(f"Error downloading {url}: {str(e)}")
+        # Do not leave a partial file behind (e.g. the connection dropped mid-body)
+        if download_path is not None and os.path.exists(download_path):
+            os.remove(download_path)
         return None
 
 
@@ -148,7 +159,7 @@ def unzip_if_needed(file_path, extract_to=None, target_extensions=None):
     return extracted_paths[0], cleanup_paths
 
 
-def process_file(file_path):
+def process_file(file_path, sink=None, cache_dir=None, metrics=None, profile=None, memory_limit=None, pool=None):
     """Move through directories and process files"""
     
     # Handle directory case (multiple files extracted)
@@ -160,32 +171,103 @@ def process_file(file_path):
                 full_path = os.path.join(root, file)
                 file_extension = os.path.splitext(full_path)[1].lower()
                 if file_extension in ['.csv', '.json']:
-                    process_single_file(full_path)
+                    process_single_file(full_path, sink, cache_dir, metrics, profile, memory_limit, pool)
         return
     
     # Handle single file case
-    process_single_file(file_path)
+    process_single_file(file_path, sink, cache_dir, metrics, profile, memory_limit, pool)
 
-def process_single_file(file_path):
-    """Process a single file"""
+def process_single_file(file_path, sink: ChargeSink = None, cache_dir=None, metrics: RunMetrics = None,
+                        profile: ProfileConfig = None, memory_limit: int = None, pool=None):
+    """
+    Process a single file
+
+    Args:
+        file_path: CSV or JSON MRF
+        sink: Output_Sinks.ChargeSink to write to (e.g. ParquetSink, NullSink).
+              If None, loads into Postgres using ../Credentials/cred.txt
+        cache_dir: Normalized_Cache directory. A file whose content is already
+                   cached is loaded from the cache without parsing; otherwise
+                   its normalized output is cached while it is processed.
+        metrics: Run_Metrics.RunMetrics the file's report is recorded in
+        profile: Profiling.ProfileConfig; if it applies to the file, the ETL runs
+                 under a profiler and the artifacts are listed in the file's report
+        memory_limit: RSS ceiling in bytes; the ETL runs in its memory-bounded mode
+        pool: Connection_Pool.create_pool pool the default Postgres sink borrows connections from
+    """
     print(f"Processing {file_path}...")
-    
+    profiler = None
+    if profile is not None and profile.applies(file_path):
+        output_dir = profile.output_dir or os.path.join(metrics.report_dir if metrics and metrics.report_dir else "../Reports",
+                                                        "profiles")
+        profiler = FileProfiler(profile, output_dir, os.path.splitext(os.path.basename(file_path))[0])
+
+    start = time.time()
+    try:
+        if profiler is None:
+            result, source = _process_single_file(file_path, sink, cache_dir, memory_limit, pool)
+        else:
+            with profiler:
+                result, source = _process_single_file(file_path, sink, cache_dir, memory_limit, pool)
+            print(f"Profile written to {profiler.artifacts['profile_report']}")
+    except Exception as e:
+        if metrics is not None:
+            metrics.record_file(file_path, None, time.time() - start, error=str(e),
+                                artifacts=profiler.artifacts if profiler else None)
+        raise
+    if metrics is not None:
+        metrics.record_file(file_path, result, time.time() - start, source=source,
+                            artifacts=profiler.artifacts if profiler else None)
+
+
+def _process_single_file(file_path, sink, cache_dir, memory_limit, pool):
+    """:return: (ETL result or cache load summary, 'cache' if loaded from the cache else None)"""
     db_connection_str = ""
-    with open("../Credentials/cred.txt", "r") as f:
-        db_connection_str = f.readline()
+    if sink is None and pool is None:
+        db_connection_str = read_connection_str()
+
+    if cache_dir is not None:
+        cache = NormalizedCache(cache_dir)
+        digest = mrf_digest(file_path)
+        if sink is None:
+            sink = PostgresSink(db_connection_str or None, pool)
+        if cache.has(digest):
+            result = cache.load(digest, sink)
+            print(f"Loaded {result['rows']:,} cached rows for {result['hospital_name']}: {file_path}")
+            return result, 'cache'
+        sink = CachingSink(sink, cache, digest, source=os.path.basename(file_path))
 
     file_extension = os.path.splitext(file_path)[1].lower()
 
     if file_extension == '.json':
-        etl = HospitalChargeETLJSON(db_connection_str, file_path)
+        etl = HospitalChargeETLJSON(db_connection_str, file_path, sink=sink, memory_limit=memory_limit, pool=pool)
         result = etl.execute()
     elif file_extension == '.csv':
-        etl = HospitalChargeETLCSV(db_connection_str, file_path)
+        etl = HospitalChargeETLCSV(db_connection_str, file_path, sink=sink, memory_limit=memory_limit, pool=pool)
         result = etl.execute()
     else:
         raise ValueError(f"Unsupported file type: {file_extension}. Only .json and .csv are supported.")
 
     print(f"Processing complete: {file_path}")
+    return result, None
+
+
+def reload_from_cache(cache_dir, sink: ChargeSink = None):
+    """
+    Bulk load every hospital in a Normalized_Cache into a sink (Postgres by
+    default) without downloading or parsing anything.
+    """
+    cache = NormalizedCache(cache_dir)
+    if sink is None:
+        sink = PostgresSink(read_connection_str())
+
+    for digest in cache.digests():
+        start = time.time()
+        try:
+            result = cache.load(digest, sink)
+            print(f"Reloaded {result['hospital_name']} from cache: {result['rows']:,} rows in {time.time() - start:.2f}s")
+        except Exception as e:
+            print(f"Error reloading cache entry {digest}: {e}")
 
 
 def cleanup(paths):
@@ -203,7 +285,7 @@ def cleanup(paths):
             print(f"Warning: Could not delete {path}: {e}")
 
 
-def download_worker(url_queue, result_queue, download_dir, target_extensions=None):
+def download_worker(url_queue, result_queue, download_dir, target_extensions=None, metrics=None):
     """
     Worker thread that downloads files.
     
@@ -212,6 +294,7 @@ def download_worker(url_queue, result_queue, download_dir, target_extensions=Non
         result_queue: Queue to put results in
         download_dir: Directory to download to
         target_extensions: List of file extensions to extract from zips (e.g., ['.csv', '.json'])
+        metrics: Run_Metrics.RunMetrics download, unzip and backpressure times are recorded in
     """
     while True:
         item = url_queue.get()
@@ -220,15 +303,30 @@ def download_worker(url_queue, result_queue, download_dir, target_extensions=Non
         
         url = item
         extracted_path = None
-        cleanup_paths = []
+        # Each download gets its own directory: servers often use the same generic
+        # filename (standardcharges.csv), and concurrent downloads or extractions
+        # must not overwrite or delete each other's files
+        file_dir = tempfile.mkdtemp(dir=download_dir)
+        cleanup_paths = [file_dir]
         
         try:
-            downloaded_file = download_file(url, download_dir)
-            extracted_path, cleanup_paths = unzip_if_needed(
+            download_start = time.time()
+            downloaded_file = download_file(url, file_dir)
+            if metrics is not None and downloaded_file is not None:
+                metrics.record_download(url, downloaded_file, time.time() - download_start)
+            unzip_start = time.time()
+            extracted_path, extracted_paths = unzip_if_needed(
                 downloaded_file, 
                 target_extensions=target_extensions
             )
+            cleanup_paths = extracted_paths + cleanup_paths
+            if metrics is not None and extracted_path != downloaded_file:
+                metrics.record_unzip(downloaded_file, time.time() - unzip_start)
+            # Blocks while the processor is max_buffered files behind
+            put_start = time.time()
             result_queue.put(('success', extracted_path, cleanup_paths))
+            if metrics is not None:
+                metrics.record_queue_wait('downloader', time.time() - put_start)
         except Exception as e:
             print(f"Error downloading {url}: {e}")
             # Even on error, try to cleanup what we downloaded
@@ -239,7 +337,9 @@ def download_worker(url_queue, result_queue, download_dir, target_extensions=Non
             url_queue.task_done()
 
 
-def pipeline_process(urls, download_dir="./downloads", max_buffered=1, target_extensions=None):
+def pipeline_process(urls, download_dir="./downloads", max_buffered=1, target_extensions=None, sink=None, cache_dir=None,
+                     metrics=None, profile=None, memory_limit=None, defer_indexes=False, pool=None,
+                     download_workers=1):
     """
     Download and process files with pipelining and backpressure control.
     Downloads next file while processing current file, but limits how many
@@ -251,25 +351,51 @@ def pipeline_process(urls, download_dir="./downloads", max_buffered=1, target_ex
         max_buffered: Max number of files to download ahead (default: 1)
         target_extensions: List of file extensions to extract from zips (e.g., ['.csv', '.json'])
                           If None, extracts all files
+        sink: Output_Sinks.ChargeSink every file is written to (default: Postgres)
+        cache_dir: Normalized_Cache directory shared by every file (see process_single_file)
+        metrics: Run_Metrics.RunMetrics for the run; call its finish() afterwards to write the reports
+        profile: Profiling.ProfileConfig for the files to profile (see process_single_file)
+        memory_limit: RSS ceiling in bytes for each ETL (see process_single_file)
+        defer_indexes: for full rebuilds; drop the deferrable indexes in Database/Indexes.sql
+                       for the run and recreate them concurrently at the end
+        pool: connection pool shared by every file's Postgres sink; without a sink or a pool,
+              one is created for the run (see Connection_Pool.create_pool)
+        download_workers: number of files downloaded at once; up to download_workers + max_buffered
+                          files can be on disk besides the one being processed
     """
+    if defer_indexes:
+        with deferred_indexes(read_connection_str()):
+            return pipeline_process(urls, download_dir, max_buffered, target_extensions, sink, cache_dir,
+                                    metrics, profile, memory_limit, pool=pool, download_workers=download_workers)
+
+    if sink is None and pool is None:
+        with create_pool() as pool:
+            return pipeline_process(urls, download_dir, max_buffered, target_extensions, sink, cache_dir,
+                                    metrics, profile, memory_limit, pool=pool, download_workers=download_workers)
+
     os.makedirs(download_dir, exist_ok=True)
     
     # Use maxsize to limit queue - this provides backpressure!
     url_queue = Queue(maxsize=max_buffered)
     result_queue = Queue(maxsize=max_buffered)
     
-    # Start download worker thread
-    download_thread = threading.Thread(
-        target=download_worker,
-        args=(url_queue, result_queue, download_dir, target_extensions)
-    )
-    download_thread.start()
+    # Start download worker threads
+    download_threads = [
+        threading.Thread(
+            target=download_worker,
+            args=(url_queue, result_queue, download_dir, target_extensions, metrics)
+        )
+        for _ in range(download_workers)
+    ]
+    for download_thread in download_threads:
+        download_thread.start()
     
     # Feed URLs in a separate thread to avoid blocking
     def feed_urls():
         for url in urls:
             url_queue.put(url)  # Blocks if queue is full (backpressure!)
-        url_queue.put(None)  # Poison pill
+        for _ in download_threads:
+            url_queue.put(None)  # Poison pill, one per worker
     
     feeder_thread = threading.Thread(target=feed_urls)
     feeder_thread.start()
@@ -277,12 +403,15 @@ def pipeline_process(urls, download_dir="./downloads", max_buffered=1, target_ex
     # Process files as they become available
     for i in range(len(urls)):
         # Wait for current file to finish downloading
+        wait_start = time.time()
         status, file_path, cleanup_paths = result_queue.get()
+        if metrics is not None:
+            metrics.record_queue_wait('processor', time.time() - wait_start)
         
         if status == 'success':
             try:
                 # Process the file
-                process_file(file_path)
+                process_file(file_path, sink, cache_dir, metrics, profile, memory_limit, pool)
             except Exception as e:
                 print(f"Error processing {file_path}: {e}")
             finally:
@@ -295,7 +424,8 @@ def pipeline_process(urls, download_dir="./downloads", max_buffered=1, target_ex
         
     # Wait for threads to finish
     feeder_thread.join()
-    download_thread.join()
+    for download_thread in download_threads:
+        download_thread.join()
 
 def main():
     # Configuration - just list URLs, fil enames are auto-detected
@@ -380,7 +510,7 @@ def main():
             with open(file_name, "r") as f:
                 for line in f:
                     if "location-name" in line:
-                        print(f"Adding MRF for {line[line.find(":") + 1:].strip()} to the list of urls")
+                        print(f"Adding MRF for {line[line.find(':') + 1:].strip()} to the list of urls")
                     if "mrf-url" in line:
                         urls.add(line[line.find(":") + 1:].strip())
 
@@ -395,7 +525,9 @@ def main():
     print("=" * 50)
     # max_buffered=1 means download at most 1 file ahead
     # Increase if you have more disk space and want more parallelism
-    pipeline_process(urls, download_dir, max_buffered=3, target_extensions=target_extensions)
+    metrics = RunMetrics("../Reports")
+    pipeline_process(urls, download_dir, max_buffered=3, target_extensions=target_extensions, metrics=metrics)
+    metrics.finish()
     total_time = time.time() - overall_start
 
     print(f"The process took {total_time:.2f}s")
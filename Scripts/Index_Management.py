@@ -0,0 +1,156 @@
+import argparse
+import contextlib
+import os
+import re
+import time
+
+import psycopg
+
+from Connection_Pool import read_connection_str
+
+
+INDEXES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Database", "Indexes.sql")
+
+DEFERRED_SECTION = "-- Deferred during full rebuilds"
+
+_CREATE_INDEX = re.compile(
+    r"CREATE\s+(?P<unique>UNIQUE\s+)?INDEX\s+IF\s+NOT\s+EXISTS\s+(?P<name>\w+)\s+ON\s+(?P<table>\w+)(?P<rest>.*)",
+    re.IGNORECASE | re.DOTALL)
+
+
+class IndexDefinition:
+    """One CREATE INDEX statement from Indexes.sql"""
+
+    def __init__(self, name: str, table: str, statement: str, deferrable: bool):
+        self.name = name
+        self.table = table
+        self.statement = statement
+        self.deferrable = deferrable
+
+    def create_sql(self, concurrently: bool = False) -> str:
+        if not concurrently:
+            return self.statement
+        return re.sub(r"\bINDEX\s+IF", "INDEX CONCURRENTLY IF", self.statement, count=1, flags=re.IGNORECASE)
+
+    def __repr__(self):
+        return f"IndexDefinition({self.name!r} on {self.table!r}, deferrable={self.deferrable})"
+
+
+def load_index_definitions(path: str = INDEXES_FILE) -> list[IndexDefinition]:
+    with open(path) as f:
+        text = f.read()
+
+    definitions = []
+    deferrable = False
+    for statement in text.split(';'):
+        lines = []
+        for line in statement.splitlines():
+            if line.strip() == DEFERRED_SECTION:
+                deferrable = True
+            if not line.strip().startswith('--'):
+                lines.append(line)
+        sql = "\n".join(lines).strip()
+        match = _CREATE_INDEX.match(sql)
+        if match:
+            definitions.append(IndexDefinition(match['name'], match['table'], sql, deferrable))
+    return definitions
+
+
+def index_status(conn, definitions: list[IndexDefinition] = None) -> dict[str, str]:
+    """:return: {index name: 'valid', 'invalid' (a failed concurrent build) or 'missing'}"""
+    definitions = definitions if definitions is not None else load_index_definitions()
+    rows = conn.execute("""
+        SELECT c.relname, i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = ANY(%s)
+          AND pg_catalog.pg_table_is_visible(c.oid)
+    """, ([d.name for d in definitions],)).fetchall()
+    found = dict(rows)
+    return {d.name: ('missing' if d.name not in found else 'valid' if found[d.name] else 'invalid')
+            for d in definitions}
+
+
+def drop_indexes(conn, definitions: list[IndexDefinition] = None, deferrable_only: bool = True) -> list[str]:
+    """
+    Drop indexes so bulk loads do not maintain them row by row.
+
+    :param conn: autocommit connection
+    :return: names of the indexes dropped
+    """
+    definitions = definitions if definitions is not None else load_index_definitions()
+    dropped = []
+    for definition in definitions:
+        if deferrable_only and not definition.deferrable:
+            continue
+        conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {definition.name}")
+        dropped.append(definition.name)
+    return dropped
+
+
+def create_indexes(conn, definitions: list[IndexDefinition] = None, concurrently: bool = True) -> dict[str, float]:
+    """
+    Create the indexes that are missing, rebuilding any left invalid by a
+    failed concurrent build. Concurrent builds do not block the loader or
+    readers but cannot run in a transaction.
+
+    :param conn: autocommit connection
+    :return: {index name: seconds to build} for the indexes built
+    """
+    definitions = definitions if definitions is not None else load_index_definitions()
+    status = index_status(conn, definitions)
+    built = {}
+    for definition in definitions:
+        if status[definition.name] == 'valid':
+            continue
+        if status[definition.name] == 'invalid':
+            conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {definition.name}")
+        start = time.perf_counter()
+        conn.execute(definition.create_sql(concurrently))
+        built[definition.name] = time.perf_counter() - start
+    for table in sorted({d.table for d in definitions}):
+        conn.execute(f"ANALYZE {table}")
+    return built
+
+
+@contextlib.contextmanager
+def deferred_indexes(db_connection_str: str, definitions: list[IndexDefinition] = None):
+    """
+    Drop the deferrable indexes for the duration of a full rebuild and
+    recreate them concurrently afterwards, also when the rebuild fails.
+
+    Usage:
+        with deferred_indexes(db_connection_str):
+            pipeline_process(urls)
+    """
+    definitions = definitions if definitions is not None else load_index_definitions()
+    with psycopg.connect(db_connection_str, autocommit=True) as conn:
+        drop_indexes(conn, definitions)
+    try:
+        yield
+    finally:
+        with psycopg.connect(db_connection_str, autocommit=True) as conn:
+            create_indexes(conn, definitions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the secondary indexes in Database/Indexes.sql")
+    parser.add_argument('command', choices=('status', 'create', 'drop'))
+    parser.add_argument('--db', help="connection string, default ../Credentials/cred.txt")
+    parser.add_argument('--all', action='store_true', help="drop every index, not only the deferrable ones")
+    args = parser.parse_args(argv)
+
+    with psycopg.connect(args.db or read_connection_str(), autocommit=True) as conn:
+        if args.command == 'status':
+            for name, status in index_status(conn).items():
+                print(f"{name:<40} {status}")
+        elif args.command == 'create':
+            for name, seconds in create_indexes(conn).items():
+                print(f"Built {name} in {seconds:.1f}s")
+        else:
+            for name in drop_indexes(conn, deferrable_only=not args.all):
+                print(f"Dropped {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import codecs
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, NamedTuple
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:  # optional dependency
+    simdjson = None
+
+
+# Fastest first. simdjson parses to a compact tape and only builds Python
+# objects for the values that are read; orjson builds everything but is
+# several times faster than the stdlib decoder.
+PREFERENCE = ('simdjson', 'orjson', 'json')
+
+# Top-level key left lazy with simdjson so rejected items are never materialized
+CHARGES_KEY = 'standard_charge_information'
+
+# Not in PREFERENCE: decodes one charge item at a time, in bounded memory,
+# at the cost of reading the file twice (see stream_json)
+STREAM = 'stream'
+
+# Rough peak memory per byte of file while decoding, for choosing a decoder
+# that fits in the memory available
+MEMORY_PER_FILE_BYTE = {'simdjson': 3, 'orjson': 8, 'json': 10, STREAM: 0}
+
+
+class JSONDocument(NamedTuple):
+    data: Any
+    backend: str
+    decode_time: float
+
+
+def available_decoders() -> list[str]:
+    installed = {'simdjson': simdjson is not None, 'orjson': orjson is not None, 'json': True}
+    return [name for name in PREFERENCE if installed[name]]
+
+
+def select_decoder(backend: str = 'auto', file_path: str = None, memory_available: int = None) -> str:
+    """
+    :param memory_available: with 'auto', bytes the decode may use; the fastest
+                             decoder expected to fit is chosen, else STREAM
+    """
+    available = available_decoders()
+    if backend == STREAM:
+        return STREAM
+    if backend == 'auto':
+        if memory_available is not None and file_path is not None:
+            size = os.path.getsize(file_path)
+            fitting = [name for name in available if size * MEMORY_PER_FILE_BYTE[name] <= memory_available]
+            return fitting[0] if fitting else STREAM
+        return available[0]
+    if backend not in available:
+        raise ValueError(f"JSON decoder '{backend}' is not available. Installed: {available}")
+    return backend
+
+
+def _read_bytes(file_path: str) -> bytes:
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    if raw.startswith(codecs.BOM_UTF8):
+        raw = raw[len(codecs.BOM_UTF8):]
+    return raw
+
+
+def materialize(value):
+    """Convert a lazy simdjson value to plain Python objects; anything else is returned as is"""
+    if simdjson is not None:
+        if isinstance(value, simdjson.Array):
+            return value.as_list()
+        if isinstance(value, simdjson.Object):
+            return value.as_dict()
+    return value
+
+
+def _decode_simdjson(raw: bytes) -> dict:
+    # Hospital metadata is converted to plain Python values; the charge list
+    # stays a lazy simdjson Array (it keeps its parser alive), so a charge
+    # item's payers_information is only decoded if the item is read.
+    # Object.items() would materialize every value, so go through keys().
+    document = simdjson.Parser().parse(raw)
+    return {key: document[key] if key == CHARGES_KEY else materialize(document[key]) for key in document.keys()}
+
+
+def _decode(backend: str, raw: bytes):
+    if backend == 'simdjson':
+        return _decode_simdjson(raw)
+    if backend == 'orjson':
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def load_json(file_path: str, backend: str = 'auto', memory_available: int = None) -> JSONDocument:
+    """
+    Decode a JSON MRF with the fastest available decoder
+
+    :param backend: 'auto', 'simdjson', 'orjson', 'json' or 'stream'
+    :param memory_available: see select_decoder
+    """
+    backend = select_decoder(backend, file_path, memory_available)
+    if backend == STREAM:
+        return stream_json(file_path)
+    start = time.time()
+    data = _decode(backend, _read_bytes(file_path))
+    return JSONDocument(data, backend, time.time() - start)
+
+
+_WHITESPACE = re.compile(r'\s*')
+_DECODER = json.JSONDecoder()
+
+
+class _JSONReader:
+    """Decodes consecutive JSON values from a text file through a bounded buffer"""
+
+    def __init__(self, f, buffer_size: int):
+        self.f = f
+        self.buffer_size = buffer_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int):
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            return
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self) -> str:
+        """Next non-whitespace character, '' at the end of the file"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill(self.buffer_size)
+
+    def take(self, expected: str) -> str:
+        char = self.peek()
+        if not char or char not in expected:
+            raise ValueError(f"Expected one of {expected!r} in JSON, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        size = self.buffer_size
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+                # A number cut off by the end of the buffer still decodes
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # The value runs past the buffer; grow geometrically so huge values stay linear
+            self._fill(size)
+            size *= 2
+
+
+def _top_level(file_path: str, buffer_size: int):
+    """
+    Yield (key, value) for the top-level object; the value of CHARGES_KEY is a
+    generator over its items that must be exhausted before the next pair
+    """
+    def items(reader):
+        reader.take('[')
+        if reader.peek() == ']':
+            reader.pos += 1
+            return
+        while True:
+            yield reader.value()
+            if reader.take(',]') == ']':
+                return
+
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        reader = _JSONReader(f, buffer_size)
+        reader.take('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.value()
+            reader.take(':')
+            yield key, items(reader) if key == CHARGES_KEY else reader.value()
+            if reader.take(',}') == '}':
+                return
+
+
+class StreamedItems:
+    """The charge items of a JSON MRF, decoded from the file each time they are iterated"""
+
+    def __init__(self, file_path: str, count: int, buffer_size: int):
+        self.file_path = file_path
+        self.count = count
+        self.buffer_size = buffer_size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        for key, value in _top_level(self.file_path, self.buffer_size):
+            if key == CHARGES_KEY:
+                yield from value
+                return
+
+
+def stream_json(file_path: str, buffer_size: int = 1 << 20) -> JSONDocument:
+    """
+    Decode a JSON MRF without holding it in memory. A first pass reads the
+    hospital metadata, wherever it sits relative to the charge list, and
+    counts the charge items; the items are then StreamedItems, decoded one
+    at a time on every iteration. Peak memory is about buffer_size plus the
+    largest single item.
+    """
+    start = time.time()
+    data = {}
+    count = 0
+    for key, value in _top_level(file_path, buffer_size):
+        if key == CHARGES_KEY:
+            count = sum(1 for _ in value)
+        else:
+            data[key] = value
+    data[CHARGES_KEY] = StreamedItems(file_path, count, buffer_size)
+    return JSONDocument(data, STREAM, time.time() - start)
+
+
+def benchmark_decoders(file_path: str, repeat: int = 3) -> dict[str, float]:
+    """Best-of-repeat decode time in seconds for every installed decoder"""
+    raw = _read_bytes(file_path)
+    results = {}
+    for backend in available_decoders():
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            data = _decode(backend, raw)
+            # Touch every item so lazy decoders are not flattered
+            for item in data.get(CHARGES_KEY) or []:
+                item["code_information"]
+            timings.append(time.time() - start)
+            del data
+        results[backend] = min(timings)
+    return results
+
+
+if __name__ == "__main__":
+    size = len(_read_bytes(sys.argv[1])) / 1e6
+    for backend, seconds in benchmark_decoders(sys.argv[1]).items():
+        print(f"{backend:>8}: {seconds:.3f}s ({size / seconds:,.1f} MB/s)")
@@ -0,0 +1,247 @@
+import gzip
+import io
+import mimetypes
+import os
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlparse
+
+
+# How a file is served:
+#   plain       the bytes, named by the URL path
+#   zip         a zip archive holding the file, at <name>.zip
+#   gzip        the bytes with Content-Encoding: gzip
+#   redirect    302s (redirects of them) ending at the plain file
+#   attachment  a URL without a file name, named by Content-Disposition
+#   forbidden   403, as some hospital sites answer scripted clients
+#   throttled   the plain file at the route's own bandwidth
+#   truncated   a full Content-Length, then the connection drops halfway
+MODES = ('plain', 'zip', 'gzip', 'redirect', 'attachment', 'forbidden', 'throttled', 'truncated')
+
+_CHUNK_SIZE = 16 * 1024
+
+
+class _Route:
+    def __init__(self, body: bytes | None, mode: str, filename: str, status: int = 200, headers: dict = None,
+                 bandwidth: float | None = None, location: str | None = None):
+        self.body = body
+        self.mode = mode
+        self.filename = filename
+        self.status = status
+        self.headers = headers or {}
+        self.bandwidth = bandwidth
+        self.location = location
+
+
+class LocalMRFServer:
+    """
+    A local HTTP server standing in for hospital websites, so downloading,
+    unzipping and the whole pipeline can be run and timed offline.
+
+    Files are registered under a mode (see MODES) and the server answers
+    with the matching behaviour; index() publishes a cms-hpt.txt listing
+    MRF URLs like a hospital's. bandwidth (bytes per second, per response)
+    and latency (seconds before each response) apply to every route.
+    Every request is logged in .requests as (path, status, bytes sent).
+
+    Usage:
+        with LocalMRFServer(bandwidth=5e6, latency=0.05) as server:
+            url = server.add_file('/root/mrf.csv', mode='zip')
+            index_url = server.index('Hospital A', [url])
+            pipeline_process([url], sink=NullSink())
+    """
+
+    def __init__(self, bandwidth: float | None = None, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.routes = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    def _add(self, path: str, route: _Route) -> str:
+        self.routes[path] = route
+        return self.url(path)
+
+    def add_file(self, file_path: str | None = None, mode: str = 'plain', data: bytes | None = None,
+                 filename: str | None = None, bandwidth: float | None = None, redirects: int = 2) -> str:
+        """
+        Serve a file (or data, named filename) and return its URL.
+
+        :param bandwidth: bytes per second for this route; throttled defaults to a tenth of the server's, or 256 KB/s
+        :param redirects: number of hops for redirect
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode: {mode}. Expected one of {MODES}")
+        if data is None:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+        filename = filename or os.path.basename(file_path)
+        index = len(self.routes)
+        name = quote(filename)
+
+        if mode == 'zip':
+            archive = io.BytesIO()
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr(filename, data)
+            return self._add(f"/files/{index}/{name}.zip", _Route(archive.getvalue(), mode, filename + '.zip'))
+
+        if mode == 'gzip':
+            return self._add(f"/files/{index}/{name}",
+                             _Route(gzip.compress(data, compresslevel=1), mode, filename,
+                                    headers={'Content-Encoding': 'gzip'}))
+
+        if mode == 'redirect':
+            target = f"/files/{index}/{name}"
+            self._add(target, _Route(data, 'plain', filename))
+            for hop in range(redirects):
+                source = f"/redirect/{index}/{hop}"
+                self._add(source, _Route(None, mode, filename, status=302, location=target))
+                target = source
+            return self.url(target)
+
+        if mode == 'attachment':
+            return self._add(f"/download?id={index}", _Route(data, mode, filename, headers={
+                'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+            }))
+
+        if mode == 'forbidden':
+            return self._add(f"/files/{index}/{name}", _Route(b"Forbidden", mode, filename, status=403))
+
+        if mode == 'throttled':
+            bandwidth = bandwidth or (self.bandwidth / 10 if self.bandwidth else 256_000)
+
+        return self._add(f"/files/{index}/{name}", _Route(data, mode, filename, bandwidth=bandwidth))
+
+    def index(self, location_name: str, mrf_urls: list[str], name: str | None = None) -> str:
+        """Publish a cms-hpt.txt listing mrf_urls for one location; returns its URL"""
+        lines = []
+        for mrf_url in mrf_urls:
+            lines += [
+                f"location-name: {location_name}",
+                f"source-page-url: {self.base_url}/price-transparency",
+                f"mrf-url: {mrf_url}",
+                "contact-name: Price Transparency Office",
+                "contact-email: transparency@example.org",
+                "",
+            ]
+        path = f"/{quote(name)}/cms-hpt.txt" if name else f"/sites/{len(self.routes)}/cms-hpt.txt"
+        return self._add(path, _Route("\n".join(lines).encode(), 'plain', 'cms-hpt.txt'))
+
+    def _log(self, path: str, status: int, sent: int):
+        with self._lock:
+            self.requests.append((path, status, sent))
+
+    def start(self) -> 'LocalMRFServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name="local-mrf-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _handler(server: LocalMRFServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if server.latency:
+                time.sleep(server.latency)
+            path = urlparse(self.path)
+            route = server.routes.get(path.path + (f"?{path.query}" if path.query else ''))
+            if route is None:
+                self._send_body(404, b"Not found", {})
+                return
+            if route.location is not None:
+                self.send_response(route.status)
+                self.send_header('Location', route.location)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                server._log(self.path, route.status, 0)
+                return
+
+            headers = dict(route.headers)
+            content_type = None if route.mode == 'attachment' else mimetypes.guess_type(route.filename)[0]
+            headers['Content-Type'] = content_type or 'application/octet-stream'
+            self._send_body(route.status, route.body, headers, route.bandwidth or server.bandwidth,
+                            truncate=route.mode == 'truncated')
+
+        def _send_body(self, status: int, body: bytes, headers: dict, bandwidth: float | None = None,
+                       truncate: bool = False):
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(body)))
+            if truncate:
+                self.send_header('Connection', 'close')
+            self.end_headers()
+
+            end = len(body) // 2 if truncate else len(body)
+            sent = 0
+            start = time.monotonic()
+            try:
+                while sent < end:
+                    chunk = body[sent:min(sent + _CHUNK_SIZE, end)]
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if bandwidth:
+                        ahead = sent / bandwidth - (time.monotonic() - start)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            if truncate:
+                self.close_connection = True
+            server._log(self.path, status, sent)
+
+    return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve MRFs locally the way hospital websites do")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--mode', choices=MODES, default='plain')
+    parser.add_argument('--bandwidth', type=float, default=None, help="bytes per second")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds")
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    mrf_server = LocalMRFServer(args.bandwidth, args.latency, port=args.port)
+    urls = [mrf_server.add_file(path, args.mode) for path in args.files]
+    print(f"Index: {mrf_server.index('Local Hospital', urls)}")
+    for url in urls:
+        print(f"MRF:   {url}")
+    mrf_server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mrf_server.stop()
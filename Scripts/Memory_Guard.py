@@ -0,0 +1,120 @@
+import gc
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # optional dependency
+    psutil = None
+
+
+class MemoryCeilingExceeded(MemoryError):
+    """Raised instead of being OOM killed when the RSS stays above the ceiling after degrading"""
+
+
+def current_rss() -> int | None:
+    """Resident set size of this process in bytes, None if it cannot be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+def process_peak_rss() -> int | None:
+    """Peak RSS over the life of the process in bytes"""
+    if resource is None:
+        return None
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class MemoryGuard:
+    """
+    Watches the process RSS while an ETL runs.
+
+    Without a ceiling it only samples, so the run can report its peak.
+    With one, callers ask under_pressure() at points where they can shed
+    memory (flush buffered batches, read smaller chunks); past the soft
+    limit it answers True, and past the ceiling it collects garbage and,
+    if that does not help, raises MemoryCeilingExceeded so the file fails
+    cleanly instead of the pipeline being OOM killed.
+
+    The RSS is read at most every check_interval seconds, so asking per
+    row is cheap and a caller sheds memory at most that often. The peak is
+    the highest sample, so short spikes between samples are missed.
+
+    Usage:
+        guard = MemoryGuard(ceiling_bytes=4 << 30)
+        ...
+        if sizer.should_flush(batches) or guard.under_pressure():
+            flush(batches)
+    """
+
+    def __init__(self, ceiling_bytes: int | None = None, soft_fraction: float = 0.8, check_interval: float = 0.1):
+        self.ceiling_bytes = ceiling_bytes
+        self.soft_bytes = int(ceiling_bytes * soft_fraction) if ceiling_bytes else None
+        self.check_interval = check_interval
+
+        self.peak_bytes = 0
+        self.pressure_events = 0
+        self._last_check = 0.0
+        self._last_rss = None
+        self.sample()
+
+        if ceiling_bytes and self._last_rss is None:
+            raise RuntimeError("A memory ceiling needs the process RSS, which cannot be read on this platform "
+                               "(install psutil)")
+
+    @property
+    def bounded(self) -> bool:
+        return self.ceiling_bytes is not None
+
+    def sample(self) -> int | None:
+        """Read the RSS now and update the peak"""
+        rss = current_rss()
+        self._last_check = time.monotonic()
+        self._last_rss = rss
+        if rss is not None and rss > self.peak_bytes:
+            self.peak_bytes = rss
+        return rss
+
+    def headroom(self) -> int | None:
+        """Bytes left below the soft limit, None when unbounded"""
+        if not self.bounded:
+            return None
+        return self.soft_bytes - (self.sample() or 0)
+
+    def under_pressure(self) -> bool:
+        """True, at most once per check_interval, when the RSS is past the soft limit"""
+        if time.monotonic() - self._last_check < self.check_interval:
+            return False
+        rss = self.sample()
+        if not self.bounded or rss is None or rss < self.soft_bytes:
+            return False
+
+        self.pressure_events += 1
+        if rss >= self.ceiling_bytes:
+            gc.collect()
+            rss = self.sample()
+            if rss >= self.ceiling_bytes:
+                raise MemoryCeilingExceeded(f"RSS {rss / 2**20:,.0f} MiB is over the "
+                                            f"{self.ceiling_bytes / 2**20:,.0f} MiB ceiling")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'ceiling_bytes': self.ceiling_bytes,
+            'peak_rss_bytes': self.peak_bytes,
+            'process_peak_rss_bytes': process_peak_rss(),
+            'pressure_events': self.pressure_events,
+        }
@@ -0,0 +1,188 @@
+import datetime
+import json
+import os
+import shutil
+from hashlib import sha256
+
+from Charge_Batches import ChargeBatches, ColumnarBatch
+from Output_Sinks import ChargeSink
+
+
+# Bump when the batch schemas or the normalization rules change, so stale
+# entries are re-parsed instead of reloaded
+CACHE_VERSION = 1
+
+TABLES = ('services', 'standard_charges', 'payer_charges')
+
+# Entries being written; never complete, even once their manifest exists
+PARTIAL_SUFFIX = '.partial'
+
+
+def mrf_digest(file_path: str, block_size: int = 1 << 20) -> str:
+    """sha256 of the MRF's content, the cache key"""
+    digest = sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class NormalizedCache:
+    """
+    Local store of normalized ETL output, one directory per MRF content hash:
+
+        cache_dir/<sha256>/manifest.json
+        cache_dir/<sha256>/payer_charges/part-00000.parquet
+        ...
+
+    Each part holds one flushed batch. An entry is written under
+    <sha256>.partial and renamed into place when the hospital finishes, so
+    an entry under its digest is always complete; partial directories a
+    crashed run left behind are never listed or loaded.
+
+    Usage:
+        cache = NormalizedCache("../Cache")
+        digest = mrf_digest(file_path)
+        if cache.has(digest):
+            cache.load(digest, sink)
+        else:
+            etl = HospitalChargeETLCSV(..., sink=CachingSink(sink, cache, digest))
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest)
+
+    def manifest(self, digest: str) -> dict | None:
+        try:
+            with open(os.path.join(self.path(digest), 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get('version') == CACHE_VERSION else None
+
+    def has(self, digest: str) -> bool:
+        """True for a complete entry: renamed into place, with a manifest of the current version"""
+        return not digest.endswith(PARTIAL_SUFFIX) and self.manifest(digest) is not None
+
+    def digests(self) -> list[str]:
+        """Every complete entry in the cache; entries a crashed run left half written are skipped"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return sorted(name for name in os.listdir(self.cache_dir) if self.has(name))
+
+    def iter_batches(self, digest: str):
+        """Yield the cached ChargeBatches of an entry in the order they were written"""
+        import pyarrow.parquet as pq
+        root = self.path(digest)
+        for part in range(self.manifest(digest)['parts']):
+            batches = ChargeBatches()
+            for table, batch in batches.tables():
+                file_path = os.path.join(root, table, f"part-{part:05d}.parquet")
+                if os.path.exists(file_path):
+                    setattr(batches, table, ColumnarBatch.from_arrow(batch.schema, pq.read_table(file_path)))
+            yield batches
+
+    def load(self, digest: str, sink: ChargeSink) -> dict:
+        """
+        Load a cached hospital into a sink without parsing the MRF again.
+        The hospital's as_of_date is the reload date, as for a fresh parse.
+
+        :return: {'hospital_name', 'rows', 'parts'} plus the sink's summary
+        """
+        manifest = self.manifest(digest)
+        hospital = dict(manifest['hospital'])
+        hospital['as_of_date'] = datetime.date.today()
+
+        rows = 0
+        sink.begin_hospital(hospital)
+        try:
+            for batches in self.iter_batches(digest):
+                sink.write(batches)
+                rows += batches.row_count
+            summary = sink.finish_hospital()
+        except Exception:
+            sink.abort()
+            raise
+        return {'hospital_name': hospital['hospital_name'], 'rows': rows, 'parts': manifest['parts'], **summary}
+
+
+class CachingSink(ChargeSink):
+    """
+    Passes everything through to another sink and keeps a copy in a
+    NormalizedCache.
+
+    If the other sink fails (the database is down, a constraint changed)
+    it is aborted and caching carries on, so the entry is still completed
+    and can be reloaded later; the failure is raised from finish_hospital.
+    """
+
+    def __init__(self, sink: ChargeSink, cache: NormalizedCache, digest: str, source: str = None):
+        self.sink = sink
+        self.cache = cache
+        self.digest = digest
+        self.source = source
+        self.name = sink.name
+        self._hospital = None
+        self._parts = 0
+        self._error = None
+        self._partial = cache.path(digest) + PARTIAL_SUFFIX
+
+    def _forward(self, method, *args, default=None):
+        if self._error is not None:
+            return default
+        try:
+            return method(*args)
+        except Exception as e:
+            self._error = e
+            self.sink.abort()
+            return default
+
+    def begin_hospital(self, hospital: dict):
+        self._error = None
+        self._forward(self.sink.begin_hospital, hospital)
+        shutil.rmtree(self._partial, ignore_errors=True)
+        for table in TABLES:
+            os.makedirs(os.path.join(self._partial, table))
+        self._hospital = hospital
+        self._parts = 0
+
+    def write(self, batches: ChargeBatches) -> tuple[int, int, int]:
+        import pyarrow.parquet as pq
+        counts = self._forward(self.sink.write, batches, default=(0, 0, 0))
+        for table, batch in batches.tables():
+            if len(batch):
+                pq.write_table(batch.to_arrow(), os.path.join(self._partial, table, f"part-{self._parts:05d}.parquet"),
+                               compression='zstd')
+        self._parts += 1
+        return counts
+
+    def finish_hospital(self) -> dict:
+        summary = self._forward(self.sink.finish_hospital, default={})
+        manifest = {
+            'version': CACHE_VERSION,
+            'source': self.source,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'parts': self._parts,
+            'hospital': {key: value.isoformat() if isinstance(value, datetime.date) else value
+                         for key, value in self._hospital.items()},
+        }
+        with open(os.path.join(self._partial, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        final = self.cache.path(self.digest)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(self._partial, final)
+
+        if self._error is not None:
+            raise self._error
+        return summary
+
+    def abort(self):
+        self.sink.abort()
+        shutil.rmtree(self._partial, ignore_errors=True)
+
+    def close(self):
+        self.sink.close()
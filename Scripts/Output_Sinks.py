@@ -0,0 +1,327 @@
+import json
+import os
+import shutil
+import time
+from urllib.parse import quote
+
+import psycopg
+
+from Charge_Batches import ChargeBatches
+from Charge_Loader import load_charge_batches
+from Price_History import record_price_history
+from Price_Summaries import refresh_price_summaries
+
+
+# Column order of the hospitals table
+HOSPITAL_COLUMNS = (
+    'hospital_name', 'hospital_license_number', 'hospital_national_provider_identifiers', 'hospital_address',
+    'hospital_location', 'as_of_date', 'last_update', 'version', 'financial_aid_policy',
+)
+
+# A NOTIFY on this channel is sent in the transaction that changes a
+# hospital's charges, with the JSON payload {"hospital_name": ..., "codes":
+# [...]}; codes is null when the list would not fit in a payload (8000 bytes)
+# and then means any code may have changed
+RELOAD_CHANNEL = 'hospital_reloaded'
+_MAX_PAYLOAD_BYTES = 7900
+
+_reload_listeners = []
+
+
+def add_reload_listener(callback):
+    """
+    Call callback(hospital_name, codes) in this process whenever a
+    PostgresSink commits changes to a hospital's charges. codes is the set
+    of codes the hospital priced before or after the change, or None if
+    unknown. Other processes LISTEN on RELOAD_CHANNEL instead.
+    """
+    _reload_listeners.append(callback)
+
+
+def remove_reload_listener(callback):
+    if callback in _reload_listeners:
+        _reload_listeners.remove(callback)
+
+
+def reload_payload(hospital_name: str, codes: set[str] | None) -> str:
+    payload = json.dumps({'hospital_name': hospital_name, 'codes': sorted(codes) if codes is not None else None})
+    if len(payload.encode()) > _MAX_PAYLOAD_BYTES:
+        payload = json.dumps({'hospital_name': hospital_name, 'codes': None})
+    return payload
+
+
+def _announce_reload(cur, hospital_name: str, codes: set[str] | None):
+    """Queue the NOTIFY on cur's transaction; returns the call that tells this process's listeners after the commit"""
+    cur.execute("SELECT pg_notify(%s, %s)", (RELOAD_CHANNEL, reload_payload(hospital_name, codes)))
+
+    def notify_listeners():
+        for callback in list(_reload_listeners):
+            callback(hospital_name, codes)
+    return notify_listeners
+
+
+class ChargeSink:
+    """
+    Destination for the normalized output of an ETL run.
+
+    An ETL calls begin_hospital once with the hospital metadata (replacing
+    whatever the sink held for that hospital), write for every flushed
+    ChargeBatches, then finish_hospital, or abort if the run failed.
+
+    Usage:
+        sink.begin_hospital(hospital)
+        sink.write(batches)
+        summary = sink.finish_hospital()
+    """
+
+    name = ''
+
+    def begin_hospital(self, hospital: dict):
+        """:param hospital: {column: value} for HOSPITAL_COLUMNS"""
+        raise NotImplementedError
+
+    def write(self, batches: ChargeBatches) -> tuple[int, int, int]:
+        """:return: (services, standard charges, payer charges) written"""
+        raise NotImplementedError
+
+    def finish_hospital(self) -> dict:
+        """:return: sink specific summary of the hospital's load"""
+        return {}
+
+    def abort(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PostgresSink(ChargeSink):
+    """
+    Upserts into the database. A hospital is reloaded in one transaction:
+    its metadata upsert, the delete of its old charges, every write, the
+    price history and the price summaries all commit together when it
+    finishes, so readers keep seeing the previous load until then and a
+    failed load rolls back to it. The commit announces the reload (see
+    add_reload_listener and RELOAD_CHANNEL).
+
+    With a pool (Connection_Pool.create_pool) the connection is borrowed
+    from it and returned, instead of one being opened per hospital, and
+    the statements run on every load stay prepared on it.
+    """
+
+    name = 'postgres'
+
+    def __init__(self, db_connection_str: str = None, pool=None):
+        if db_connection_str is None and pool is None:
+            raise ValueError("PostgresSink needs a db_connection_str or a pool")
+        self.db_connection_str = db_connection_str
+        self.pool = pool
+        self.hospital = None
+        self.table_seconds = {}
+        self._conn = None
+        self._cur = None
+
+    def begin_hospital(self, hospital: dict):
+        # A hospital left open by a load that never finished is rolled back
+        self.abort()
+        self.hospital = hospital
+        self.table_seconds = {}
+        cur = self._cursor()
+        cur.execute("""
+            DELETE FROM standard_charges
+            WHERE hospital_name = (%s)
+        """, (hospital['hospital_name'],), prepare=True)
+        cur.execute("""
+            DELETE FROM payer_charges
+            WHERE hospital_name = (%s)
+        """, (hospital['hospital_name'],), prepare=True)
+        cur.execute("""
+            DELETE FROM service_description_aliases
+            WHERE hospital_name = (%s)
+        """, (hospital['hospital_name'],), prepare=True)
+        cur.execute("""
+            INSERT INTO HOSPITALS (hospital_name, hospital_license_number, hospital_national_provider_identifiers, hospital_address, hospital_location, as_of_date, last_update, version, financial_aid_policy)
+            VALUES (%(hospital_name)s, %(hospital_license_number)s, %(hospital_national_provider_identifiers)s, %(hospital_address)s, %(hospital_location)s, %(as_of_date)s, %(last_update)s, %(version)s, %(financial_aid_policy)s)
+            ON CONFLICT (hospital_name)
+            DO UPDATE SET
+                hospital_license_number = EXCLUDED.hospital_license_number,
+                hospital_national_provider_identifiers = EXCLUDED.hospital_national_provider_identifiers,
+                hospital_address = EXCLUDED.hospital_address,
+                hospital_location = EXCLUDED.hospital_location,
+                as_of_date = EXCLUDED.as_of_date,
+                last_update = EXCLUDED.last_update,
+                version = EXCLUDED.version,
+                financial_aid_policy = EXCLUDED.financial_aid_policy
+        """, hospital, prepare=True)
+
+    def _cursor(self):
+        if self._conn is None:
+            self._conn = self.pool.getconn() if self.pool is not None else psycopg.connect(self.db_connection_str)
+            self._cur = self._conn.cursor()
+        return self._cur
+
+    def write(self, batches: ChargeBatches) -> tuple[int, int, int]:
+        return load_charge_batches(self._cursor(), batches, self.table_seconds, self.hospital['hospital_name'])
+
+    def finish_hospital(self) -> dict:
+        history_counts = record_price_history(self._cursor(), self.hospital['hospital_name'], self.hospital['as_of_date'])
+        codes = set()
+        summary_counts = refresh_price_summaries(self._cursor(), self.hospital['hospital_name'], codes)
+        notify_listeners = _announce_reload(self._cursor(), self.hospital['hospital_name'], codes)
+        self._conn.commit()
+        self.close()
+        notify_listeners()
+        return {'price_history': history_counts, 'price_summaries': summary_counts, 'table_seconds': self.table_seconds}
+
+    def abort(self):
+        if self._conn is not None:
+            self._conn.rollback()
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            if self.pool is not None:
+                # Rolls back anything uncommitted before the connection is reused
+                self.pool.putconn(self._conn)
+            else:
+                self._conn.close()
+        self._conn = None
+        self._cur = None
+
+
+class ParquetSink(ChargeSink):
+    """
+    Writes Parquet datasets instead of a database, one per table, hive
+    partitioned by hospital:
+
+        output_dir/payer_charges/hospital_name=<quoted name>/part-00000.parquet
+
+    The hospital_name column lives in the partition path rather than the
+    files. Services are partitioned by the hospital that published them.
+    Money columns are int64 cents, as in the staging tables.
+
+    A hospital is written to _hospital_name=<quoted name>.partial
+    directories, which dataset readers skip, and these replace the
+    hospital's partitions only in finish_hospital; a failed reload leaves
+    the last good output in place.
+    """
+
+    name = 'parquet'
+
+    TABLES = ('hospitals', 'services', 'standard_charges', 'payer_charges')
+
+    def __init__(self, output_dir: str, compression: str = 'zstd'):
+        self.output_dir = output_dir
+        self.compression = compression
+        self.hospital = None
+        self.table_seconds = {}
+        self._parts = 0
+        self._rows = 0
+
+    def _partition(self, table: str, suffix: str = '') -> str:
+        name = f"hospital_name={quote(self.hospital['hospital_name'], safe='')}"
+        return os.path.join(self.output_dir, table, f"_{name}{suffix}" if suffix else name)
+
+    def _write_table(self, table: str, data):
+        import pyarrow.parquet as pq
+        if 'hospital_name' in data.column_names:
+            data = data.drop_columns(['hospital_name'])
+        directory = self._partition(table, '.partial')
+        os.makedirs(directory, exist_ok=True)
+        pq.write_table(data, os.path.join(directory, f"part-{self._parts:05d}.parquet"), compression=self.compression)
+
+    def _remove_partitions(self, suffix: str):
+        for table in self.TABLES:
+            shutil.rmtree(self._partition(table, suffix), ignore_errors=True)
+
+    def begin_hospital(self, hospital: dict):
+        import pyarrow
+        self.hospital = hospital
+        self.table_seconds = {}
+        self._parts = 0
+        self._rows = 0
+        self._remove_partitions('.partial')
+        self._write_table('hospitals', pyarrow.Table.from_pylist([{col: hospital.get(col) for col in HOSPITAL_COLUMNS}]))
+
+    def write(self, batches: ChargeBatches) -> tuple[int, int, int]:
+        counts = []
+        for table, batch in batches.tables():
+            if len(batch):
+                start = time.perf_counter()
+                self._write_table(table, batch.to_arrow())
+                self.table_seconds[table] = self.table_seconds.get(table, 0.0) + time.perf_counter() - start
+            counts.append(len(batch))
+        self._parts += 1
+        self._rows += sum(counts)
+        return counts[0], counts[1], counts[2]
+
+    def finish_hospital(self) -> dict:
+        # A directory cannot be replaced while it holds files, so the old
+        # partition is moved aside first and removed once the new one is in place
+        for table in self.TABLES:
+            final, previous = self._partition(table), self._partition(table, '.previous')
+            shutil.rmtree(previous, ignore_errors=True)
+            if os.path.exists(final):
+                os.replace(final, previous)
+            if os.path.exists(self._partition(table, '.partial')):
+                os.replace(self._partition(table, '.partial'), final)
+        self._remove_partitions('.previous')
+        return {'parquet_parts': self._parts, 'rows_written': self._rows, 'table_seconds': self.table_seconds}
+
+    def abort(self):
+        if self.hospital is not None:
+            self._remove_partitions('.partial')
+
+
+class NullSink(ChargeSink):
+    """
+    Discards everything, so an ETL run measures parsing and normalization
+    alone. rows and bytes are totals over every hospital; finish_hospital
+    reports the current hospital's rows.
+    """
+
+    name = 'null'
+
+    def __init__(self):
+        self.hospitals = 0
+        self.rows = 0
+        self.bytes = 0
+        self.hospital_rows = 0
+
+    def begin_hospital(self, hospital: dict):
+        self.hospitals += 1
+        self.hospital_rows = 0
+
+    def write(self, batches: ChargeBatches) -> tuple[int, int, int]:
+        self.rows += batches.row_count
+        self.bytes += batches.nbytes
+        self.hospital_rows += batches.row_count
+        return len(batches.services), len(batches.standard_charges), len(batches.payer_charges)
+
+    def finish_hospital(self) -> dict:
+        return {'rows_discarded': self.hospital_rows}
+
+
+SINKS = {sink.name: sink for sink in (PostgresSink, ParquetSink, NullSink)}
+
+
+def create_sink(name: str, db_connection_str: str = None, output_dir: str = None, pool=None) -> ChargeSink:
+    """
+    :param name: 'postgres', 'parquet' or 'null'
+    :param db_connection_str: required for postgres without a pool
+    :param output_dir: required for parquet
+    :param pool: connection pool for postgres (see Connection_Pool.create_pool)
+    """
+    if name == PostgresSink.name:
+        return PostgresSink(db_connection_str, pool)
+    if name == ParquetSink.name:
+        return ParquetSink(output_dir)
+    if name == NullSink.name:
+        return NullSink()
+    raise ValueError(f"Unknown sink: {name}. Expected one of {list(SINKS)}")
@@ -0,0 +1,136 @@
+import datetime
+
+
+# Each history table is diffed against its live table on the key columns.
+# Only rows whose values changed (or that appeared/disappeared) since the last
+# load touch the history, so reloading an unchanged file writes nothing.
+HISTORY_TABLES = {
+    "standard_charges": {
+        "keys": ["service_id", "hospital_name"],
+        "values": [
+            "standard_charge_gross",
+            "standard_charge_discounted_cash",
+            "standard_charge_min",
+            "standard_charge_max",
+        ],
+    },
+    "payer_charges": {
+        "keys": ["service_id", "hospital_name", "payer_name", "plan_name"],
+        "values": [
+            "standard_charge_negotiated_dollar",
+            "standard_charge_negotiated_algorithm",
+            "standard_charge_negotiated_percent",
+            "estimated_amount",
+            "median_amount",
+            "tenth_percentile_amount",
+            "ninetieth_percentile_amount",
+            "count_amounts",
+            "standard_charge_methodology",
+            "additional_generic_notes",
+        ],
+    },
+}
+
+
+def _match(keys: list[str], left: str, right: str) -> str:
+    return " AND ".join(f"{left}.{k} = {right}.{k}" for k in keys)
+
+
+def _same_values(values: list[str], left: str, right: str) -> str:
+    lhs = ", ".join(f"{left}.{v}" for v in values)
+    rhs = ", ".join(f"{right}.{v}" for v in values)
+    return f"({lhs}) IS NOT DISTINCT FROM ({rhs})"
+
+
+def _history_statements(table: str) -> tuple[str, str, str]:
+    keys = HISTORY_TABLES[table]["keys"]
+    values = HISTORY_TABLES[table]["values"]
+    history = f"{table}_history"
+    columns = ", ".join(keys + values)
+
+    unchanged = f"""
+        EXISTS (
+            SELECT 1 FROM {table} live
+            WHERE {_match(keys, 'live', 'h')} AND {_same_values(values, 'live', 'h')}
+        )
+    """
+
+    # A version opened earlier today is replaced rather than closed, so that
+    # re-running a load on the same day never leaves an empty [d, d) range.
+    discard_same_day = f"""
+        DELETE FROM {history} h
+        WHERE h.hospital_name = %(hospital_name)s
+          AND h.valid_to = 'infinity'
+          AND h.valid_from >= %(as_of_date)s
+          AND NOT {unchanged}
+    """
+
+    close_changed = f"""
+        UPDATE {history} h
+        SET valid_to = %(as_of_date)s
+        WHERE h.hospital_name = %(hospital_name)s
+          AND h.valid_to = 'infinity'
+          AND h.valid_from < %(as_of_date)s
+          AND NOT {unchanged}
+    """
+
+    open_new = f"""
+        INSERT INTO {history} ({columns}, valid_from)
+        SELECT {", ".join(f"live.{c}" for c in keys + values)}, %(as_of_date)s
+        FROM {table} live
+        WHERE live.hospital_name = %(hospital_name)s
+          AND NOT EXISTS (
+              SELECT 1 FROM {history} h
+              WHERE {_match(keys, 'h', 'live')} AND h.valid_to = 'infinity'
+          )
+    """
+
+    return discard_same_day, close_changed, open_new
+
+
+_STATEMENTS = {table: _history_statements(table) for table in HISTORY_TABLES}
+
+
+def record_price_history(cur, hospital_name: str, as_of_date: datetime.date) -> dict[str, tuple[int, int]]:
+    """
+    Fold the freshly loaded charges for a hospital into the history tables.
+
+    Must run after the hospital's charges have been reloaded and before the
+    transaction commits.
+
+    :param cur: psycopg cursor on the connection that loaded the charges
+    :param hospital_name: hospital that was just reloaded
+    :param as_of_date: load date; changed prices become valid from this date
+    :return: {table: (versions_closed, versions_opened)}
+    """
+    params = {"hospital_name": hospital_name, "as_of_date": as_of_date}
+    counts = {}
+
+    for table, (discard_same_day, close_changed, open_new) in _STATEMENTS.items():
+        cur.execute(discard_same_day, params, prepare=True)
+        cur.execute(close_changed, params, prepare=True)
+        closed = cur.rowcount
+        cur.execute(open_new, params, prepare=True)
+        opened = cur.rowcount
+        counts[table] = (closed, opened)
+
+    return counts
+
+
+def charges_as_of(cur, table: str, hospital_name: str, as_of_date: datetime.date) -> list[tuple]:
+    """
+    Return the charges a hospital published on a given date.
+
+    :param table: 'standard_charges' or 'payer_charges'
+    :return: rows of key columns followed by value columns
+    """
+    keys = HISTORY_TABLES[table]["keys"]
+    values = HISTORY_TABLES[table]["values"]
+
+    cur.execute(f"""
+        SELECT {", ".join(keys + values)}
+        FROM {table}_history
+        WHERE hospital_name = %s
+          AND daterange(valid_from, valid_to) @> %s::date
+    """, (hospital_name, as_of_date))
+    return cur.fetchall()
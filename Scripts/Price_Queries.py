@@ -0,0 +1,335 @@
+import collections
+import json
+import threading
+import time
+
+import psycopg
+from psycopg.rows import dict_row
+
+from Connection_Pool import create_pool
+from Output_Sinks import RELOAD_CHANNEL, add_reload_listener, remove_reload_listener
+
+
+# Rates of unmodified services only, as in the price summaries
+_CHEAPEST_HOSPITALS = """
+    SELECT pc.hospital_name,
+           s.setting,
+           min(pc.standard_charge_negotiated_dollar) AS min_price,
+           max(pc.standard_charge_negotiated_dollar) AS max_price,
+           count(*) AS plan_count
+    FROM payer_charges pc
+    JOIN services s ON s.service_id = pc.service_id
+    WHERE s.code = %(code)s
+      AND s.type = %(code_type)s::service_type_enum
+      AND (%(setting)s::setting_enum IS NULL OR s.setting = %(setting)s::setting_enum)
+      AND coalesce(s.modifiers, '') = ''
+      AND pc.payer_name = %(payer_name)s
+      AND pc.standard_charge_negotiated_dollar IS NOT NULL
+    GROUP BY pc.hospital_name, s.setting
+    ORDER BY min_price, pc.hospital_name
+    LIMIT %(limit)s
+"""
+
+_SERVICE_SPREAD = """
+    SELECT setting, min_price, p10_price, median_price, p90_price, max_price, hospital_count, rate_count
+    FROM service_price_summary
+    WHERE code = %(code)s
+      AND type = %(code_type)s::service_type_enum
+      AND (%(setting)s::setting_enum IS NULL OR setting = %(setting)s::setting_enum)
+    ORDER BY setting
+"""
+
+_PAYER_SPREAD = """
+    SELECT setting, payer_name, min_price, p10_price, median_price, p90_price, max_price, hospital_count, rate_count
+    FROM payer_price_summary
+    WHERE code = %(code)s
+      AND type = %(code_type)s::service_type_enum
+      AND (%(setting)s::setting_enum IS NULL OR setting = %(setting)s::setting_enum)
+    ORDER BY setting, median_price
+"""
+
+# Lowest rate per service and payer at each hospital, for services both price
+_HOSPITAL_DIFF = """
+    WITH rates AS (
+        SELECT pc.hospital_name, pc.service_id, pc.payer_name,
+               min(pc.standard_charge_negotiated_dollar) AS price
+        FROM payer_charges pc
+        WHERE pc.hospital_name IN (%(hospital_a)s, %(hospital_b)s)
+          AND (%(payer_name)s::text IS NULL OR pc.payer_name = %(payer_name)s::text)
+          AND pc.standard_charge_negotiated_dollar IS NOT NULL
+        GROUP BY pc.hospital_name, pc.service_id, pc.payer_name
+    )
+    SELECT s.code, s.type, s.setting, s.modifiers, s.description, a.payer_name,
+           a.price AS price_a,
+           b.price AS price_b,
+           b.price - a.price AS difference
+    FROM rates a
+    JOIN rates b ON b.service_id = a.service_id AND b.payer_name = a.payer_name
+    JOIN services s ON s.service_id = a.service_id
+    WHERE a.hospital_name = %(hospital_a)s
+      AND b.hospital_name = %(hospital_b)s
+      AND (%(code_type)s::service_type_enum IS NULL OR s.type = %(code_type)s::service_type_enum)
+    ORDER BY abs(b.price - a.price) DESC, s.code, a.payer_name
+    LIMIT %(limit)s
+"""
+
+# Fuzzy (trigram word similarity) or full-text matches over every
+# hospital's descriptions, ranked per code by the best matching alias
+_SEARCH_SERVICES = """
+    WITH query AS (
+        SELECT %(text)s::text AS text, websearch_to_tsquery('english', %(text)s) AS terms
+    ),
+    matches AS (
+        SELECT a.service_id, a.hospital_name, a.description,
+               word_similarity(q.text, a.description) + ts_rank(a.search, q.terms) AS score
+        FROM service_description_aliases a, query q
+        WHERE q.text <%% a.description
+           OR a.search @@ q.terms
+    )
+    SELECT s.code, s.type,
+           max(m.score) AS score,
+           (array_agg(m.description ORDER BY m.score DESC))[1] AS description,
+           count(DISTINCT m.hospital_name) AS hospital_count
+    FROM matches m
+    JOIN services s ON s.service_id = m.service_id
+    WHERE (%(code_type)s::service_type_enum IS NULL OR s.type = %(code_type)s::service_type_enum)
+    GROUP BY s.code, s.type
+    ORDER BY score DESC, hospital_count DESC, s.code
+    LIMIT %(limit)s
+"""
+
+
+class _Entry:
+    __slots__ = ('value', 'expires', 'hospitals', 'codes', 'any_reload')
+
+    def __init__(self, value, expires: float, hospitals: frozenset, codes: frozenset, any_reload: bool):
+        self.value = value
+        self.expires = expires
+        self.hospitals = hospitals
+        self.codes = codes
+        self.any_reload = any_reload
+
+
+class QueryCache:
+    """
+    LRU result cache with a time to live. Every entry is tagged with the
+    hospitals and codes its result depends on, so a reload drops exactly
+    the entries it can change: those naming the hospital, and those for a
+    code the hospital priced before or after the reload (any code-tagged
+    entry when the codes are unknown). Entries put with any_reload, whose
+    result can change with any hospital, are dropped on every reload.
+
+    Every invalidation bumps generation. A result computed while a reload
+    came in may predate it, so put skips results whose query started at an
+    older generation rather than caching them until the TTL runs out.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generation = 0
+        self.stale_puts = 0
+
+    def get(self, key):
+        """:return: the cached value, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value, hospitals=(), codes=(), any_reload: bool = False, generation: int | None = None):
+        """:param generation: the cache's generation when the query producing value started"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self.stale_puts += 1
+                return
+            self._entries[key] = _Entry(value, time.monotonic() + self.ttl, frozenset(hospitals), frozenset(codes),
+                                        any_reload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_hospital(self, hospital_name: str, codes=None) -> int:
+        """:return: number of entries dropped"""
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, entry in self._entries.items()
+                     if entry.any_reload or hospital_name in entry.hospitals
+                     or (entry.codes and (codes is None or not entry.codes.isdisjoint(codes)))]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'stale_puts': self.stale_puts,
+        }
+
+
+class PriceQueries:
+    """
+    Price comparisons over the loaded charges.
+
+    Queries run as prepared statements on connections borrowed from a pool,
+    and results are cached (see QueryCache). Reloads done by a PostgresSink
+    in this process invalidate the cache directly; with listen=True a
+    background connection also LISTENs for reloads done by other processes.
+    Cached results are shared, so callers must not modify them.
+
+    :param pool: a psycopg_pool.ConnectionPool (or anything with a
+                 connection() context manager); default a new pool on
+                 db_connection_str (see Connection_Pool.create_pool)
+    :param db_connection_str: required without a pool, and for listen=True
+                 when the pool does not expose its conninfo
+
+    Usage:
+        with PriceQueries(db_connection_str=db) as queries:
+            queries.cheapest_hospitals('99213', 'CPT', 'Aetna')
+            queries.price_spread('470', 'MS-DRG')
+            queries.hospital_diff('Hospital A', 'Hospital B', payer_name='Cigna')
+            queries.search_services('knee MRI')
+    """
+
+    def __init__(self, pool=None, db_connection_str: str | None = None, cache_size: int = 1024,
+                 cache_ttl: float = 300.0, listen: bool = True, pool_size: int = 4):
+        if pool is None:
+            if db_connection_str is None:
+                raise ValueError("PriceQueries needs a pool or a db_connection_str")
+            pool = create_pool(db_connection_str, max_size=pool_size, name='price-queries')
+            self._owns_pool = True
+        else:
+            self._owns_pool = False
+        self.pool = pool
+        self.db_connection_str = db_connection_str or getattr(pool, 'conninfo', None)
+        self.cache = QueryCache(cache_size, cache_ttl)
+
+        add_reload_listener(self.cache.invalidate_hospital)
+        self._listener = None
+        self._stop = threading.Event()
+        if listen:
+            self._listener = threading.Thread(target=self._listen, name="reload-listener", daemon=True)
+            self._listener.start()
+
+    def _query(self, sql: str, params: dict) -> list[dict]:
+        with self.pool.connection() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(sql, params, prepare=True)
+                return cur.fetchall()
+
+    def _cached(self, key: tuple, sql: str, params: dict, hospitals=(), codes=(), any_reload=False) -> list[dict]:
+        result = self.cache.get(key)
+        if result is None:
+            generation = self.cache.generation
+            result = self._query(sql, params)
+            self.cache.put(key, result, hospitals, codes, any_reload, generation)
+        return result
+
+    def cheapest_hospitals(self, code: str, code_type: str, payer_name: str, setting: str | None = None,
+                           limit: int = 10) -> list[dict]:
+        """
+        Hospitals with the lowest negotiated rate for a code with one payer.
+
+        :return: [{'hospital_name', 'setting', 'min_price', 'max_price', 'plan_count'}] cheapest first;
+                 min and max are over the payer's plans at that hospital
+        """
+        params = {'code': code, 'code_type': code_type, 'payer_name': payer_name, 'setting': setting, 'limit': limit}
+        key = ('cheapest_hospitals', code, code_type, payer_name, setting, limit)
+        return self._cached(key, _CHEAPEST_HOSPITALS, params, codes=(code,))
+
+    def price_spread(self, code: str, code_type: str, setting: str | None = None) -> dict:
+        """
+        Distribution of negotiated rates for a service across hospitals.
+
+        :return: {'service': [one row per setting], 'payers': [one row per setting and payer]};
+                 rows hold min, p10, median, p90 and max price, hospital_count and rate_count
+        """
+        params = {'code': code, 'code_type': code_type, 'setting': setting}
+        key = ('price_spread', code, code_type, setting)
+        result = self.cache.get(key)
+        if result is None:
+            generation = self.cache.generation
+            result = {'service': self._query(_SERVICE_SPREAD, params), 'payers': self._query(_PAYER_SPREAD, params)}
+            self.cache.put(key, result, codes=(code,), generation=generation)
+        return result
+
+    def hospital_diff(self, hospital_a: str, hospital_b: str, payer_name: str | None = None,
+                      code_type: str | None = None, limit: int = 1000) -> list[dict]:
+        """
+        Services both hospitals price with the same payer, largest differences first.
+
+        :return: [{'code', 'type', 'setting', 'modifiers', 'description', 'payer_name',
+                   'price_a', 'price_b', 'difference'}]; difference is price_b - price_a
+        """
+        params = {'hospital_a': hospital_a, 'hospital_b': hospital_b, 'payer_name': payer_name,
+                  'code_type': code_type, 'limit': limit}
+        key = ('hospital_diff', hospital_a, hospital_b, payer_name, code_type, limit)
+        return self._cached(key, _HOSPITAL_DIFF, params, hospitals=(hospital_a, hospital_b))
+
+    def search_services(self, text: str, code_type: str | None = None, limit: int = 20) -> list[dict]:
+        """
+        Services whose descriptions, at any hospital, match text ("knee MRI"),
+        fuzzily or on full-text terms, best first.
+
+        :return: [{'code', 'type', 'score', 'description', 'hospital_count'}]; description is the
+                 best matching alias, hospital_count the hospitals with a matching alias
+        """
+        text = " ".join(text.split())
+        params = {'text': text, 'code_type': code_type, 'limit': limit}
+        key = ('search_services', text.lower(), code_type, limit)
+        return self._cached(key, _SEARCH_SERVICES, params, any_reload=True)
+
+    def _listen(self):
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self.db_connection_str, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {RELOAD_CHANNEL}")
+                    # Reloads missed while not listening may have left stale entries
+                    self.cache.clear()
+                    while not self._stop.is_set():
+                        for notify in conn.notifies(timeout=1.0):
+                            reload = json.loads(notify.payload)
+                            codes = reload['codes']
+                            self.cache.invalidate_hospital(reload['hospital_name'],
+                                                           set(codes) if codes is not None else None)
+            except psycopg.Error:
+                self.cache.clear()
+                self._stop.wait(5.0)
+
+    def close(self):
+        remove_reload_listener(self.cache.invalidate_hospital)
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join()
+        if self._owns_pool:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
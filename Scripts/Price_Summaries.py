@@ -0,0 +1,148 @@
+import time
+
+
+# Cross-hospital price distributions of the negotiated dollar amounts, kept
+# in tables so that comparisons do not aggregate payer_charges on the fly.
+# Only services without modifiers are summarized: a modified code (e.g. a
+# professional component) is a different price from the unmodified one.
+#
+# Percentiles cannot be updated from a delta, so a refresh recomputes every
+# summary row the reloaded hospital contributes to now or contributed to
+# before. price_summary_members remembers the latter, because the old
+# charges are gone by the time the refresh runs.
+SUMMARY_TABLES = {
+    "service_price_summary": ["code", "type", "setting"],
+    "payer_price_summary": ["code", "type", "setting", "payer_name"],
+}
+
+_PRICES = """
+    FROM payer_charges pc
+    JOIN services s ON s.service_id = pc.service_id
+    WHERE pc.standard_charge_negotiated_dollar IS NOT NULL
+      AND coalesce(s.modifiers, '') = ''
+      AND s.setting IS NOT NULL
+"""
+
+_AFFECTED_KEYS = f"""
+    CREATE TEMP TABLE price_summary_affected ON COMMIT DROP AS
+    SELECT code, type, setting, payer_name
+    FROM price_summary_members
+    WHERE hospital_name = %(hospital_name)s
+    UNION
+    SELECT s.code, s.type, s.setting, pc.payer_name
+    {_PRICES}
+      AND pc.hospital_name = %(hospital_name)s
+"""
+
+_REPLACE_MEMBERS = (
+    """
+    DELETE FROM price_summary_members
+    WHERE hospital_name = %(hospital_name)s
+    """,
+    f"""
+    INSERT INTO price_summary_members (hospital_name, code, type, setting, payer_name)
+    SELECT DISTINCT pc.hospital_name, s.code, s.type, s.setting, pc.payer_name
+    {_PRICES}
+      AND pc.hospital_name = %(hospital_name)s
+    """,
+)
+
+
+def _group(keys: list[str]) -> str:
+    return ", ".join("pc.payer_name" if k == "payer_name" else f"s.{k}" for k in keys)
+
+
+def _aggregate(table: str, where: str = "") -> str:
+    keys = SUMMARY_TABLES[table]
+    price = "pc.standard_charge_negotiated_dollar"
+    group = _group(keys)
+    return f"""
+        INSERT INTO {table} ({", ".join(keys)}, min_price, p10_price, median_price, p90_price, max_price,
+                             hospital_count, rate_count, refreshed_at)
+        SELECT {group},
+               min({price}),
+               percentile_cont(0.1) WITHIN GROUP (ORDER BY {price})::numeric(12, 2),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY {price})::numeric(12, 2),
+               percentile_cont(0.9) WITHIN GROUP (ORDER BY {price})::numeric(12, 2),
+               max({price}),
+               count(DISTINCT pc.hospital_name),
+               count(*),
+               now()
+        {_PRICES}
+        {where}
+        GROUP BY {group}
+    """
+
+
+def _refresh_statements(table: str) -> tuple[str, str]:
+    keys = SUMMARY_TABLES[table]
+    key_list = ", ".join(keys)
+    affected = f"SELECT DISTINCT {key_list} FROM price_summary_affected"
+
+    remove_affected = f"""
+        DELETE FROM {table}
+        WHERE ({key_list}) IN ({affected})
+    """
+
+    recompute_affected = _aggregate(table, f"AND ({_group(keys)}) IN ({affected})")
+
+    return remove_affected, recompute_affected
+
+
+_STATEMENTS = {table: _refresh_statements(table) for table in SUMMARY_TABLES}
+
+
+def refresh_price_summaries(cur, hospital_name: str, affected_codes: set[str] | None = None) -> dict:
+    """
+    Recompute the summary rows a reloaded hospital affects.
+
+    Must run after the hospital's charges have been reloaded, on the same
+    transaction, so the summaries commit (or roll back) with the charges.
+
+    :param cur: psycopg cursor on the connection that loaded the charges
+    :param hospital_name: hospital that was just reloaded
+    :param affected_codes: if given, the codes the hospital prices now or priced before are added to it
+    :return: {table: rows recomputed, 'seconds': time taken}
+    """
+    start = time.perf_counter()
+    params = {"hospital_name": hospital_name}
+    counts = {}
+
+    # Hospitals reloading concurrently would delete and re-insert the same
+    # summary rows; refreshes take turns until their transactions commit
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('price_summaries'))")
+    cur.execute(_AFFECTED_KEYS, params)
+    if affected_codes is not None:
+        cur.execute("SELECT DISTINCT code FROM price_summary_affected")
+        affected_codes.update(code for code, in cur.fetchall())
+    for statement in _REPLACE_MEMBERS:
+        cur.execute(statement, params, prepare=True)
+    for table, (remove_affected, recompute_affected) in _STATEMENTS.items():
+        cur.execute(remove_affected)
+        cur.execute(recompute_affected)
+        counts[table] = cur.rowcount
+    cur.execute("DROP TABLE price_summary_affected")
+
+    counts["seconds"] = time.perf_counter() - start
+    return counts
+
+
+def rebuild_price_summaries(cur) -> dict[str, int]:
+    """
+    Recompute every summary from scratch, e.g. after creating the tables on
+    a database that already holds charges. The caller commits.
+
+    :return: {table: rows written}
+    """
+    cur.execute("TRUNCATE price_summary_members")
+    cur.execute(f"""
+        INSERT INTO price_summary_members (hospital_name, code, type, setting, payer_name)
+        SELECT DISTINCT pc.hospital_name, s.code, s.type, s.setting, pc.payer_name
+        {_PRICES}
+    """)
+    counts = {}
+    for table in SUMMARY_TABLES:
+        cur.execute(f"TRUNCATE {table}")
+        cur.execute(_aggregate(table))
+        counts[table] = cur.rowcount
+    return counts
@@ -0,0 +1,199 @@
+import collections
+import cProfile
+import fnmatch
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+PROFILERS = ('cprofile', 'sampling')
+
+
+class ProfileConfig:
+    """
+    Which files to profile and how.
+
+    :param profiler: 'cprofile' (deterministic, exact call counts, slows
+                     Python heavy code 1.5-2x) or 'sampling' (a thread that
+                     records the main thread's stack every interval seconds;
+                     low overhead, output in collapsed stack format for
+                     flamegraph.pl or speedscope)
+    :param output_dir: where artifacts go; default <report dir>/profiles
+    :param trace_memory: also run tracemalloc and report the top allocation sites;
+                         this slows allocation heavy code several times over, so
+                         turn it off when the timings matter more than memory
+    :param top: number of functions / allocation sites in the text reports
+    :param files: fnmatch patterns matched against the file name; None profiles every file
+    :param interval: sampling interval in seconds
+
+    Work done in worker processes (HospitalChargeETLJSON with workers > 1)
+    is not seen by either profiler.
+
+    Usage:
+        process_single_file(path, profile=ProfileConfig('sampling'))
+        pipeline_process(urls, profile=ProfileConfig(files=['*children*']))
+    """
+
+    def __init__(self, profiler: str = 'cprofile', output_dir: str | None = None, trace_memory: bool = True,
+                 top: int = 30, files: list[str] | None = None, interval: float = 0.005, trace_frames: int = 10):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler: {profiler}. Expected one of {PROFILERS}")
+        self.profiler = profiler
+        self.output_dir = output_dir
+        self.trace_memory = trace_memory
+        self.top = top
+        self.files = files
+        self.interval = interval
+        self.trace_frames = trace_frames
+
+    def applies(self, file_path: str) -> bool:
+        if self.files is None:
+            return True
+        name = os.path.basename(file_path)
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.files)
+
+
+class _StackSampler:
+    """Counts the stacks of one thread, sampled from a background thread"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, top: int) -> str:
+        """Functions by the share of samples they were on the stack (inclusive) and on top (self)"""
+        inclusive = collections.Counter()
+        leaf = collections.Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            leaf[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        total = self.samples or 1
+        lines = [f"{self.samples:,} samples every {self.interval * 1000:g}ms", "", "Self:"]
+        lines += [f"  {count / total:7.1%}  {frame}" for frame, count in leaf.most_common(top)]
+        lines += ["", "Inclusive:"]
+        lines += [f"  {count / total:7.1%}  {frame}" for frame, count in inclusive.most_common(top)]
+        return "\n".join(lines) + "\n"
+
+
+def _allocation_report(snapshot, peak: int, top: int) -> str:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    stats = snapshot.statistics('traceback')
+    lines = [f"Peak traced memory: {peak / 2**20:,.1f} MiB",
+             f"Still allocated at the end: {sum(stat.size for stat in stats) / 2**20:,.1f} MiB", ""]
+    for rank, stat in enumerate(stats[:top], 1):
+        lines.append(f"#{rank}: {stat.size / 2**20:,.2f} MiB in {stat.count:,} blocks")
+        lines += [f"    {line}" for line in stat.traceback.format(limit=5)]
+    return "\n".join(lines) + "\n"
+
+
+class FileProfiler:
+    """
+    Profiles everything run inside it and writes, to output_dir:
+        <name>.prof            pstats dump (cprofile), e.g. for snakeviz
+        <name>.collapsed.txt   collapsed stacks (sampling)
+        <name>.profile.txt     top functions
+        <name>.alloc.txt       top allocation sites and peak traced memory (trace_memory)
+
+    Usage:
+        with FileProfiler(config, output_dir, "hospital") as profiler:
+            etl.execute()
+        profiler.artifacts
+    """
+
+    def __init__(self, config: ProfileConfig, output_dir: str, name: str):
+        self.config = config
+        self.output_dir = output_dir
+        self.name = name
+        self.artifacts = {}
+        self._profile = None
+        self._sampler = None
+        self._started_tracemalloc = False
+
+    def _path(self, suffix: str) -> str:
+        return os.path.join(self.output_dir, f"{self.name}{suffix}")
+
+    def __enter__(self):
+        if self.config.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self.config.trace_frames)
+            self._started_tracemalloc = True
+        if self.config.profiler == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = _StackSampler(threading.get_ident(), self.config.interval)
+            self._sampler.start()
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.time() - self._start
+        if self._profile is not None:
+            self._profile.disable()
+        else:
+            self._sampler.stop()
+        # Snapshot before writing the reports, which allocate too
+        snapshot = peak = None
+        if self._started_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self._profile is not None:
+            self._profile.dump_stats(self._path('.prof'))
+            text = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=text)
+            stats.sort_stats('cumulative').print_stats(self.config.top)
+            stats.sort_stats('tottime').print_stats(self.config.top)
+            with open(self._path('.profile.txt'), 'w') as f:
+                f.write(f"{seconds:.2f}s wall\n{text.getvalue()}")
+            self.artifacts['profile'] = self._path('.prof')
+        else:
+            with open(self._path('.collapsed.txt'), 'w') as f:
+                f.write(self._sampler.collapsed())
+            with open(self._path('.profile.txt'), 'w') as f:
+                f.write(f"{seconds:.2f}s wall\n{self._sampler.report(self.config.top)}")
+            self.artifacts['profile'] = self._path('.collapsed.txt')
+        self.artifacts['profile_report'] = self._path('.profile.txt')
+
+        if snapshot is not None:
+            with open(self._path('.alloc.txt'), 'w') as f:
+                f.write(_allocation_report(snapshot, peak, self.config.top))
+            self.artifacts['allocations'] = self._path('.alloc.txt')
+            self.artifacts['peak_traced_bytes'] = peak
+        return False
@@ -1,12 +1,18 @@
-import csv
 import datetime
-from hashlib import sha256
-import psycopg
+import numpy
 import pandas
 import time
 import re
 import traceback
 import logging
+from Code_Filter import ALLOWED_CPT_HCPCS_CODES, CODE_FILTER, DRG_TYPES, WHITELISTED_TYPES
+from CSV_Reader import HospitalCSVFile
+from Charge_Batches import ChargeBatches
+from Output_Sinks import ChargeSink, PostgresSink
+from Charge_Values import normalize_charge_frame
+from Batch_Sizing import AdaptiveBatchSizer
+from Memory_Guard import MemoryGuard
+from Service_Ids import normalize_modifiers, service_id as compute_service_id, service_id_cache_counts, service_id_cache_stats
 from typing import Dict, List, Optional, Tuple, Iterable
 
 
@@ -19,59 +25,18 @@ class HospitalChargeETLCSV:
         etl.execute()
     """
 
-    ALLOWED_CPT_HCPCS_CODES = {
-        '19120', '29826', '29881', '33206', '33207', '33208', '33274', '36415', '42820',
-        '43235', '43239', '45378', '45380', '45385', '45391', '47562', '49505', '55700',
-        '55866', '59400', '59510', '59610', '62322', '64483', '66821', '66984', '70450',
-        '70553', '72110', '72148', '72193', '73700', '73702', '73721', '74176', '74177',
-        '74178', '76700', '76805', '76830', '77065', '77066', '77067', '80048', '80053',
-        '80055', '80061', '80069', '80076', '81000', '81001', '81002', '81003', '84153',
-        '84154', '84443', '85025', '85027', '85610', '85730', '90832', '90834', '90837',
-        '90846', '90847', '90853', '92961', '93000', '93306', '93350', '93452', '93650',
-        '93656', '95810', '97110', '97161', '97162', '97163', '99203', '99204', '99205',
-        '99243', '99244', '99385', '99386', '99421', '99422', '99423', '00670', '01214',
-        '01215', '01402', '01961', '01967', '12001', '17134', '20526', '20550', '20552',
-        '20600', '20605', '20606', '20610', '20611', '20612', '20931', '22514', '22551',
-        '22845', '23350', '24220', '25246', '27093', '27096', '27130', '27134', '27369',
-        '27447', '27648', '29826', '29827', '29881', '32555', '36415', '38571', '42820',
-        '45385', '46415', '47000', '47562', '49083', '49505', '50200', '51700', '51701',
-        '51798', '52000', '55700', '55866', '58340', '59400', '59610', '62323', '63047',
-        '63048', '63060', '64447', '64483', '66291', '70110', '70140', '70160', '70200',
-        '70220', '70260', '70330', '70336', '70355', '70450', '70460', '70470', '70480',
-        '70481', '70482', '70486', '70487', '70490', '70491', '70492', '70540', '70543',
-        '70551', '70553', '71045', '71046', '71100', '71101', '71120', '71130', '71250',
-        '71260', '71270', '71550', '71552', '72020', '72040', '72070', '72072', '72082',
-        '72100', '72110', '72125', '72126', '72128', '72129', '72131', '72132', '72141',
-        '72146', '72148', '72156', '72157', '72158', '72170', '72192', '72193', '72194',
-        '72195', '72197', '72202', '72220', '73000', '73010', '73030', '73040', '73050',
-        '73080', '73085', '73090', '73110', '73115', '73130', '73140', '73200', '73201',
-        '73218', '73220', '73221', '73223', '73502', '73525', '73552', '73562', '73564',
-        '73580', '73590', '73610', '73630', '73650', '73660', '73700', '73701', '73718',
-        '73720', '73721', '73723', '73925', '73971', '74018', '74150', '74153', '74160',
-        '74170', '74176', '74177', '74178', '74181', '74183', '74220', '74270', '74280',
-        '74740', '75012', '75557', '75561', '75565', '76000', '76376', '76380', '76506',
-        '76536', '76604', '76641', '76642', '76700', '76705', '76770', '76775', '76776',
-        '76801', '76805', '76811', '76813', '76815', '76816', '76817', '76819', '76830',
-        '76831', '76856', '76857', '76870', '76872', '76882', '76942', '76946', '77002',
-        '77063', '77065', '77066', '77067', '77072', '77073', '77074', '77075', '77077',
-        '78452', '78815', '78816', '80048', '80053', '80055', '80061', '80069', '80076',
-        '81000', '81001', '81002', '81003', '82040', '82043', '82247', '82248', '82306',
-        '82310', '82374', '82435', '82565', '82570', '82607', '82728', '82947', '83036',
-        '83540', '83550', '83735', '83970', '84075', '84100', '84132', '84153', '84154',
-        '84155', '84156', '84439', '84443', '84450', '84460', '85027', '85610', '85652',
-        '85730', '86140', '87086', '88300', '88300', '88307', '88313', '88346', '90832',
-        '90834', '90837', '90846', '90847', '90853', '93000', '93005', '93010', '93016',
-        '93017', '93018', '93225', '93226', '93227', '93308', '93312', '93320', '93325',
-        '93350', '93452', '93880', '93882', '93886', '93888', '93892', '93893', '93923',
-        '93926', '93930', '93931', '93970', '93975', '93976', '93978', '93979', '94070',
-        '94640', '94668', '94760', '94762', '95720', '95810', '96101', '97110', '99152',
-        '99153', '99211', '99243', '99244', '99385', '99386', '99421', '99422', '99423',
-        'C8928'
-    }
+    ALLOWED_CPT_HCPCS_CODES = ALLOWED_CPT_HCPCS_CODES
     
-    ALLOWED_TYPES = {'MS-DRG', 'APR-DRG', 'CPT', 'HCPCS'}
+    ALLOWED_TYPES = WHITELISTED_TYPES | DRG_TYPES
 
-    def __init__(self, db_connection_str: str, file_path: str):
+    ENGINES = ('pandas', 'arrow')
+
+    CHUNK_ROWS = 100000
+    MIN_CHUNK_ROWS = 5000
+
+    def __init__(self, db_connection_str: str, file_path: str, prefilter: bool = False, engine: str = 'pandas',
+                 flush_seconds: float = 1.0, max_batch_bytes: int = 64 << 20, sink: Optional[ChargeSink] = None,
+                 memory_limit: Optional[int] = None, pool=None):
         """
         Initialize the ETL process
         
@@ -79,21 +44,55 @@ class HospitalChargeETLCSV:
         :type db_connection_str: str
         :param file_path: path to the hospital charge CSV
         :type file_path: str
+        :param prefilter: drop rows without a whitelisted code or DRG marker before parsing
+        :type prefilter: bool
+        :param engine: CSV engine, 'pandas' (C parser) or 'arrow' (multithreaded pyarrow parser and compute kernels)
+        :type engine: str
+        :param flush_seconds: target time per database flush; the batch size adapts to reach it
+        :type flush_seconds: float
+        :param max_batch_bytes: flush as soon as the buffered batches reach this size
+        :type max_batch_bytes: int
+        :param sink: where the hospital and its charges are written; defaults to PostgresSink(db_connection_str, pool)
+        :type sink: ChargeSink
+        :param memory_limit: RSS ceiling in bytes. Chunks are then filtered, converted and written one at a
+                             time instead of all at once, read smaller and flushed early near the limit, and
+                             the run fails with MemoryCeilingExceeded rather than going past it
+        :type memory_limit: int
+        :param pool: connection pool the default PostgresSink borrows its connections from
+                     (see Connection_Pool.create_pool); without one it connects with db_connection_str
+        :type pool: psycopg_pool.ConnectionPool
         """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown CSV engine: {engine}. Expected one of {self.ENGINES}")
+
         logging.basicConfig(filename="../Logs/ETLLogs.log", level=logging.INFO)
         self.logger = logging.getLogger("ETL Logger")
         self.db_connection_str = db_connection_str
         self.file_path = file_path
+        self.prefilter = prefilter
+        self.engine = engine
+        self.batch_sizer = AdaptiveBatchSizer(target_seconds=flush_seconds, max_bytes=max_batch_bytes)
+        self.sink = sink if sink is not None else PostgresSink(db_connection_str, pool)
+        self.memory_guard = MemoryGuard(memory_limit)
+        self.chunk_rows = self.CHUNK_ROWS
 
         # State tracking
         self.hospital_name = None
-        self.encoding = 'latin1'
+        self.as_of_date = None
+        self.csv_file = None
+        self.encoding = None
         self.column_mapping = {}
         self.filtered_data = None
 
         self.total_rows_processed = 0
         self.total_rows_kept = 0
         self.total_rows_found = 0
+        self.parse_time = 0.0
+        self.value_rejects = {}
+        self.stage_times = {}
+        self.rows_written = {}
+        self.sink_summary = {}
+        self.service_id_cache_start = (0, 0)
         
 
     def execute(self, skip_confirmation: bool = False) -> dict:
@@ -111,20 +110,30 @@ class HospitalChargeETLCSV:
         self.logger.info(f"File: {self.file_path}")
 
         overall_start = time.time()
+        self.service_id_cache_start = service_id_cache_counts()
 
         try:
             self.logger.info("STEP 1: Loading and inserting hospital metadata")
+            stage_start = time.time()
             hospital_dict = self._read_hospital_data()
             self._upsert_hospital_data(hospital_dict)
+            self.stage_times['metadata'] = time.time() - stage_start
+
+            if self.memory_guard.bounded:
+                return self._execute_bounded(overall_start)
 
             self.logger.info("\nSTEP 2: Filtering charge data...")
             filter_start = time.time()
             filtered_data = self._filter_services()
             filter_time = time.time() - filter_start
+            self.stage_times['filter'] = filter_time
+            self.memory_guard.sample()
             self.logger.info(f"Filtering complete in {filter_time:.2f}s")
             
             matches_found = len(filtered_data)
             if matches_found == 0:
+                # Leave the hospital's previous load in place
+                self.sink.abort()
                 return {
                 'status': 'failed',
                 'error': 'Found no useful data after filtering',
@@ -138,51 +147,112 @@ class HospitalChargeETLCSV:
                 convert_start = time.time()
                 filtered_data = self._convert_wide_to_tall(filtered_data)
                 convert_time = time.time() - convert_start
+                self.stage_times['wide_to_tall'] = convert_time
+                self.memory_guard.sample()
                 
                 self.logger.info(f"Conversion complete in {convert_time:.2f}s")
                 self.logger.info(f"  {matches_found:,} wide rows -> {len(filtered_data):,} tall rows")
 
 
+            stage_start = time.time()
+            self.value_rejects = self._normalize_charge_values(filtered_data)
+            self.stage_times['normalize'] = time.time() - stage_start
+
             self.logger.info("\nSTEP 3: Inserting charge data into database...")
+            stage_start = time.time()
             self._arrange_charge_data(filtered_data)
+            self.stage_times['load'] = time.time() - stage_start
 
-            overall_time = time.time() - overall_start
-
-            self.logger.info("\n" + "="*70)
-            self.logger.info("ETL PROCESS COMPLETE")
-            self.logger.info("="*70)
-            self.logger.info(f"Total execution time: {overall_time:.2f}s ({overall_time/60:.2f} minutes)")
-            self.logger.info(f"Hospital: {self.hospital_name}")
-            self.logger.info(f"Records inserted: {self.total_rows_found:,}\n\n\n")
-
-            return {
-                'status': 'success',
-                'execution_time': overall_time,
-                'hospital_license_number': self.hospital_name,
-                'records_processed': self.total_rows_processed,
-                'records_inserted': self.total_rows_found,
-            }
+            return self._summary(overall_start)
         
         except Exception as e:
             self.logger.info(f"\nETL pipeline failed: {e}")
+            self.sink.abort()
             traceback.print_exc()
             
             return {
                 'status': 'failed',
                 'error': str(e),
+                'memory': self.memory_guard.stats(),
             }
 
+        finally:
+            if self.csv_file is not None:
+                self.csv_file.close()
+
     # Private Methods
-    
+
+    def _summary(self, overall_start: float) -> dict:
+        overall_time = time.time() - overall_start
+
+        self.logger.info("\n" + "="*70)
+        self.logger.info("ETL PROCESS COMPLETE")
+        self.logger.info("="*70)
+        self.logger.info(f"Total execution time: {overall_time:.2f}s ({overall_time/60:.2f} minutes)")
+        self.logger.info(f"Hospital: {self.hospital_name}")
+        self.logger.info(f"Records inserted: {self.total_rows_found:,}\n\n\n")
+
+        return {
+            'status': 'success',
+            'execution_time': overall_time,
+            'hospital_license_number': self.hospital_name,
+            'records_processed': self.total_rows_processed,
+            'records_kept': self.total_rows_kept,
+            'records_inserted': self.total_rows_found,
+            'rows_written': self.rows_written,
+            'engine': self.engine,
+            'parse_rows_per_second': self.total_rows_processed / self.parse_time if self.parse_time else 0.0,
+            'service_id_cache': self._service_id_cache_stats(),
+            'value_rejects': self.value_rejects,
+            'batching': self.batch_sizer.stats(),
+            'sink': self.sink.name,
+            'stage_times': self.stage_times,
+            'sink_summary': self.sink_summary,
+            'memory': self.memory_guard.stats(),
+        }
+
+    def _execute_bounded(self, overall_start: float) -> dict:
+        """STEP 2 and 3 of execute, one chunk at a time so memory stays flat whatever the file size"""
+        self.logger.info("\nSTEP 2: Filtering and inserting charge data chunk by chunk (memory-bounded)...")
+        stage_start = time.time()
+        self._arrange_charge_data(self._bounded_charge_frames())
+        self.stage_times['filter_load'] = time.time() - stage_start
+
+        if self.total_rows_found == 0:
+            return {
+                'status': 'failed',
+                'error': 'Found no useful data after filtering',
+            }
+        return self._summary(overall_start)
+
+    def _bounded_charge_frames(self) -> Iterable[pandas.DataFrame]:
+        """Filtered chunks, converted to tall and normalized, ready for _arrange_charge_data"""
+        for filtered_chunk in self._filtered_chunks():
+            # object first: under pandas 3, where() leaves NaN in string columns, which would hash as "nan"
+            filtered_chunk = filtered_chunk.astype(object).where(filtered_chunk.notnull(), None)
+            if not self._detect_tall(filtered_chunk):
+                convert_start = time.time()
+                filtered_chunk = self._convert_wide_to_tall(filtered_chunk)
+                self.stage_times['wide_to_tall'] = self.stage_times.get('wide_to_tall', 0.0) + time.time() - convert_start
+
+            for col, rejected in self._normalize_charge_values(filtered_chunk).items():
+                self.value_rejects[col] = self.value_rejects.get(col, 0) + rejected
+
+            yield filtered_chunk
+            del filtered_chunk
+
+            if self.memory_guard.under_pressure() and self.chunk_rows > self.MIN_CHUNK_ROWS:
+                self.chunk_rows = max(self.MIN_CHUNK_ROWS, self.chunk_rows // 2)
+                self.logger.info(f"Memory pressure: reading {self.chunk_rows:,} rows per chunk")
+
     def _read_hospital_data(self) -> dict:
         """Read hospital metadata from the first two rows of the CSV"""
 
-        with open(self.file_path, 'r', encoding=self.encoding) as f:
-            reader = csv.reader(f)
-            header_row = next(reader)
-            data_row = next(reader)
+        # The file stays open; _filter_services continues from the charge header
+        self.csv_file = HospitalCSVFile(self.file_path)
+        self.encoding = self.csv_file.encoding
 
-            return dict(zip(header_row, data_row))
+        return self.csv_file.metadata
             
     def _upsert_hospital_data(self, metadata: dict[str, str]):
         """Upsert hospital metadata into database"""
@@ -220,41 +290,39 @@ class HospitalChargeETLCSV:
             hospital_national_provider_identifiers = "|".join(x.strip() for x in hospital_national_provider_identifiers.split("|"))
 
         self.hospital_name = hospital_name
-
-        with psycopg.connect(self.db_connection_str) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    DELETE FROM standard_charges
-                    WHERE hospital_name = (%s)
-                """, (hospital_name,))
-                cur.execute("""
-                    DELETE FROM payer_charges
-                    WHERE hospital_name = (%s)
-                """, (hospital_name,))
-                cur.execute("""
-                    INSERT INTO HOSPITALS (hospital_name, hospital_license_number, hospital_national_provider_identifiers, hospital_address, hospital_location, as_of_date, last_update, version, financial_aid_policy)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (hospital_name)
-                    DO UPDATE SET
-                        hospital_license_number = EXCLUDED.hospital_license_number,
-                        hospital_national_provider_identifiers = EXCLUDED.hospital_national_provider_identifiers, 
-                        hospital_address = EXCLUDED.hospital_address,
-                        hospital_location = EXCLUDED.hospital_location,
-                        as_of_date = EXCLUDED.as_of_date,
-                        last_update = EXCLUDED.last_update,
-                        version = EXCLUDED.version,
-                        financial_aid_policy = EXCLUDED.financial_aid_policy
-                """, (hospital_name, hospital_license_number, hospital_national_provider_identifiers, hospital_address, hospital_location, as_of_date, last_update, version, financial_aid_policy))
+        self.as_of_date = as_of_date
+
+        self.sink.begin_hospital({
+            'hospital_name': hospital_name,
+            'hospital_license_number': hospital_license_number,
+            'hospital_national_provider_identifiers': hospital_national_provider_identifiers,
+            'hospital_address': hospital_address,
+            'hospital_location': hospital_location,
+            'as_of_date': as_of_date,
+            'last_update': last_update,
+            'version': version,
+            'financial_aid_policy': financial_aid_policy,
+        })
 
     def _filter_services(self) -> pandas.DataFrame:
         """Filter services with flexible column discovery and vectorized operations"""
 
+        filtered_chunks = list(self._filtered_chunks())
+        
+        if not filtered_chunks:
+            self.logger.info("\nERROR: No data kept after filtering!")
+            return pandas.DataFrame()
+        
+        chargeData = pandas.concat(filtered_chunks, ignore_index=True)
+        # object first: under pandas 3, where() leaves NaN in string columns, which would hash as "nan"
+        return chargeData.astype(object).where(chargeData.notnull(), None)
+
+    def _filtered_chunks(self) -> Iterable[pandas.DataFrame]:
+        """Discover the columns, then parse and filter the charge rows chunk by chunk, yielding the non-empty results"""
+
         # Discover columns from file
         self.logger.info("Discovering column structure...")
-        with open(self.file_path, 'r', encoding=self.encoding) as f:
-            next(f)  # Skip hospital metadata
-            next(f)
-            charge_header = next(csv.reader(f))
+        charge_header = self.csv_file.charge_header
         
         self.column_mapping = self._discover_columns(charge_header)
         
@@ -273,106 +341,88 @@ class HospitalChargeETLCSV:
         self.logger.info("="*70)
 
         # Read and filter chunks
-        chunks = pandas.read_csv(self.file_path, skiprows=2, encoding=self.encoding, 
-                            chunksize=100000, dtype=str, low_memory=False)
-        filtered_chunks = []
+        if self.engine == 'arrow':
+            from Arrow_CSV_Engine import ArrowChargeFilter, read_batches
+            arrow_filter = ArrowChargeFilter(self.column_mapping)
+            batches = read_batches(self.csv_file, arrow_filter.column_types(charge_header), prefilter=self.prefilter)
+            filtered = arrow_filter.filter_batches(batches)
+        else:
+            filtered = (self._filter_chunk(chunk) for chunk in self._pandas_chunks())
 
         total_rows = 0
         kept_rows = 0
-        
-        for chunk_num, chunk in enumerate(chunks, 1):
-            chunk_total = len(chunk)
+        chunk_num = 0
+        
+        while True:
+            # Only the parsing and filtering count towards parse_time, not the consumer's work between chunks
+            parse_start = time.time()
+            try:
+                chunk_total, chunk_kept, filtered_chunk = next(filtered)
+            except StopIteration:
+                self.parse_time += time.time() - parse_start
+                break
+            self.parse_time += time.time() - parse_start
+
+            chunk_num += 1
             total_rows += chunk_total
             self.total_rows_processed += chunk_total
-            
-            self.logger.info(f"  Chunk {chunk_num}: Processing {chunk_total:,} rows...")
-            
-            # Add tracking columns
-            chunk['_matched_code'] = None
-            chunk['_matched_type'] = None
-            
-            # Normalize setting
-            if self.column_mapping['setting'] in chunk.columns:
-                chunk[self.column_mapping['setting']] = chunk[self.column_mapping['setting']].apply(self._normalize_setting)
-            
-            # Build filter condition and capture matched code/type
-            filter_condition = pandas.Series([False] * len(chunk), index=chunk.index)
-
-            for code_col, type_col in zip(self.column_mapping['code_columns'], 
-                                            self.column_mapping['type_columns']):
-                if code_col not in chunk.columns or type_col not in chunk.columns:
-                    continue
-                
-                # Normalize codes (uppercase, strip)
-                chunk[code_col] = chunk[code_col].astype(str).str.upper().str.strip()
-                
-                # Check if type is allowed
-                valid_type = chunk[type_col].isin(self.ALLOWED_TYPES)
-                
-                # For DRG types, all codes allowed
-                is_drg = chunk[type_col].isin(['MS-DRG', 'APR-DRG'])
-                
-                # For CPT/HCPCS, only whitelist codes allowed
-                is_cpt_hcpcs = chunk[type_col].isin(['CPT', 'HCPCS'])
-                code_in_whitelist = chunk[code_col].isin(self.ALLOWED_CPT_HCPCS_CODES)
-                
-                # Combine: valid_type AND (DRG OR (CPT/HCPCS AND in_whitelist))
-                matches = valid_type & (is_drg | (is_cpt_hcpcs & code_in_whitelist))
-                
-                # Only update rows that haven't been matched yet
-                unmatched = chunk['_matched_code'].isna()
-                newly_matched = matches & unmatched
-                
-                # Store the matched code and type - iterate through matched indices
-                for idx in chunk[newly_matched].index:
-                    chunk.at[idx, '_matched_code'] = chunk.at[idx, code_col]
-                    chunk.at[idx, '_matched_type'] = chunk.at[idx, type_col]
-                
-                filter_condition = filter_condition | matches
-            
-            
-            filtered_chunk = chunk[filter_condition]
-            chunk_kept = len(filtered_chunk)
             kept_rows += chunk_kept
             self.total_rows_kept += chunk_kept
             
+            self.logger.info(f"  Chunk {chunk_num}: Processed {chunk_total:,} rows")
+            self.logger.info(f"{chunk_total:,} rows -> {chunk_kept:,} kept")
+            
             if len(filtered_chunk) > 0:
-                # Handle "Both" settings by duplicating rows
-                setting_col = self.column_mapping['setting']
-                both_mask = filtered_chunk[setting_col] == 'Both'
-                
-                if both_mask.any():
-                    # Split into "Both" and non-"Both" rows
-                    both_rows = filtered_chunk[both_mask].copy()
-                    normal_rows = filtered_chunk[~both_mask].copy()
-                    
-                    # Create two copies of "Both" rows - one for each setting
-                    inpatient_rows = both_rows.copy()
-                    inpatient_rows[setting_col] = 'Inpatient'
-                    
-                    outpatient_rows = both_rows.copy()
-                    outpatient_rows[setting_col] = 'Outpatient'
-                    
-                    # Combine all rows
-                    filtered_chunk = pandas.concat([normal_rows, inpatient_rows, outpatient_rows], ignore_index=True)
-                    
-                    
                 self.total_rows_found += len(filtered_chunk)
-                filtered_chunks.append(filtered_chunk)
-            
-            self.logger.info(f"{chunk_total:,} rows -> {chunk_kept:,} kept")
+                yield filtered_chunk
         
+        self.csv_file.close()
+
+        prefiltered = self.csv_file.prefiltered
+        if prefiltered is not None:
+            total_rows += prefiltered.records_skipped
+            self.total_rows_processed += prefiltered.records_skipped
+            self.logger.info(f"Prefilter: {prefiltered.records_scanned:,} records scanned, "
+                             f"{prefiltered.records_skipped:,} skipped before parsing")
+
         self.logger.info(f"\nTotal: {total_rows:,} rows -> {kept_rows:,} kept")
+        self.logger.info(f"Parse throughput ({self.engine}): "
+                         f"{total_rows / self.parse_time if self.parse_time else 0:,.0f} rows/s")
+
+    def _pandas_chunks(self) -> Iterable[pandas.DataFrame]:
+        """Chunks of self.chunk_rows rows, read as requested so the chunk size can shrink mid-file"""
+        reader = self.csv_file.read_chunks(chunksize=self.chunk_rows, prefilter=self.prefilter)
+        while True:
+            try:
+                yield reader.get_chunk(self.chunk_rows)
+            except StopIteration:
+                return
+                    
+    def _filter_chunk(self, chunk: pandas.DataFrame) -> Tuple[int, int, pandas.DataFrame]:
+        """
+        Keep the rows of a pandas chunk with a relevant code
+
+        :return: (rows read, rows kept before Both expansion, kept rows)
+        """
+        # Find the first relevant code/type pair of every row in one pass
+        matched, matched_codes, matched_types = CODE_FILTER.first_match_frame(
+            chunk, self.column_mapping['code_columns'], self.column_mapping['type_columns'])
         
-        if not filtered_chunks:
-            self.logger.info("\nERROR: No data kept after filtering!")
-            return pandas.DataFrame()
+        filtered_chunk = chunk[matched].copy()
+        filtered_chunk['_matched_code'] = matched_codes[matched]
+        filtered_chunk['_matched_type'] = matched_types[matched]
+        chunk_kept = len(filtered_chunk)
         
-        chargeData = pandas.concat(filtered_chunks, ignore_index=True)
-        return chargeData.where(chargeData.notnull(), None)
-                    
-    def _arrange_charge_data(self, chargeData: pandas.DataFrame):
-        """Process charge data with flexible column mapping"""
+        setting_col = self.column_mapping['setting']
+        if chunk_kept > 0 and setting_col in filtered_chunk.columns:
+            filtered_chunk[setting_col] = self._normalize_settings(filtered_chunk[setting_col])
+            # Handle "Both" settings by duplicating rows
+            filtered_chunk = self._expand_both_settings(filtered_chunk, setting_col)
+        
+        return len(chunk), chunk_kept, filtered_chunk
+
+    def _arrange_charge_data(self, chargeData: pandas.DataFrame | Iterable[pandas.DataFrame]):
+        """Process charge data, one frame or a stream of frames, with flexible column mapping"""
         
         start_time = time.time()
         
@@ -380,157 +430,130 @@ class HospitalChargeETLCSV:
         total_standard_charges_inserted = 0
         total_payer_charges_inserted = 0
         
-        with psycopg.connect(self.db_connection_str) as conn:
-            with conn.cursor() as cur:
-                num_records = 0
-                batch_start = time.time()
-                
-                services_batch = []
-                standard_charges_batch = []
-                payer_charges_batch = []
-                
-                for _, row in chargeData.iterrows():
-                    setting = row[self.column_mapping['setting']]
-                    description = row[self.column_mapping['description']]
-                    
-                    # Use the pre-matched code and type from filtering
-                    code = row['_matched_code']
-                    code_type = row['_matched_type']
-                    
-                    if not code or not code_type:
-                        logging.error("Matched code or matched type was none")
-                        continue  # Should rarely happen since we filtered already
+        num_records = 0
+        batch_start = time.time()
+        
+        batches = ChargeBatches()
+        
+        frames = [chargeData] if isinstance(chargeData, pandas.DataFrame) else chargeData
+        for frame in frames:
+            for _, row in frame.iterrows():
+                setting = row[self.column_mapping['setting']]
+                description = row[self.column_mapping['description']]
+            
+                # Use the pre-matched code and type from filtering
+                code = row['_matched_code']
+                code_type = row['_matched_type']
+            
+                if not code or not code_type:
+                    logging.error("Matched code or matched type was none")
+                    continue  # Should rarely happen since we filtered already
 
-                    modifiers = row[self.column_mapping['modifiers']] if self.column_mapping['modifiers'] else None
+                modifiers = normalize_modifiers(row[self.column_mapping['modifiers']]) if self.column_mapping['modifiers'] else None
 
-                    service_id = sha256(f"{setting}|{code}|{code_type}|{modifiers}".encode()).hexdigest()
+                service_id = compute_service_id(setting, code, code_type, modifiers)
 
-                    services_batch.append((service_id, setting, code, description, code_type, modifiers))
-                    
-                    # Get standard charges (using column mapping)
-                    gross = row[self.column_mapping['gross']] if self.column_mapping['gross'] else None
-                    discounted = row[self.column_mapping['discounted_cash']] if self.column_mapping['discounted_cash'] else None
-                    min_charge = row[self.column_mapping['min']] if self.column_mapping['min'] else None
-                    max_charge = row[self.column_mapping['max']] if self.column_mapping['max'] else None
-                    
-                    standard_charges_batch.append((
-                        service_id, 
+                batches.services.append((service_id, setting, code, description, code_type, modifiers))
+            
+                # Get standard charges (using column mapping)
+                gross = row[self.column_mapping['gross']] if self.column_mapping['gross'] else None
+                discounted = row[self.column_mapping['discounted_cash']] if self.column_mapping['discounted_cash'] else None
+                min_charge = row[self.column_mapping['min']] if self.column_mapping['min'] else None
+                max_charge = row[self.column_mapping['max']] if self.column_mapping['max'] else None
+            
+                batches.standard_charges.append((
+                    service_id, 
+                    self.hospital_name, 
+                    gross, discounted, min_charge, max_charge
+                ))
+            
+                # Get payer charges (using column mapping)
+                payer_name = row[self.column_mapping['payer_name']] if self.column_mapping['payer_name'] else None
+                plan_name = row[self.column_mapping['plan_name']] if self.column_mapping['plan_name'] else None
+                negotiated_dollar = row[self.column_mapping['negotiated_dollar']] if self.column_mapping['negotiated_dollar'] else None
+                negotiated_algorithm = row[self.column_mapping['negotiated_algorithm']] if self.column_mapping['negotiated_algorithm'] else None
+                negotiated_percentage = row[self.column_mapping['negotiated_percentage']] if self.column_mapping['negotiated_percentage'] else None
+                estimated_amount = row[self.column_mapping['estimated_amount']] if self.column_mapping['estimated_amount'] else None
+                methodology = row[self.column_mapping['methodology']] if self.column_mapping['methodology'] else None
+                additional_notes = row[self.column_mapping['additional_notes']] if self.column_mapping['additional_notes'] else None
+                median_amount = row[self.column_mapping['median_amount']] if self.column_mapping['median_amount'] else None
+                tenth_percentile_amount = row[self.column_mapping['10th_percentile_amount']] if self.column_mapping['10th_percentile_amount'] else None
+                ninetieth_percentile_amount = row[self.column_mapping['90th_percentile_amount']] if self.column_mapping['90th_percentile_amount'] else None
+                count_amounts = row[self.column_mapping['count']] if self.column_mapping['count'] else None
+
+                if payer_name is not None and plan_name is not None:
+                    batches.payer_charges.append((
+                        service_id,
                         self.hospital_name, 
-                        gross, discounted, min_charge, max_charge
+                        payer_name, plan_name,
+                        negotiated_dollar, negotiated_algorithm, negotiated_percentage,
+                        estimated_amount, methodology, additional_notes,
+                        median_amount, tenth_percentile_amount, ninetieth_percentile_amount,
+                        count_amounts
                     ))
-                    
-                    # Get payer charges (using column mapping)
-                    payer_name = row[self.column_mapping['payer_name']] if self.column_mapping['payer_name'] else None
-                    plan_name = row[self.column_mapping['plan_name']] if self.column_mapping['plan_name'] else None
-                    negotiated_dollar = row[self.column_mapping['negotiated_dollar']] if self.column_mapping['negotiated_dollar'] else None
-                    negotiated_algorithm = row[self.column_mapping['negotiated_algorithm']] if self.column_mapping['negotiated_algorithm'] else None
-                    negotiated_percentage = row[self.column_mapping['negotiated_percentage']] if self.column_mapping['negotiated_percentage'] else None
-                    estimated_amount = row[self.column_mapping['estimated_amount']] if self.column_mapping['estimated_amount'] else None
-                    methodology = row[self.column_mapping['methodology']] if self.column_mapping['methodology'] else None
-                    additional_notes = row[self.column_mapping['additional_notes']] if self.column_mapping['additional_notes'] else None
-                    median_amount = row[self.column_mapping['median_amount']] if self.column_mapping['median_amount'] else None
-                    tenth_percentile_amount = row[self.column_mapping['10th_percentile_amount']] if self.column_mapping['10th_percentile_amount'] else None
-                    ninetieth_percentile_amount = row[self.column_mapping['90th_percentile_amount']] if self.column_mapping['90th_percentile_amount'] else None
-                    count_amounts = row[self.column_mapping['count']] if self.column_mapping['count'] else None
-
-                    if payer_name is not None and plan_name is not None:
-                        payer_charges_batch.append((
-                            service_id,
-                            self.hospital_name, 
-                            payer_name, plan_name,
-                            negotiated_dollar, negotiated_algorithm, negotiated_percentage,
-                            estimated_amount, methodology, additional_notes,
-                            median_amount, tenth_percentile_amount, ninetieth_percentile_amount,
-                            count_amounts
-                        ))
-
-                    num_records += 1
-                    
-                    if num_records % 5000 == 0:
-                        batch_counts = self._execute_batch_upserts(cur, services_batch, standard_charges_batch, payer_charges_batch)
-                        total_services_inserted += batch_counts[0]
-                        total_standard_charges_inserted += batch_counts[1]
-                        total_payer_charges_inserted += batch_counts[2]
-                        
-                        batch_end = time.time()
-                        batch_time = batch_end - batch_start
-                        total_time = batch_end - start_time
-                        avg_time_per_record = total_time / num_records
-                        
-                        self.logger.info(f"Processed {num_records:,} records in {total_time:.2f}s "
-                              f"(batch: {batch_time:.2f}s, avg: {avg_time_per_record*1000:.2f}ms/record)")
-                        
-                        services_batch = []
-                        standard_charges_batch = []
-                        payer_charges_batch = []
-                        batch_start = time.time()
-                
-                if services_batch:
-                    batch_counts = self._execute_batch_upserts(cur, services_batch, standard_charges_batch, payer_charges_batch)
+
+                num_records += 1
+            
+                if self.batch_sizer.should_flush(batches) or self.memory_guard.under_pressure():
+                    batch_counts = self._flush_batches(batches)
                     total_services_inserted += batch_counts[0]
                     total_standard_charges_inserted += batch_counts[1]
                     total_payer_charges_inserted += batch_counts[2]
                 
-                conn.commit()
+                    batch_end = time.time()
+                    batch_time = batch_end - batch_start
+                    total_time = batch_end - start_time
+                    avg_time_per_record = total_time / num_records
                 
-                end_time = time.time()
-                total_time = end_time - start_time
-                self.logger.info(f"\n=== Insertion Complete ===")
-                self.logger.info(f"Total records processed: {num_records:,}")
-                self.logger.info(f"Actual insertions:")
-                self.logger.info(f"  Services: {total_services_inserted:,}")
-                self.logger.info(f"  Standard Charges: {total_standard_charges_inserted:,}")
-                self.logger.info(f"  Payer Charges: {total_payer_charges_inserted:,}")
-                self.logger.info(f"Total time: {total_time:.2f}s")
-                self.logger.info(f"Records per second: {num_records/total_time:.2f}")
-
-    def _execute_batch_upserts(self, cur, services_batch, standard_charges_batch, payer_charges_batch):
-        """Execute batch upserts for all three tables"""
-        services_inserted = 0
-        standard_charges_inserted = 0
-        payer_charges_inserted = 0
-        
-        if services_batch:
-            cur.executemany("""
-                INSERT INTO services (service_id, setting, code, description, type, modifiers)
-                VALUES(%s, %s, %s, %s, %s, %s)
-                ON CONFLICT DO NOTHING
-            """, services_batch)
-            services_inserted = cur.rowcount
-        
-        if standard_charges_batch:
-            cur.executemany("""
-                INSERT INTO standard_charges (service_id, hospital_name, standard_charge_gross, standard_charge_discounted_cash, standard_charge_min, standard_charge_max)
-                VALUES(%s, %s, %s, %s, %s, %s)
-                ON CONFLICT (service_id, hospital_name)
-                DO UPDATE SET 
-                    standard_charge_gross = COALESCE(EXCLUDED.standard_charge_gross, standard_charges.standard_charge_gross),
-                    standard_charge_discounted_cash = COALESCE(EXCLUDED.standard_charge_discounted_cash, standard_charges.standard_charge_discounted_cash),
-                    standard_charge_min = COALESCE(EXCLUDED.standard_charge_min, standard_charges.standard_charge_min),
-                    standard_charge_max = COALESCE(EXCLUDED.standard_charge_max, standard_charges.standard_charge_max)                            
-            """, standard_charges_batch)
-            standard_charges_inserted = cur.rowcount
-        
-        if payer_charges_batch:
-            cur.executemany("""
-                INSERT INTO payer_charges (service_id, hospital_name, payer_name, plan_name, standard_charge_negotiated_dollar, standard_charge_negotiated_algorithm, standard_charge_negotiated_percent, estimated_amount, standard_charge_methodology, additional_generic_notes, median_amount, tenth_percentile_amount, ninetieth_percentile_amount, count_amounts)
-                VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (service_id, hospital_name, payer_name, plan_name)
-                DO UPDATE SET
-                    standard_charge_negotiated_dollar = EXCLUDED.standard_charge_negotiated_dollar,
-                    standard_charge_negotiated_algorithm = EXCLUDED.standard_charge_negotiated_algorithm,
-                    standard_charge_negotiated_percent = EXCLUDED.standard_charge_negotiated_percent,
-                    estimated_amount = EXCLUDED.estimated_amount,
-                    standard_charge_methodology = EXCLUDED.standard_charge_methodology,
-                    additional_generic_notes = EXCLUDED.additional_generic_notes,
-                    median_amount = EXCLUDED.median_amount,
-                    tenth_percentile_amount = EXCLUDED.tenth_percentile_amount,
-                    ninetieth_percentile_amount = EXCLUDED.ninetieth_percentile_amount,
-                    count_amounts = EXCLUDED.count_amounts
-            """, payer_charges_batch)
-            payer_charges_inserted = cur.rowcount
-        
-        return (services_inserted, standard_charges_inserted, payer_charges_inserted)
+                    self.logger.info(f"Processed {num_records:,} records in {total_time:.2f}s "
+                          f"(batch: {batch_time:.2f}s, avg: {avg_time_per_record*1000:.2f}ms/record, "
+                          f"next batch: {self.batch_sizer.batch_rows:,} rows)")
+                
+                    batches = ChargeBatches()
+                    batch_start = time.time()
+        
+        if len(batches):
+            batch_counts = self._flush_batches(batches)
+            total_services_inserted += batch_counts[0]
+            total_standard_charges_inserted += batch_counts[1]
+            total_payer_charges_inserted += batch_counts[2]
+
+        if num_records == 0:
+            # Nothing to replace the hospital's previous load with; leave it in place
+            self.sink.abort()
+            return
+
+        sink_summary = self.sink_summary = self.sink.finish_hospital()
+        self.rows_written = {'services': total_services_inserted, 'standard_charges': total_standard_charges_inserted,
+                             'payer_charges': total_payer_charges_inserted}
+        
+        end_time = time.time()
+        total_time = end_time - start_time
+        self.logger.info(f"\n=== Insertion Complete ===")
+        self.logger.info(f"Total records processed: {num_records:,}")
+        self.logger.info(f"Actual insertions:")
+        self.logger.info(f"  Services: {total_services_inserted:,}")
+        self.logger.info(f"  Standard Charges: {total_standard_charges_inserted:,}")
+        self.logger.info(f"  Payer Charges: {total_payer_charges_inserted:,}")
+        self.logger.info(f"Total time: {total_time:.2f}s")
+        self.logger.info(f"Records per second: {num_records/total_time:.2f}")
+        cache = self._service_id_cache_stats()
+        self.logger.info(f"Service id cache: {cache['hits']:,} hits, {cache['misses']:,} misses "
+                         f"({cache['hit_rate']:.1%}, {cache['size']:,} cached)")
+        for table, (closed, opened) in sink_summary.get('price_history', {}).items():
+            self.logger.info(f"Price history ({table}): {closed:,} closed, {opened:,} opened")
+
+    def _service_id_cache_stats(self) -> dict:
+        """service_id cache hits and misses of this file, not everything the process loaded before it"""
+        hits, misses = service_id_cache_counts()
+        return service_id_cache_stats(hits - self.service_id_cache_start[0], misses - self.service_id_cache_start[1])
+
+    def _flush_batches(self, batches: ChargeBatches) -> tuple[int, int, int]:
+        """Write the buffered batches to the sink and let the batch sizer learn from how long it took"""
+        flush_start = time.time()
+        batch_counts = self.sink.write(batches)
+        self.batch_sizer.record(batches.row_count, batches.nbytes, time.time() - flush_start)
+        return batch_counts
 
     # Utility Methods
 
@@ -619,6 +642,44 @@ class HospitalChargeETLCSV:
 
         return mapping
 
+    def _normalize_charge_values(self, df: pandas.DataFrame) -> dict[str, int]:
+        """Parse the money and percent columns in place and log values that could not be parsed"""
+        money_keys = ['gross', 'discounted_cash', 'min', 'max', 'negotiated_dollar', 'estimated_amount',
+                      'median_amount', '10th_percentile_amount', '90th_percentile_amount']
+        money_columns = [self.column_mapping[key] for key in money_keys]
+        percent_columns = [self.column_mapping['negotiated_percentage']]
+
+        rejects = normalize_charge_frame(df, money_columns, percent_columns)
+        for col, rejected in rejects.items():
+            self.logger.info(f"  {col}: {rejected:,} values rejected as non-numeric or out of range")
+        return rejects
+
+    def _normalize_settings(self, settings: pandas.Series) -> numpy.ndarray:
+        """Normalize a setting column, running _normalize_setting once per distinct raw value"""
+        codes, uniques = pandas.factorize(settings)
+        # Trailing None is picked up by the -1 code factorize gives missing values
+        lookup = numpy.array([self._normalize_setting(value) for value in uniques] + [None], dtype=object)
+        return lookup[codes]
+
+    def _expand_both_settings(self, df: pandas.DataFrame, setting_col: str) -> pandas.DataFrame:
+        """Replace every "Both" row with an Inpatient row followed by an Outpatient row"""
+        both = df[setting_col].to_numpy(dtype=object) == 'Both'
+        if not both.any():
+            return df
+
+        positions = numpy.repeat(numpy.arange(len(df)), numpy.where(both, 2, 1))
+        expanded = df.iloc[positions].reset_index(drop=True)
+
+        expanded_both = both[positions]
+        first_copy = numpy.ones(len(positions), dtype=bool)
+        first_copy[1:] = positions[1:] != positions[:-1]
+
+        settings = expanded[setting_col].to_numpy(dtype=object, copy=True)
+        settings[expanded_both & first_copy] = 'Inpatient'
+        settings[expanded_both & ~first_copy] = 'Outpatient'
+        expanded[setting_col] = settings
+        return expanded
+
     def _normalize_setting(self, setting: str) -> Optional[str]:
         """Normalize setting values"""
         if not setting or (isinstance(setting, float) and pandas.isna(setting)):
@@ -738,27 +799,6 @@ class HospitalChargeETLCSV:
         self.column_mapping['count'] = 'count' if self.column_mapping['count'] else None
         
         tall_df = pandas.DataFrame(tall_rows)
-        numeric_columns = [
-            'negotiated_dollar', 'negotiated_percentage',
-            self.column_mapping['gross'], self.column_mapping['discounted_cash'],
-            self.column_mapping['min'], self.column_mapping['max']
-        ]
-
-        if self.column_mapping['estimated_amount']:
-            numeric_columns.append(self.column_mapping['estimated_amount']) 
-
-        if self.column_mapping['median_amount']:
-            numeric_columns.append(self.column_mapping['median_amount'])
-        
-        if self.column_mapping['10th_percentile_amount']:
-            numeric_columns.append(self.column_mapping['10th_percentile_amount'])
-
-        if self.column_mapping['90th_percentile_amount']:
-            numeric_columns.append(self.column_mapping['90th_percentile_amount'])
-        
-        for col in numeric_columns:
-            if col in tall_df.columns:
-                tall_df[col] = pandas.to_numeric(tall_df[col], errors='coerce')
         
         return tall_df
 
@@ -780,6 +820,8 @@ class HospitalChargeETLCSV:
         return base_cols
             
 if __name__ == "__main__":
+    import sys
+
     print("Starting ETL process...")
     overall_start = time.time()
 
@@ -787,7 +829,9 @@ if __name__ == "__main__":
     with open("../Credentials/cred.txt", "r") as f:
         db_connection_str = f.readline()
     
-    file_path = "../MachineReadableFiles/261130649_crystal-clinic-orthopaedic-center_standardcharges.csv"
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python Read_Hospital_CSV.py <hospital charge CSV>")
+    file_path = sys.argv[1]
 
     etl = HospitalChargeETLCSV(db_connection_str, file_path)
     result = etl.execute()
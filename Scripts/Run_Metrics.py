@@ -0,0 +1,271 @@
+import datetime
+import json
+import math
+import os
+import threading
+
+
+# Histogram bucket upper bounds, Prometheus style (cumulative, +Inf last)
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, math.inf)
+RATE_BUCKETS = (1e2, 1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 1e7, 1e8, math.inf)
+RATIO_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, math.inf)
+
+# name: (type, help, buckets)
+METRICS = {
+    'mrf_files_total': ('counter', "MRFs processed by status", None),
+    'mrf_download_bytes_total': ('counter', "Bytes downloaded", None),
+    'mrf_download_seconds': ('histogram', "Time to download one MRF", SECONDS_BUCKETS),
+    'mrf_download_bytes_per_second': ('histogram', "Download throughput per MRF", RATE_BUCKETS),
+    'mrf_unzip_seconds': ('histogram', "Time to extract one archive", SECONDS_BUCKETS),
+    'mrf_queue_wait_seconds': ('histogram', "Time blocked on a pipeline queue", SECONDS_BUCKETS),
+    'mrf_stage_seconds': ('histogram', "Time per ETL stage", SECONDS_BUCKETS),
+    'mrf_parse_rows_total': ('counter', "Charge rows (CSV) or items (JSON) read", None),
+    'mrf_parse_rows_per_second': ('histogram', "Rows read per second of ETL time, per MRF", RATE_BUCKETS),
+    'mrf_filter_rows_kept_total': ('counter', "Rows or items kept by the code filter", None),
+    'mrf_filter_keep_ratio': ('histogram', "Fraction of rows kept by the code filter, per MRF", RATIO_BUCKETS),
+    'mrf_sink_rows_total': ('counter', "Rows written to the sink", None),
+    'mrf_sink_rows_per_second': ('histogram', "Rows written per second of sink time, per MRF", RATE_BUCKETS),
+    'mrf_value_rejects_total': ('counter', "Price values rejected as non-numeric or out of range", None),
+    'mrf_file_seconds': ('gauge', "Duration of the last ETL run per hospital", None),
+    'mrf_file_peak_rss_bytes': ('gauge', "Peak RSS sampled during the last ETL run per hospital", None),
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+
+class MetricsRegistry:
+    """
+    Thread safe counters, gauges and histograms with labels, rendered as a
+    dict for JSON reports or in the Prometheus text exposition format.
+    Metric names must be declared in METRICS.
+
+    Usage:
+        registry = MetricsRegistry()
+        registry.inc('mrf_sink_rows_total', 5000, table='payer_charges')
+        registry.observe('mrf_stage_seconds', 1.7, stage='filter')
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}   # name -> {label key: value}
+        self._histograms = {}  # name -> {label key: [bucket counts, sum, count]}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._values.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = METRICS[name][2]
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = [[0] * len(buckets), 0.0, 0]
+            counts, _, _ = entry = series[key]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self) -> dict:
+        """{name: [{'labels', 'value'} or {'labels', 'count', 'sum', 'buckets'}]}"""
+        with self._lock:
+            result = {}
+            for name, series in self._values.items():
+                result[name] = [{'labels': dict(key), 'value': value} for key, value in series.items()]
+            for name, series in self._histograms.items():
+                buckets = METRICS[name][2]
+                result[name] = [{
+                    'labels': dict(key), 'count': count, 'sum': total,
+                    'buckets': {_format_bound(bound): n for bound, n in zip(buckets, counts)},
+                } for key, (counts, total, count) in series.items()]
+            return result
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in METRICS.items():
+                if name in self._values:
+                    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                    lines += [f"{name}{_format_labels(key)} {value}" for key, value in self._values[name].items()]
+                elif name in self._histograms:
+                    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                    for key, (counts, total, count) in self._histograms[name].items():
+                        cumulative = 0
+                        for bound, n in zip(buckets, counts):
+                            cumulative += n
+                            lines.append(f"{name}_bucket{_format_labels(key, (('le', _format_bound(bound)),))} {cumulative}")
+                        lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                        lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, text: str):
+    """Write via a temporary file so readers (e.g. node_exporter) never see half a file"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def _file_stem(file_path: str) -> str:
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+class RunMetrics:
+    """
+    Metrics for one pipeline run. Download, unzip and queue timings are
+    recorded as they happen; every ETL result is turned into a per-file
+    report and folded into the run totals.
+
+    Writes, under report_dir:
+        files/<MRF name>.json   one report per processed file
+        run.json                run totals and every file report
+        metrics.prom            Prometheus textfile (for node_exporter's textfile collector)
+
+    Usage:
+        metrics = RunMetrics("../Reports")
+        pipeline_process(urls, metrics=metrics)
+        metrics.finish()
+    """
+
+    def __init__(self, report_dir: str | None = None, prometheus_path: str | None = None):
+        self.report_dir = report_dir
+        self.prometheus_path = prometheus_path or (os.path.join(report_dir, 'metrics.prom') if report_dir else None)
+        self.registry = MetricsRegistry()
+        self.started = datetime.datetime.now()
+        self.files = []
+        self._lock = threading.Lock()
+
+    def record_download(self, url: str, file_path: str, seconds: float):
+        nbytes = os.path.getsize(file_path)
+        self.registry.inc('mrf_download_bytes_total', nbytes)
+        self.registry.observe('mrf_download_seconds', seconds)
+        if seconds > 0:
+            self.registry.observe('mrf_download_bytes_per_second', nbytes / seconds)
+
+    def record_unzip(self, file_path: str, seconds: float):
+        self.registry.observe('mrf_unzip_seconds', seconds)
+
+    def record_queue_wait(self, queue: str, seconds: float):
+        """:param queue: which side waited, e.g. 'processor' (starved) or 'downloader' (backpressure)"""
+        self.registry.observe('mrf_queue_wait_seconds', seconds, queue=queue)
+
+    def record_file(self, file_path: str, result: dict | None, seconds: float, error: str | None = None,
+                    source: str | None = None, artifacts: dict | None = None) -> dict:
+        """
+        Fold an ETL result (the dict execute returns, or a cache load summary)
+        into the run and write the file's report.
+
+        :param source: where the rows came from, default the ETL's sink name; 'cache' for cache loads
+        :param artifacts: files written about the run, e.g. profiles
+        :return: the file report
+        """
+        result = result or {}
+        status = 'failed' if error or result.get('status') == 'failed' else result.get('status', 'success')
+        hospital = result.get('hospital_license_number') or result.get('hospital_name')
+        self.registry.inc('mrf_files_total', status=status)
+
+        report = {
+            'file': file_path,
+            'hospital': hospital,
+            'status': status,
+            'error': error or result.get('error'),
+            'source': source or result.get('sink'),
+            'seconds': seconds,
+            'stage_times': result.get('stage_times', {}),
+        }
+        if artifacts:
+            report['artifacts'] = artifacts
+
+        if status == 'success':
+            memory = result.get('memory', {})
+            if memory:
+                report['peak_rss_bytes'] = memory.get('peak_rss_bytes')
+            if hospital:
+                self.registry.set('mrf_file_seconds', seconds, hospital=hospital)
+                if memory.get('peak_rss_bytes'):
+                    self.registry.set('mrf_file_peak_rss_bytes', memory['peak_rss_bytes'], hospital=hospital)
+            for stage, stage_seconds in result.get('stage_times', {}).items():
+                self.registry.observe('mrf_stage_seconds', stage_seconds, stage=stage)
+
+            read = result.get('records_processed', 0)
+            kept = result.get('records_kept')
+            execution_time = result.get('execution_time') or seconds
+            report['rows_read'] = read
+            self.registry.inc('mrf_parse_rows_total', read)
+            if read and execution_time:
+                report['rows_per_second'] = read / execution_time
+                self.registry.observe('mrf_parse_rows_per_second', report['rows_per_second'])
+            if kept is not None:
+                report['rows_kept'] = kept
+                self.registry.inc('mrf_filter_rows_kept_total', kept)
+                if read:
+                    report['keep_ratio'] = kept / read
+                    self.registry.observe('mrf_filter_keep_ratio', report['keep_ratio'])
+
+            table_seconds = result.get('sink_summary', {}).get('table_seconds', {})
+            report['sink_rows'] = {}
+            for table, rows in result.get('rows_written', {}).items():
+                report['sink_rows'][table] = {'rows': rows}
+                self.registry.inc('mrf_sink_rows_total', rows, table=table)
+                if rows and table_seconds.get(table):
+                    rate = rows / table_seconds[table]
+                    report['sink_rows'][table]['rows_per_second'] = rate
+                    self.registry.observe('mrf_sink_rows_per_second', rate, table=table)
+
+            for column, rejected in result.get('value_rejects', {}).items():
+                self.registry.inc('mrf_value_rejects_total', rejected, column=column)
+            report['value_rejects'] = result.get('value_rejects', {})
+
+        with self._lock:
+            self.files.append(report)
+        if self.report_dir:
+            _write_atomic(os.path.join(self.report_dir, 'files', f"{_file_stem(file_path)}.json"),
+                          json.dumps(report, indent=2, default=str))
+        return report
+
+    def summary(self) -> dict:
+        with self._lock:
+            files = list(self.files)
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+            'seconds': (datetime.datetime.now() - self.started).total_seconds(),
+            'files': files,
+            'metrics': self.registry.snapshot(),
+        }
+
+    def finish(self) -> dict:
+        """Write the run report and the Prometheus textfile; returns the run report"""
+        summary = self.summary()
+        if self.report_dir:
+            _write_atomic(os.path.join(self.report_dir, 'run.json'), json.dumps(summary, indent=2, default=str))
+        if self.prometheus_path:
+            _write_atomic(self.prometheus_path, self.registry.to_prometheus())
+        return summary
@@ -0,0 +1,54 @@
+import math
+from functools import lru_cache
+from hashlib import sha256
+
+
+# The same (setting, code, type, modifiers) combinations repeat thousands of
+# times per file and across hospitals, so the digests are memoized for the
+# whole run (per process). Bounded so a pathological file cannot grow it
+# without limit.
+SERVICE_ID_CACHE_SIZE = 1 << 16
+
+
+def normalize_modifiers(modifiers) -> str | None:
+    """
+    v2 JSON files list modifier_code as an array; CSVs pipe-separate them
+    in one column. Both become the CSV form, which is hashable and what
+    the services.modifiers column holds.
+    """
+    if isinstance(modifiers, (list, tuple)):
+        return "|".join(str(m) for m in modifiers) or None
+    if isinstance(modifiers, float) and math.isnan(modifiers):
+        # pandas' missing value; must hash the same as None
+        return None
+    return modifiers
+
+
+@lru_cache(maxsize=SERVICE_ID_CACHE_SIZE)
+def service_id(setting, code, code_type, modifiers) -> str:
+    """Primary key of a row in services"""
+    return sha256(f"{setting}|{code}|{code_type}|{modifiers}".encode()).hexdigest()
+
+
+def service_id_cache_counts() -> tuple[int, int]:
+    """(hits, misses) of this process's service_id cache since it started"""
+    info = service_id.cache_info()
+    return info.hits, info.misses
+
+
+def service_id_cache_stats(hits: int, misses: int) -> dict:
+    """
+    Summary of one run's service_id lookups. The cache lives for the whole
+    process and each worker process has its own, so callers count their
+    hits and misses from differences of service_id_cache_counts() rather
+    than reporting the cache's lifetime totals. size is this process's.
+    """
+    info = service_id.cache_info()
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+        'hit_rate': hits / lookups if lookups else 0.0,
+    }
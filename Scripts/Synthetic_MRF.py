@@ -0,0 +1,280 @@
+import csv
+import json
+import os
+import random
+from typing import Iterator, Optional
+
+from Code_Filter import ALLOWED_CPT_HCPCS_CODES
+
+
+FORMATS = ('tall', 'wide', 'json')
+
+PAYERS = ('Aetna', 'Anthem', 'Cigna', 'Humana', 'UnitedHealthcare', 'Medical Mutual', 'CareSource', 'Molina',
+          'Oscar', 'Ambetter')
+PLANS = ('PPO', 'HMO', 'EPO', 'POS', 'Medicare Advantage', 'Medicaid', 'Marketplace')
+METHODOLOGIES = ('fee schedule', 'case rate', 'per diem', 'percent of total billed charges', 'other')
+SETTINGS = ('inpatient', 'outpatient', 'both')
+
+_WORDS = ('MRI', 'CT', 'knee', 'hip', 'spine', 'lumbar', 'cervical', 'abdomen', 'pelvis', 'with contrast',
+          'without contrast', 'panel', 'comprehensive', 'metabolic', 'office visit', 'new patient', 'established',
+          'colonoscopy', 'biopsy', 'arthroscopy', 'repair', 'injection', 'ultrasound', 'x-ray', '2 views', 'bilateral')
+
+_MATCHING_CODES = sorted(ALLOWED_CPT_HCPCS_CODES)
+
+_CSV_CODE_COLUMNS = ['description', 'code|1', 'code|1|type', 'code|2', 'code|2|type', 'modifiers', 'setting',
+                     'standard_charge|gross', 'standard_charge|discounted_cash', 'standard_charge|min',
+                     'standard_charge|max']
+
+
+def payer_plans(payers: int, plans: int) -> list[tuple[str, str]]:
+    """(payer, plan) pairs, numbering payer names once the stock list runs out"""
+    names = [PAYERS[p % len(PAYERS)] + (f" {p // len(PAYERS) + 1}" if p >= len(PAYERS) else '') for p in range(payers)]
+    return [(name, PLANS[q % len(PLANS)] + (f" {q // len(PLANS) + 1}" if q >= len(PLANS) else ''))
+            for name in names for q in range(plans)]
+
+
+def _charge_items(rng: random.Random, plans: list[tuple[str, str]], match_rate: float, both_rate: float,
+                  percent_rate: float) -> Iterator[dict]:
+    """
+    Endless stream of format neutral charge items. Each has a chargemaster
+    code first and, for match_rate of them, a code the filters keep second,
+    so the ETL has to look past the first code column.
+    """
+    index = 0
+    while True:
+        index += 1
+        if rng.random() < match_rate:
+            if rng.random() < 0.2:
+                code, code_type = f"{rng.randint(1, 999):03d}", 'MS-DRG'
+            else:
+                code = rng.choice(_MATCHING_CODES)
+                code_type = 'HCPCS' if code[0].isalpha() else 'CPT'
+        else:
+            # A code type the filters never keep, or a CPT code outside the list
+            code, code_type = (f"L{index:06d}", 'LOCAL') if rng.random() < 0.5 else (f"X{index % 10000:04d}", 'CPT')
+
+        if rng.random() < both_rate:
+            setting = 'both'
+        else:
+            setting = rng.choice(SETTINGS[:2])
+
+        gross = round(rng.uniform(20, 50_000), 2)
+        payers = []
+        for payer, plan in plans:
+            if rng.random() < percent_rate:
+                percentage = round(rng.uniform(30, 90), 1)
+                payers.append({
+                    'payer_name': payer, 'plan_name': plan, 'dollar': None, 'percentage': percentage,
+                    'algorithm': f"{percentage}% of billed charges", 'estimated_amount': round(gross * percentage / 100, 2),
+                    'methodology': 'percent of total billed charges',
+                })
+            else:
+                payers.append({
+                    'payer_name': payer, 'plan_name': plan, 'dollar': round(gross * rng.uniform(0.2, 0.9), 2),
+                    'percentage': None, 'algorithm': None, 'estimated_amount': None,
+                    'methodology': rng.choice(METHODOLOGIES[:3]),
+                })
+        dollars = [p['dollar'] if p['dollar'] is not None else p['estimated_amount'] for p in payers]
+
+        yield {
+            'description': " ".join(rng.sample(_WORDS, rng.randint(2, 5))),
+            'codes': [(f"{index:07d}", 'CDM'), (code, code_type)],
+            'modifiers': rng.choice(('26', 'TC', '50')) if rng.random() < 0.05 else None,
+            'setting': setting,
+            'gross': gross,
+            'discounted_cash': round(gross * 0.6, 2),
+            'min': min(dollars) if dollars else None,
+            'max': max(dollars) if dollars else None,
+            'payers': payers,
+            'matches': code_type != 'LOCAL' and (code_type == 'MS-DRG' or code in ALLOWED_CPT_HCPCS_CODES),
+        }
+
+
+def _money_text(rng: random.Random, value: Optional[float], dirty_rate: float) -> str:
+    """CSV rendering of a price, sometimes the way hospitals actually publish them"""
+    if value is None:
+        return 'N/A' if rng.random() < dirty_rate else ''
+    if rng.random() < dirty_rate:
+        return f"${value:,.2f}"
+    return f"{value:.2f}"
+
+
+def _metadata(hospital_name: str) -> dict:
+    return {
+        'hospital_name': hospital_name,
+        'last_updated_on': '2025-01-01',
+        'version': '2.0.0',
+        'location_name': f"{hospital_name} Main Campus",
+        'hospital_address': '100 Main St, Dayton, OH 45402',
+        'license_number|OH': '0000',
+        'type_2_npi': '1234567890|1234567891',
+        'financial_aid_policy': 'https://example.org/financial-assistance',
+    }
+
+
+class _Progress:
+    """Tracks what has been generated and decides when to stop"""
+
+    def __init__(self, f, items: Optional[int], target_bytes: Optional[int]):
+        self.f = f
+        self.items = items
+        self.target_bytes = target_bytes
+        self.generated = 0
+        self.matching = 0
+        self.rows = 0
+
+    def more(self) -> bool:
+        if self.target_bytes is not None:
+            # tell() flushes, so only look every so often
+            return self.generated % 32 != 0 or self.f.tell() < self.target_bytes
+        return self.generated < self.items
+
+    def add(self, item: dict, rows: int):
+        self.generated += 1
+        self.matching += item['matches']
+        self.rows += rows
+
+
+def _write_tall_csv(f, items, progress: _Progress, rng: random.Random, hospital_name: str, dirty_rate: float):
+    writer = csv.writer(f, lineterminator='\n')
+    metadata = _metadata(hospital_name)
+    writer.writerow(metadata.keys())
+    writer.writerow(metadata.values())
+    writer.writerow(_CSV_CODE_COLUMNS + [
+        'payer_name', 'plan_name', 'standard_charge|negotiated_dollar', 'standard_charge|negotiated_percentage',
+        'standard_charge|negotiated_algorithm', 'estimated_amount', 'standard_charge|methodology',
+        'additional_generic_notes'])
+
+    while progress.more():
+        item = next(items)
+        base = _csv_base(item, rng, dirty_rate)
+        for payer in item['payers']:
+            writer.writerow(base + [
+                payer['payer_name'], payer['plan_name'], _money_text(rng, payer['dollar'], dirty_rate),
+                payer['percentage'] or '', payer['algorithm'] or '', _money_text(rng, payer['estimated_amount'], 0),
+                payer['methodology'], '',
+            ])
+        progress.add(item, len(item['payers']))
+
+
+def _write_wide_csv(f, items, progress: _Progress, rng: random.Random, hospital_name: str, dirty_rate: float,
+                    plans: list[tuple[str, str]]):
+    writer = csv.writer(f, lineterminator='\n')
+    metadata = _metadata(hospital_name)
+    writer.writerow(metadata.keys())
+    writer.writerow(metadata.values())
+    header = list(_CSV_CODE_COLUMNS)
+    for payer, plan in plans:
+        header += [f"standard_charge|{payer}|{plan}|negotiated_dollar", f"standard_charge|{payer}|{plan}|negotiated_percentage",
+                   f"standard_charge|{payer}|{plan}|negotiated_algorithm", f"estimated_amount|{payer}|{plan}",
+                   f"standard_charge|{payer}|{plan}|methodology"]
+    writer.writerow(header + ['additional_generic_notes'])
+
+    while progress.more():
+        item = next(items)
+        row = _csv_base(item, rng, dirty_rate)
+        for payer in item['payers']:
+            row += [_money_text(rng, payer['dollar'], dirty_rate), payer['percentage'] or '', payer['algorithm'] or '',
+                    _money_text(rng, payer['estimated_amount'], 0), payer['methodology']]
+        writer.writerow(row + [''])
+        progress.add(item, 1)
+
+
+def _csv_base(item: dict, rng: random.Random, dirty_rate: float) -> list:
+    (code1, type1), (code2, type2) = item['codes']
+    return [item['description'], code1, type1, code2, type2, item['modifiers'] or '', item['setting'],
+            _money_text(rng, item['gross'], dirty_rate), _money_text(rng, item['discounted_cash'], dirty_rate),
+            _money_text(rng, item['min'], 0), _money_text(rng, item['max'], 0)]
+
+
+def _write_json(f, items, progress: _Progress, hospital_name: str):
+    metadata = _metadata(hospital_name)
+    license_number = metadata.pop('license_number|OH')
+    header = {
+        'hospital_name': hospital_name,
+        'last_updated_on': metadata['last_updated_on'],
+        'version': metadata['version'],
+        'location_name': [metadata['location_name']],
+        'hospital_address': [metadata['hospital_address']],
+        'license_information': {'license_number': license_number, 'state': 'OH'},
+        'type_2_npi': metadata['type_2_npi'].split('|'),
+        'financial_aid_policy': metadata['financial_aid_policy'],
+    }
+    # Streamed so the generator's memory does not grow with the file
+    f.write(json.dumps(header)[:-1] + ', "standard_charge_information": [')
+
+    first = True
+    while progress.more():
+        item = next(items)
+        payers_information = []
+        for payer in item['payers']:
+            entry = {'payer_name': payer['payer_name'], 'plan_name': payer['plan_name'], 'methodology': payer['methodology']}
+            if payer['dollar'] is not None:
+                entry['standard_charge_dollar'] = payer['dollar']
+            else:
+                entry['standard_charge_percentage'] = payer['percentage']
+                entry['standard_charge_algorithm'] = payer['algorithm']
+                entry['estimated_amount'] = payer['estimated_amount']
+            payers_information.append(entry)
+
+        standard_charge = {'setting': item['setting'], 'gross_charge': item['gross'], 'discounted_cash': item['discounted_cash'],
+                           'minimum': item['min'], 'maximum': item['max'], 'payers_information': payers_information}
+        if item['modifiers']:
+            standard_charge['modifier_code'] = item['modifiers']
+
+        f.write(('' if first else ', ') + json.dumps({
+            'description': item['description'],
+            'code_information': [{'code': code, 'type': code_type} for code, code_type in item['codes']],
+            'standard_charges': [standard_charge],
+        }))
+        first = False
+        progress.add(item, len(item['payers']))
+
+    f.write(']}')
+
+
+def generate_mrf(file_path: str, file_format: str = 'tall', items: int = 10_000, payers: int = 5, plans: int = 2,
+                 match_rate: float = 0.2, both_rate: float = 0.1, percent_rate: float = 0.1, dirty_rate: float = 0.05,
+                 target_bytes: Optional[int] = None, seed: int = 0, hospital_name: str = 'Synthetic General Hospital') -> dict:
+    """
+    Write a synthetic machine readable file in the CMS v2 layout.
+
+    :param file_format: 'tall' CSV, 'wide' CSV (one column group per payer/plan) or 'json'
+    :param items: number of charge items (code/setting combinations); a tall CSV has
+                  items * payers * plans rows, a wide CSV items rows
+    :param payers: number of payers, each with plans plans
+    :param match_rate: fraction of items with a code the ETL filters keep
+    :param both_rate: fraction of items with setting 'both', which the ETL doubles
+    :param percent_rate: fraction of payer prices given as a percentage rather than dollars
+    :param dirty_rate: fraction of CSV prices written as "$1,234.50" or "N/A"
+    :param target_bytes: if set, items are generated until the file reaches this size instead
+    :param seed: the same arguments and seed always produce the same file
+    :return: {'path', 'format', 'items', 'matching_items', 'rows', 'bytes'}
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown MRF format: {file_format}. Expected one of {FORMATS}")
+
+    rng = random.Random(seed)
+    plans_list = payer_plans(payers, plans)
+    charge_items = _charge_items(rng, plans_list, match_rate, both_rate, percent_rate)
+
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        progress = _Progress(f, items, target_bytes)
+        if file_format == 'tall':
+            _write_tall_csv(f, charge_items, progress, rng, hospital_name, dirty_rate)
+        elif file_format == 'wide':
+            _write_wide_csv(f, charge_items, progress, rng, hospital_name, dirty_rate, plans_list)
+        else:
+            _write_json(f, charge_items, progress, hospital_name)
+
+    return {
+        'path': file_path,
+        'format': file_format,
+        'items': progress.generated,
+        'matching_items': progress.matching,
+        'rows': progress.rows,
+        'bytes': os.path.getsize(file_path),
+    }
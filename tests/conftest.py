@@ -0,0 +1,37 @@
+import os
+import sys
+
+# The scripts import each other as top-level modules, as when run from Scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts"))
+
+
+import pytest
+
+from Output_Sinks import ChargeSink
+
+
+@pytest.fixture
+def etl_cwd(tmp_path, monkeypatch):
+    """Run from a Scripts-like directory, so the ETLs' ../Logs log file resolves"""
+    (tmp_path / "Logs").mkdir()
+    (tmp_path / "Scripts").mkdir()
+    monkeypatch.chdir(tmp_path / "Scripts")
+    return tmp_path
+
+
+class RecordingSink(ChargeSink):
+    """Keeps every row written, per table"""
+
+    name = 'recording'
+
+    def __init__(self):
+        self.hospitals = []
+        self.rows = {'services': [], 'standard_charges': [], 'payer_charges': []}
+
+    def begin_hospital(self, hospital: dict):
+        self.hospitals.append(hospital)
+
+    def write(self, batches):
+        for table, batch in batches.tables():
+            self.rows[table].extend(batch.rows())
+        return len(batches.services), len(batches.standard_charges), len(batches.payer_charges)
@@ -0,0 +1,16 @@
+from Charge_Batches import DICTIONARY, SERVICE_COLUMNS, TEXT, ColumnarBatch
+
+
+def test_list_values_in_dictionary_column():
+    batch = ColumnarBatch(SERVICE_COLUMNS)
+    batch.append(("id1", "Inpatient", "99203", "Office visit", "CPT", ["25", "59"]))
+    batch.append(("id2", "Inpatient", "99203", "Office visit", "CPT", "25|59"))
+    batch.append(("id3", "Inpatient", "99203", "Office visit", "CPT", []))
+
+    assert [row[5] for row in batch.rows()] == ["25|59", "25|59", None]
+    assert batch.columns[5].values == ["25|59", None]
+
+
+def test_descriptions_are_plain_text():
+    assert dict(SERVICE_COLUMNS)['description'] == TEXT
+    assert dict(SERVICE_COLUMNS)['modifiers'] == DICTIONARY
@@ -0,0 +1,10 @@
+import Connection_Pool
+from Connection_Pool import DirectConnections, create_pool
+
+
+def test_falls_back_without_psycopg_pool(monkeypatch):
+    monkeypatch.setattr(Connection_Pool, 'ConnectionPool', None)
+
+    with create_pool("dbname=prices", name='test') as pool:
+        assert isinstance(pool, DirectConnections)
+        assert (pool.conninfo, pool.name) == ("dbname=prices", 'test')
@@ -0,0 +1,35 @@
+import pytest
+
+from CSV_Reader import HospitalCSVFile
+
+
+def _write_csv(path):
+    """ASCII well past the encoding sample, then a cp1252 e acute"""
+    rows = [b"hospital_name,last_updated_on,version", b"Test Hospital,2024-01-01,2.0.0", b"description,code|1,setting"]
+    filler = b"Office visit,99203,outpatient"
+    rows += [filler] * (2 * HospitalCSVFile.SAMPLE_SIZE // len(filler))
+    rows.append(b"Caf\xe9 visit,99204,outpatient")
+    path.write_bytes(b"\n".join(rows) + b"\n")
+    return str(path)
+
+
+def test_detected_from_ascii_sample(tmp_path):
+    with HospitalCSVFile(_write_csv(tmp_path / "mrf.csv")) as csv_file:
+        assert csv_file.encoding == 'utf-8'
+        assert csv_file.metadata['hospital_name'] == 'Test Hospital'
+
+
+def test_pandas_reads_cp1252_byte_after_sample(tmp_path):
+    with HospitalCSVFile(_write_csv(tmp_path / "mrf.csv")) as csv_file:
+        last = list(csv_file.read_chunks(1000))[-1]
+    assert last['description'].iloc[-1] == 'Café visit'
+
+
+def test_arrow_reads_cp1252_byte_after_sample(tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    from Arrow_CSV_Engine import read_batches
+
+    with HospitalCSVFile(_write_csv(tmp_path / "mrf.csv")) as csv_file:
+        column_types = {name: pyarrow.string() for name in csv_file.charge_header}
+        batches = list(read_batches(csv_file, column_types, block_size=1 << 16))
+    assert batches[-1].column('description')[-1].as_py() == 'Café visit'
@@ -0,0 +1,30 @@
+import pytest
+
+from conftest import RecordingSink
+from Read_Hospital_CSV import HospitalChargeETLCSV
+from Service_Ids import service_id
+from Synthetic_MRF import generate_mrf
+
+
+def _load(file_path, engine):
+    sink = RecordingSink()
+    result = HospitalChargeETLCSV("", file_path, engine=engine, sink=sink).execute()
+    assert result['status'] == 'success', result
+    return sink.rows
+
+
+@pytest.mark.parametrize("file_format", ['tall', 'wide'])
+def test_engines_write_identical_rows(etl_cwd, file_format):
+    pytest.importorskip("pyarrow")
+    file_path = str(etl_cwd / f"{file_format}.csv")
+    generate_mrf(file_path, file_format, items=300, match_rate=0.5)
+
+    pandas_rows = _load(file_path, 'pandas')
+    arrow_rows = _load(file_path, 'arrow')
+
+    assert pandas_rows['services']
+    for table in pandas_rows:
+        assert sorted(pandas_rows[table], key=repr) == sorted(arrow_rows[table], key=repr), table
+    # Every id is the digest of the row it keys, missing modifiers hashing as None
+    for sid, setting, code, _, code_type, modifiers in pandas_rows['services']:
+        assert sid == service_id(setting, code, code_type, modifiers)
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from JSON_Decoders import STREAM, available_decoders, load_json
+from Read_Hospital_JSON import _flatten_shard
+from Service_Ids import normalize_modifiers, service_id
+
+
+def _write_mrf(path, modifiers):
+    document = {
+        "hospital_name": "Test Hospital",
+        "standard_charge_information": [{
+            "description": "Office visit",
+            "code_information": [{"code": "99203", "type": "CPT"}],
+            "standard_charges": [{
+                "setting": "both",
+                "gross_charge": 250,
+                "modifier_code": modifiers,
+                "payers_information": [{"payer_name": "Aetna", "plan_name": "PPO", "standard_charge_dollar": 120,
+                                        "methodology": "fee schedule"}],
+            }],
+        }],
+    }
+    path.write_text(json.dumps(document))
+    return str(path)
+
+
+def test_normalize_modifiers():
+    assert normalize_modifiers(["25", "59"]) == "25|59"
+    assert normalize_modifiers([]) is None
+    assert normalize_modifiers("25") == "25"
+    assert normalize_modifiers(None) is None
+
+
+@pytest.mark.parametrize("decoder", available_decoders() + [STREAM])
+def test_list_valued_modifier_code(tmp_path, decoder):
+    file_path = _write_mrf(tmp_path / "mrf.json", ["25", "59"])
+    items = load_json(file_path, decoder).data["standard_charge_information"]
+
+    batches, payer_records, items_kept, _ = _flatten_shard(items, "Test Hospital")
+
+    assert (payer_records, items_kept) == (1, 1)
+    services = list(batches.services.rows())
+    assert [row[5] for row in services] == ["25|59", "25|59"]
+    assert {row[0] for row in services} == {service_id("Inpatient", "99203", "CPT", "25|59"),
+                                            service_id("Outpatient", "99203", "CPT", "25|59")}
@@ -0,0 +1,20 @@
+from conftest import RecordingSink
+from Charge_Batches import PAYER_CHARGE_COLUMNS
+from Read_Hospital_JSON import HospitalChargeETLJSON
+from Synthetic_MRF import generate_mrf
+
+PERCENT = [name for name, _ in PAYER_CHARGE_COLUMNS].index('standard_charge_negotiated_percent')
+
+
+def test_generated_percentages_are_loaded(etl_cwd):
+    """The generator writes the CMS key, standard_charge_percentage; the reader must pick it up"""
+    file_path = str(etl_cwd / "mrf.json")
+    generate_mrf(file_path, 'json', items=200, match_rate=0.5, percent_rate=0.5, dirty_rate=0.0)
+
+    sink = RecordingSink()
+    result = HospitalChargeETLJSON("", file_path, sink=sink).execute()
+
+    assert result['status'] == 'success', result
+    percents = [row[PERCENT] for row in sink.rows['payer_charges'] if row[PERCENT] is not None]
+    assert percents
+    assert all(isinstance(value, float) for value in percents)
@@ -0,0 +1,24 @@
+import json
+import os
+
+from Normalized_Cache import CACHE_VERSION, PARTIAL_SUFFIX, NormalizedCache
+
+
+def _entry(cache_dir, name, manifest=True):
+    os.makedirs(cache_dir / name / 'services')
+    if manifest:
+        (cache_dir / name / 'manifest.json').write_text(json.dumps({'version': CACHE_VERSION, 'parts': 0}))
+
+
+def test_only_complete_entries_are_listed(tmp_path):
+    digest = 'a' * 64
+    _entry(tmp_path, digest)
+    # A run that crashed after writing its manifest but before the rename
+    _entry(tmp_path, 'b' * 64 + PARTIAL_SUFFIX)
+    # A run that crashed before writing its manifest
+    _entry(tmp_path, 'c' * 64, manifest=False)
+
+    cache = NormalizedCache(str(tmp_path))
+    assert cache.digests() == [digest]
+    assert not cache.has('b' * 64 + PARTIAL_SUFFIX)
+    assert not cache.has('c' * 64)
@@ -0,0 +1,21 @@
+from Charge_Batches import ChargeBatches
+from Output_Sinks import NullSink
+
+
+def _batches(rows):
+    batches = ChargeBatches()
+    for i in range(rows):
+        batches.services.append((f"id{i}", "Outpatient", "99203", "Office visit", "CPT", None))
+    return batches
+
+
+def test_summary_is_per_hospital():
+    sink = NullSink()
+    summaries = []
+    for rows in (3, 2):
+        sink.begin_hospital({'hospital_name': f"Hospital {rows}"})
+        sink.write(_batches(rows))
+        summaries.append(sink.finish_hospital())
+
+    assert [summary['rows_discarded'] for summary in summaries] == [3, 2]
+    assert (sink.hospitals, sink.rows) == (2, 5)
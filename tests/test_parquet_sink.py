@@ -0,0 +1,44 @@
+import pytest
+
+from Charge_Batches import ChargeBatches
+from Output_Sinks import ParquetSink
+
+ds = pytest.importorskip("pyarrow.dataset")
+
+
+def _batches(gross):
+    batches = ChargeBatches()
+    batches.services.append(("id1", "Outpatient", "99203", "Office visit", "CPT", None))
+    batches.standard_charges.append(("id1", "Test Hospital", gross, None, None, None))
+    return batches
+
+
+def _load(sink, gross, fail=False):
+    sink.begin_hospital({'hospital_name': 'Test Hospital'})
+    sink.write(_batches(gross))
+    if fail:
+        sink.abort()
+    else:
+        sink.finish_hospital()
+
+
+def _gross(output_dir):
+    table = ds.dataset(str(output_dir / 'standard_charges'), partitioning='hive').to_table()
+    return table.column('standard_charge_gross').to_pylist()
+
+
+def test_failed_reload_keeps_previous_output(tmp_path):
+    sink = ParquetSink(str(tmp_path))
+    _load(sink, '100.00')
+    assert _gross(tmp_path) == [10000]
+
+    # Written, but not visible to readers until the reload finishes
+    sink.begin_hospital({'hospital_name': 'Test Hospital'})
+    sink.write(_batches('200.00'))
+    assert _gross(tmp_path) == [10000]
+    sink.abort()
+    assert _gross(tmp_path) == [10000]
+
+    _load(sink, '300.00')
+    assert _gross(tmp_path) == [30000]
+    assert sorted(p.name for p in (tmp_path / 'standard_charges').iterdir()) == ['hospital_name=Test%20Hospital']
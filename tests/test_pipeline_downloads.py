@@ -0,0 +1,27 @@
+import os
+
+from conftest import RecordingSink
+from Download_and_Process import pipeline_process
+from Local_MRF_Server import LocalMRFServer
+from Synthetic_MRF import generate_mrf
+
+
+def test_concurrent_downloads_with_the_same_filename(etl_cwd, tmp_path):
+    """Servers often all call their file standardcharges.csv; concurrent downloads must not clobber each other"""
+    names = [f"Hospital {i}" for i in range(4)]
+    download_dir = tmp_path / "downloads"
+    sink = RecordingSink()
+    with LocalMRFServer() as server:
+        urls = []
+        for i, name in enumerate(names):
+            path = str(tmp_path / f"mrf-{i}.csv")
+            generate_mrf(path, 'tall', items=50, seed=i, hospital_name=name)
+            with open(path, 'rb') as f:
+                urls.append(server.add_file(data=f.read(), filename='standardcharges.csv',
+                                            mode='zip' if i % 2 else 'plain'))
+        urls.append(server.add_file(data=b"truncated", filename='standardcharges.csv', mode='truncated'))
+        pipeline_process(urls, str(download_dir), max_buffered=2, target_extensions=['.csv'], sink=sink,
+                         download_workers=3)
+
+    assert sorted(hospital['hospital_name'] for hospital in sink.hospitals) == names
+    assert os.listdir(download_dir) == []
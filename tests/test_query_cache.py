@@ -0,0 +1,43 @@
+from Price_Queries import PriceQueries, QueryCache
+
+
+def test_invalidation_drops_tagged_entries():
+    cache = QueryCache()
+    cache.put('a', [1], hospitals=('Hospital A',))
+    cache.put('b', [2], codes=('470',))
+    cache.put('c', [3], codes=('99203',))
+    cache.put('d', [4], any_reload=True)
+
+    assert cache.invalidate_hospital('Hospital A', codes={'470'}) == 3
+    assert cache.get('c') == [3]
+
+
+def test_put_skipped_after_invalidation():
+    cache = QueryCache()
+    generation = cache.generation
+    cache.invalidate_hospital('Hospital A', codes={'470'})
+    cache.put('b', [2], codes=('470',), generation=generation)
+
+    assert cache.get('b') is None
+    assert cache.stats()['stale_puts'] == 1
+
+
+def test_reload_during_query_is_not_cached():
+    queries = PriceQueries(pool=object(), listen=False)
+    results = iter([[{'hospital_name': 'Hospital A', 'min_price': 100}],
+                    [{'hospital_name': 'Hospital A', 'min_price': 90}]])
+
+    def query(sql, params):
+        # A reload of Hospital A is announced while the first query runs
+        result = next(results)
+        if result[0]['min_price'] == 100:
+            queries.cache.invalidate_hospital('Hospital A', codes={'470'})
+        return result
+
+    queries._query = query
+    try:
+        assert queries.cheapest_hospitals('470', 'MS-DRG', 'Aetna')[0]['min_price'] == 100
+        assert queries.cheapest_hospitals('470', 'MS-DRG', 'Aetna')[0]['min_price'] == 90
+        assert queries.cheapest_hospitals('470', 'MS-DRG', 'Aetna')[0]['min_price'] == 90
+    finally:
+        queries.close()
@@ -0,0 +1,34 @@
+from Output_Sinks import NullSink
+from Read_Hospital_CSV import HospitalChargeETLCSV
+from Read_Hospital_JSON import HospitalChargeETLJSON
+from Synthetic_MRF import generate_mrf
+
+
+def _lookups(result):
+    cache = result['service_id_cache']
+    return cache['hits'] + cache['misses']
+
+
+def test_csv_stats_cover_one_file(etl_cwd):
+    file_path = str(etl_cwd / "tall.csv")
+    generate_mrf(file_path, 'tall', items=200, match_rate=0.5)
+
+    first = HospitalChargeETLCSV("", file_path, sink=NullSink()).execute()
+    second = HospitalChargeETLCSV("", file_path, sink=NullSink()).execute()
+
+    assert _lookups(first) > 0
+    # Not cumulative across files; the second run finds every id cached
+    assert _lookups(second) == _lookups(first)
+    assert second['service_id_cache']['misses'] == 0
+
+
+def test_json_stats_include_worker_processes(etl_cwd):
+    file_path = str(etl_cwd / "mrf.json")
+    generate_mrf(file_path, 'json', items=400, match_rate=0.5)
+
+    pooled = HospitalChargeETLJSON("", file_path, workers=2, shard_size=100, sink=NullSink()).execute()
+    sequential = HospitalChargeETLJSON("", file_path, sink=NullSink()).execute()
+
+    assert sequential['status'] == pooled['status'] == 'success'
+    assert _lookups(sequential) > 0
+    assert _lookups(pooled) == _lookups(sequential)